@@ -1,43 +1,242 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, send_file
 from flask_cors import CORS
 import logging
+import os
+import time
+import hmac
+import uuid
+import zipfile
+from functools import wraps
+from threading import Thread
 from datetime import datetime
 from dotenv import load_dotenv
 import config
 from utils.pdf_processor import PDFProcessor
 from utils.vector_store import VectorStoreService
 from utils.llm_service import LLMService
+from utils.llm_gateway import LLMGatewayError
+from utils.profiler import RequestProfiler
+from utils.deduplication import ChunkDeduplicator
+from utils.partition_cache import PartitionCache
+from utils.snapshot import SnapshotService, SnapshotError
+from utils.embedding_migration import EmbeddingMigration
+from utils import metrics
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag", "Last-Modified", "X-Next-Cursor", "X-Total-Count", "X-Profile-Id"])
+
+partition_cache = PartitionCache(
+    cache_path=config.PARTITION_CACHE_PATH,
+    max_bytes=config.PARTITION_CACHE_MAX_MB * 1024 * 1024
+)
 
 pdf_processor = PDFProcessor(
     pdf_storage_path=config.PDF_STORAGE_PATH,
     chunk_size=config.CHUNK_SIZE,
-    chunk_overlap=config.CHUNK_OVERLAP
+    chunk_overlap=config.CHUNK_OVERLAP,
+    stream_window_pages=config.STREAM_WINDOW_PAGES,
+    ocr_quality_threshold=config.OCR_TEXT_QUALITY_THRESHOLD,
+    ocr_min_page_chars=config.OCR_MIN_PAGE_CHARS,
+    partition_strategy=config.PARTITION_STRATEGY,
+    table_score_threshold=config.PARTITION_TABLE_THRESHOLD,
+    partition_page_timeout=config.PARTITION_PAGE_TIMEOUT,
+    partition_cache=partition_cache
+)
+
+deduplicator = ChunkDeduplicator(
+    index_path=config.DEDUP_INDEX_PATH,
+    threshold=config.DEDUP_THRESHOLD,
+    cross_corpus=config.DEDUP_CROSS_CORPUS,
+    corpus_min_files=config.DEDUP_CORPUS_MIN_FILES
 )
 
 vector_store = VectorStoreService(
     vector_db_path=config.VECTOR_DB_PATH,
-    model_name=config.HF_EMBEDDING_MODEL
+    model_name=config.HF_EMBEDDING_MODEL,
+    deduplicator=deduplicator,
+    partition_cache=partition_cache,
+    num_shards=config.VECTOR_DB_SHARDS,
+    hnsw_params={
+        "space": config.HNSW_SPACE,
+        "m": config.HNSW_M,
+        "construction_ef": config.HNSW_CONSTRUCTION_EF,
+        "search_ef": config.HNSW_SEARCH_EF
+    },
+    exact_search_max_chunks=config.EXACT_SEARCH_MAX_CHUNKS,
+    embedding_cache_max_chunks=config.EMBEDDING_CACHE_MAX_CHUNKS,
+    text_blob_path=config.TEXT_BLOB_PATH,
+    summary_index_path=config.FILE_SUMMARY_PATH,
+    two_level_min_files=config.TWO_LEVEL_MIN_FILES,
+    two_level_top_files=config.TWO_LEVEL_TOP_FILES,
+    embed_query_threads=config.EMBED_QUERY_THREADS,
+    embed_ingest_threads=config.EMBED_INGEST_THREADS,
+    embed_micro_batch_size=config.EMBED_MICRO_BATCH_SIZE,
+    expansion_mode=config.RETRIEVAL_EXPANSION,
+    expansion_neighbors=config.RETRIEVAL_NEIGHBOR_CHUNKS,
+    expansion_max_chunks=config.RETRIEVAL_EXPANSION_MAX_CHUNKS
 )
 
 llm_service = LLMService(
-    gemini_api_key=config.GEMINI_API_KEY
+    gemini_api_key=config.GEMINI_API_KEY,
+    gemini_api_endpoint=config.GEMINI_API_ENDPOINT,
+    context_token_budget=config.CONTEXT_TOKEN_BUDGET,
+    chars_per_token=config.CONTEXT_CHARS_PER_TOKEN,
+    gateway_options={
+        "max_concurrency": config.LLM_MAX_CONCURRENCY,
+        "max_queue": config.LLM_MAX_QUEUE,
+        "rate_per_second": config.LLM_RATE_LIMIT_PER_SECOND,
+        "rate_burst": config.LLM_RATE_BURST,
+        "max_retries": config.LLM_MAX_RETRIES,
+        "retry_base_delay": config.LLM_RETRY_BASE_DELAY,
+        "request_timeout": config.LLM_REQUEST_TIMEOUT
+    }
+)
+
+snapshot_service = SnapshotService(
+    vector_store=vector_store,
+    snapshot_storage_path=config.SNAPSHOT_STORAGE_PATH,
+    pdf_storage_path=config.PDF_STORAGE_PATH
+)
+
+# Re-embeds the stored chunks in the background when HF_EMBEDDING_MODEL changed, queries use the old model until then
+embedding_migration = EmbeddingMigration(
+    vector_store=vector_store,
+    batch_size=config.MIGRATION_BATCH_SIZE,
+    batch_delay=config.MIGRATION_BATCH_DELAY
+)
+if config.EMBEDDING_MIGRATION_AUTOSTART:
+    embedding_migration.start()
+
+request_profiler = RequestProfiler(
+    profile_storage_path=config.PROFILE_STORAGE_PATH,
+    max_profiles=config.PROFILE_MAX_FILES,
+    header_enabled=config.PROFILING_HEADER_ENABLED
 )
 
 """
 The flask backend has the following routes:
 1. /api/upload: Upload a PDF file and process it. (use the pdf_processor to extract text and chunk it)
 2. /api/chat: Send a message to the LLM and get a response based on the uploaded files.
-3. /api/files: Get a list of all uploaded files. (to display on the side collumn)
+3. /api/files: Get a page of the uploaded files (to display on the side collumn), supports cursor, limit, sort, order and q.
 4. /api/files/<file_id>: Delete a file from storage and vector database.
+5. /api/metrics: Expose the pipeline metrics in Prometheus text format.
+6. /api/ingestion: Progress of the streaming ingestions currently running.
+7. /api/chat/batch: Answer many questions against the same files in one request.
+8. /api/admin/profiling and /api/admin/profiles: Toggle request profiling, list and download stored profiles.
+9. /api/admin/snapshots: Export, list, download and import index snapshots (chunks + embeddings + metadata).
+10. /api/admin/embedding-migration: Progress of the embedding model migration, start it and drop the replaced collection.
 """
 
+def profiled(endpoint):
+    # Runs the view under the request profiler when the request asks for it (header) or profiling is armed
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            header_requested = request.headers.get("X-Profile-Request", "").lower() in ("1", "true")
+            if not request_profiler.should_profile(header_requested):
+                return view(*args, **kwargs)
+            
+            result, profile_name = request_profiler.run(endpoint, view, *args, **kwargs)
+            response = app.make_response(result)
+            if profile_name:
+                response.headers["X-Profile-Id"] = profile_name
+            return response
+        return wrapper
+    return decorator
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not config.ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints are disabled"}), 403
+        token = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token, config.ADMIN_TOKEN):
+            return jsonify({"error": "Invalid admin token"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or "unknown"
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_latency(response):
+    if "request_start" in g:
+        elapsed = time.perf_counter() - g.request_start
+        metrics.REQUEST_LATENCY.observe(elapsed, endpoint=g.metrics_endpoint, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request(exc=None):
+    if "metrics_endpoint" in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+
+def use_streaming_ingestion(file_info, processing_method):
+    # Only the standard method can stream, it is used when asked for or when the PDF is large
+    if processing_method != "standard":
+        return False
+    if request.form.get('stream', '').lower() == 'true':
+        return True
+    try:
+        return pdf_processor.count_pages(file_info["path"]) >= config.STREAMING_INGEST_MIN_PAGES
+    except Exception as e:
+        logger.error(f"Error counting pages of {file_info['name']}: {e}")
+        return False
+
+def ingest_file(file_info, processing_method, stream):
+    # Chunk a saved PDF and index it, used by uploads and to resume interrupted ingestions
+    if stream:
+        # Large PDFs are read in page windows and indexed batch by batch
+        chunk_records, updated_file_info = pdf_processor.process_pdf_stream(file_info)
+        vector_store.add_file_stream(updated_file_info, chunk_records, batch_size=config.INGEST_BATCH_SIZE)
+        return updated_file_info
+    
+    # Process the PDF with the specified method
+    chunks, chunk_page_map, updated_file_info = pdf_processor.process_pdf(file_info, processing_method)
+    
+    # Add to vector store
+    if chunks and updated_file_info["status"] == "processed":
+        signatures = None
+        if config.DEDUP_ENABLED:
+            # Drop near-duplicate chunks (repeated headers, footers, boilerplate) before embedding them
+            with metrics.track_stage("upload", "deduplicate"):
+                chunks, chunk_page_map, signatures, dedup_stats = deduplicator.deduplicate(
+                    updated_file_info["id"], chunks, chunk_page_map
+                )
+            updated_file_info["dedup"] = {
+                "chunksIn": dedup_stats["chunksIn"],
+                "chunksDropped": dedup_stats["chunksDropped"],
+                "charsSaved": dedup_stats["charsSaved"]
+            }
+        
+        if vector_store.add_file(updated_file_info, chunks, chunk_page_map, batch_size=config.INGEST_BATCH_SIZE) and signatures:
+            deduplicator.add_to_corpus(updated_file_info["id"], signatures)
+    return updated_file_info
+
+def resume_interrupted_ingestions():
+    # Ingestions cut short by a crash or restart left a checkpoint, finish them from the saved PDF
+    for checkpoint in vector_store.pending_ingestions():
+        file_info = checkpoint["fileInfo"]
+        if not os.path.exists(file_info.get("path", "")):
+            logger.warning(f"PDF of interrupted ingestion {file_info['id']} is gone, discarding it")
+            vector_store.discard_ingestion(file_info["id"])
+            continue
+        logger.info(f"Resuming interrupted ingestion of {file_info['name']} ({file_info['id']})")
+        try:
+            ingest_file(file_info, file_info.get("processing_method", "standard"), checkpoint.get("mode") == "stream")
+        except Exception as e:
+            logger.error(f"Error resuming ingestion of {file_info['id']}: {e}")
+
+if config.RESUME_INGESTIONS_ON_STARTUP:
+    Thread(target=resume_interrupted_ingestions, daemon=True).start()
+
 @app.route('/api/upload', methods=['POST'])
+@profiled("upload")
 def upload_pdf():
     # We will first save the pdf, update metadata, extarct chunks, and chunk mapping, and add those to the vector store
     try:
@@ -60,15 +259,11 @@ def upload_pdf():
         logger.info(f"Using processing method: {processing_method}")
         
         # Save the file and get basic info
-        file_info = pdf_processor.save_pdf(pdf_file)
+        with metrics.track_stage("upload", "save"):
+            file_info = pdf_processor.save_pdf(pdf_file)
         file_info['dateUploaded'] = datetime.now().isoformat()
         
-        # Process the PDF with the specified method
-        chunks, chunk_page_map, updated_file_info = pdf_processor.process_pdf(file_info, processing_method)
-        
-        # Add to vector store
-        if chunks and updated_file_info["status"] == "processed":
-            vector_store.add_file(updated_file_info, chunks, chunk_page_map)
+        updated_file_info = ingest_file(file_info, processing_method, use_streaming_ingestion(file_info, processing_method))
         
         # Return file info to client
         return jsonify({
@@ -79,7 +274,10 @@ def upload_pdf():
                 "pages": updated_file_info.get("pages", 0),
                 "processed": updated_file_info["status"] == "processed",
                 "error": updated_file_info.get("error", None),
-                "method": updated_file_info.get("processing_method", "standard")
+                "method": updated_file_info.get("processing_method", "standard"),
+                "ocrPages": updated_file_info.get("ocr_pages", []),
+                "partitionPages": updated_file_info.get("partition_pages", []),
+                "duplicatesRemoved": updated_file_info.get("dedup", {}).get("chunksDropped", 0)
             }
         })
     
@@ -87,7 +285,13 @@ def upload_pdf():
         logger.error(f"Error uploading file: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/ingestion', methods=['GET'])
+def get_ingestion_progress():
+    # Progress of the streaming ingestions currently running
+    return jsonify(list(vector_store.ingestion_progress.values()))
+
 @app.route('/api/chat', methods=['POST'])
+@profiled("chat")
 def chat():
     try:
         # Get request data
@@ -97,12 +301,55 @@ def chat():
         
         message = data.get('message', '')
         file_ids = data.get('fileIds', [])
+        include_timings = data.get('includeTimings', config.CHAT_INCLUDE_TIMINGS)
         logger.info(f"Chat request with file ids: {file_ids}") 
         
         if not message:
             return jsonify({"error": "No message provided"}), 400
         
-        # Check if file IDs exist in the vector store
+        with metrics.collect_timings() as timings:
+            response = answer_chat(message, file_ids)
+        
+        if include_timings:
+            response["timings"] = timings
+        
+        return jsonify(response)
+    
+    except LLMGatewayError as e:
+        logger.warning(f"Chat request rejected by the LLM gateway: {e}")
+        return llm_overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error processing chat request: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "text": f"Error processing your request: {str(e)}",
+            "sources": []
+        }), 500
+
+# Chat responses that don't go through the LLM
+NO_VALID_DOCUMENTS_RESPONSE = {
+    "text": "No valid documents selected. Please upload and select at least one document.",
+    "sources": []
+}
+NO_CONTEXT_RESPONSE = {
+    "text": "I couldn't find any relevant information in your documents to answer this question.",
+    "sources": []
+}
+
+def llm_overloaded_response(error):
+    # The LLM is saturated: tell the client to retry instead of returning a generic error
+    response = jsonify({
+        "text": "The assistant is handling too many requests right now. Please try again in a moment.",
+        "sources": [],
+        "error": str(error)
+    })
+    response.headers["Retry-After"] = "5"
+    return response, error.status
+
+def validate_file_ids(file_ids):
+    # Keep only the file IDs that exist in the vector store
+    with metrics.track_stage("chat", "file_validation"):
         valid_file_ids = []
         for file_id in file_ids:
             metadata = vector_store.get_file_metadata(file_id)
@@ -111,46 +358,103 @@ def chat():
                 logger.info(f"Valid file found: {file_id} - {metadata.get('name', 'unknown')}")
             else:
                 logger.warning(f"File ID not found in vector store: {file_id}")
+        return valid_file_ids
+
+def retrieve_context(message, file_ids):
+    # Validates the selection and queries the vector store, returns (context_docs, early_response)
+    valid_file_ids = validate_file_ids(file_ids)
+    
+    # Require valid documents
+    if not valid_file_ids:
+        logger.warning("No valid documents found in request")
+        return [], dict(NO_VALID_DOCUMENTS_RESPONSE)
+    
+    # Query vector store
+    context_docs = vector_store.query(message, valid_file_ids)
+    logger.info(f"Retrieved {len(context_docs)} context documents from query")
+    
+    if not context_docs:
+        logger.warning("No context found for query")
+        return [], dict(NO_CONTEXT_RESPONSE)
+    
+    return context_docs, None
+
+def answer_chat(message, file_ids):
+    # Runs the retrieval and generation steps of a chat request and returns the response body
+    context_docs, early_response = retrieve_context(message, file_ids)
+    if early_response:
+        return early_response
+    
+    # Generate response
+    return llm_service.generate_response(message, context_docs)
+    
+@app.route('/api/chat/batch', methods=['POST'])
+@profiled("chat_batch")
+def chat_batch():
+    # Answers many questions against the same selection: one embedding call, one search call, batched generation
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
         
-        # Require valid documents
-        if not valid_file_ids:
-            logger.warning("No valid documents found in request")
-            return jsonify({
-                "text": "No valid documents selected. Please upload and select at least one document.",
-                "sources": []
-            })
+        questions = data.get('questions', [])
+        file_ids = data.get('fileIds', [])
+        include_timings = data.get('includeTimings', config.CHAT_INCLUDE_TIMINGS)
         
-        # Query vector store
-        context_docs = vector_store.query(message, valid_file_ids)
-        logger.info(f"Retrieved {len(context_docs)} context documents from query")
+        if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+            return jsonify({"error": "questions must be a non-empty list of strings"}), 400
+        if len(questions) > config.BATCH_MAX_QUESTIONS:
+            return jsonify({"error": f"Too many questions, the limit is {config.BATCH_MAX_QUESTIONS}"}), 400
         
-        if not context_docs:
-            logger.warning("No context found for query")
-            return jsonify({
-                "text": "I couldn't find any relevant information in your documents to answer this question.",
-                "sources": []
-            })
+        logger.info(f"Batch chat request with {len(questions)} questions and file ids: {file_ids}")
         
-        # Generate response
-        response = llm_service.generate_response(message, context_docs)
+        with metrics.collect_timings() as timings:
+            valid_file_ids = validate_file_ids(file_ids)
+            if not valid_file_ids:
+                logger.warning("No valid documents found in batch request")
+                responses = [dict(NO_VALID_DOCUMENTS_RESPONSE) for _ in questions]
+            else:
+                context_docs_list = vector_store.query_batch(questions, valid_file_ids)
+                responses = llm_service.generate_batch(
+                    questions,
+                    context_docs_list,
+                    max_concurrency=config.BATCH_MAX_CONCURRENCY
+                )
         
-        return jsonify(response)
+        result = {
+            "results": [
+                {"question": question, **response}
+                for question, response in zip(questions, responses)
+            ]
+        }
+        if include_timings:
+            result["timings"] = timings
+        
+        return jsonify(result)
     
     except Exception as e:
-        logger.error(f"Error processing chat request: {e}")
+        logger.error(f"Error processing batch chat request: {e}")
         import traceback
         logger.error(traceback.format_exc())
-        return jsonify({
-            "text": f"Error processing your request: {str(e)}",
-            "sources": []
-        }), 500
-    
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/files', methods=['GET'])
 def get_files():
-    #This returns a list of all files in the vector store, along with their metadata
+    # This returns a page of the files in the vector store, along with their metadata
     # This is useful for the frontend to show the files in the side column and for the querying process
+    # Listing is read-only: it doesn't count as an access, and polling clients get 304s through ETag/Last-Modified
     try:
-        files = vector_store.get_file_metadata()
+        limit = min(max(request.args.get('limit', config.FILES_PAGE_SIZE, type=int), 1), config.FILES_MAX_PAGE_SIZE)
+        try:
+            files, next_cursor, total = vector_store.list_files(
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                sort=request.args.get('sort', 'dateUploaded'),
+                order=request.args.get('order', 'desc'),
+                name_filter=request.args.get('q')
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Format for frontend
         formatted_files = []
@@ -159,10 +463,22 @@ def get_files():
                 "id": file["id"],
                 "name": file["name"],
                 "size": file["size"],
-                "dateUploaded": file.get("dateUploaded", "")
+                "dateUploaded": file.get("dateUploaded", ""),
+                "method": file.get("processing_method", "standard")
             })
         
-        return jsonify(formatted_files)
+        # The body stays a plain list, pagination details go in headers
+        response = jsonify(formatted_files)
+        response.headers["X-Total-Count"] = str(total)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Cache-Control"] = "no-cache"
+        response.last_modified = vector_store.metadata_updated_at
+        response.add_etag()
+        response = response.make_conditional(request)
+        
+        metrics.CACHE_EVENTS.inc(cache="files_listing", result="hit" if response.status_code == 304 else "miss")
+        return response
     
     except Exception as e:
         logger.error(f"Error getting files: {e}")
@@ -193,6 +509,131 @@ def delete_file(file_id):
         logger.error(f"Error deleting file: {e}")
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # Gauges that describe the stored data are refreshed at scrape time
+    try:
+        metrics.COLLECTION_SIZE.set(vector_store.collection_count())
+        metrics.STORED_FILES.set(len(vector_store.file_metadata))
+    except Exception as e:
+        logger.error(f"Error refreshing storage gauges: {e}")
+    
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def profiling_settings():
+    # POST {"headerEnabled": bool, "armedRequests": int} to change the profiling toggles
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            return jsonify(request_profiler.configure(
+                header_enabled=data.get("headerEnabled"),
+                armed_requests=data.get("armedRequests")
+            ))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid profiling settings: {e}"}), 400
+    
+    return jsonify(request_profiler.status())
+
+@app.route('/api/admin/embedding-migration', methods=['GET', 'POST'])
+@admin_required
+def embedding_migration_status():
+    # POST starts the migration when it isn't running (e.g. after a failure or with autostart disabled)
+    if request.method == 'POST':
+        started = embedding_migration.start()
+        return jsonify({**embedding_migration.status(), "started": started}), 202 if started else 200
+    return jsonify(embedding_migration.status())
+
+@app.route('/api/admin/embedding-migration/previous', methods=['DELETE'])
+@admin_required
+def drop_previous_collection():
+    if embedding_migration.progress.get("state") == "running":
+        return jsonify({"error": "A migration is running"}), 409
+    try:
+        dropped = vector_store.drop_previous_collection()
+    except Exception as e:
+        logger.error(f"Error dropping the previous collection: {e}")
+        return jsonify({"error": str(e)}), 500
+    if not dropped:
+        return jsonify({"error": "No previous collection to drop"}), 404
+    return jsonify({"dropped": dropped})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    return jsonify(request_profiler.list_profiles())
+
+@app.route('/api/admin/profiles/<profile_name>', methods=['GET'])
+@admin_required
+def download_profile(profile_name):
+    # ?format=text returns a pstats report, otherwise the raw cProfile dump is downloaded
+    if request.args.get("format") == "text":
+        report = request_profiler.render_profile(
+            profile_name,
+            sort_by=request.args.get("sort", "cumulative"),
+            limit=request.args.get("limit", 50, type=int)
+        )
+        if report is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return Response(report, mimetype="text/plain")
+    
+    path = request_profiler.get_profile_path(profile_name)
+    if not path:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, as_attachment=True, download_name=profile_name)
+
+@app.route('/api/admin/snapshots', methods=['GET', 'POST'])
+@admin_required
+def snapshots():
+    # POST {"fileIds": [...]} exports the given files (all files when omitted) into a new snapshot
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            archive_path = snapshot_service.export_snapshot(file_ids=data.get("fileIds"))
+        except SnapshotError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error exporting snapshot: {e}")
+            return jsonify({"error": str(e)}), 500
+        return jsonify({"name": os.path.basename(archive_path), "size": os.path.getsize(archive_path)})
+    
+    return jsonify(snapshot_service.list_snapshots())
+
+@app.route('/api/admin/snapshots/<snapshot_name>', methods=['GET'])
+@admin_required
+def download_snapshot(snapshot_name):
+    path = snapshot_service.get_snapshot_path(snapshot_name)
+    if not path:
+        return jsonify({"error": "Snapshot not found"}), 404
+    return send_file(path, as_attachment=True, download_name=snapshot_name)
+
+@app.route('/api/admin/snapshots/import', methods=['POST'])
+@admin_required
+def import_snapshot():
+    # Import an uploaded archive ("snapshot" file field) or a stored one ("name" field)
+    overwrite = request.form.get('overwrite', '').lower() == 'true'
+    temp_path = None
+    try:
+        if 'snapshot' in request.files:
+            temp_path = os.path.join(config.SNAPSHOT_STORAGE_PATH, f"import_{uuid.uuid4().hex}.zip")
+            request.files['snapshot'].save(temp_path)
+            archive_path = temp_path
+        else:
+            archive_path = snapshot_service.get_snapshot_path(request.form.get('name', ''))
+            if not archive_path:
+                return jsonify({"error": "Snapshot not found"}), 404
+        
+        return jsonify(snapshot_service.import_snapshot(archive_path, overwrite=overwrite))
+    except (SnapshotError, zipfile.BadZipFile) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error importing snapshot: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
 @app.route('/')
 def index():
     return jsonify({"message": "PDF Q&A API is running", "status": "ok"})
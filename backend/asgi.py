@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+import config
+from app import app as flask_app, retrieve_context, llm_service
+from utils.llm_gateway import LLMGatewayError
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Async serving mode for the backend. Run it with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+/api/chat is handled natively on the event loop: retrieval (query embedding and vector search) runs on a
+bounded thread pool and generation uses the chat model's async invoke, so a chat waiting on Gemini doesn't
+hold a worker thread. Every other route is served by the Flask app through a WSGI adapter, so the JSON
+contract of the API is the same in both modes. (Request profiling is only available on the Flask routes.)
+"""
+
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=config.ASYNC_RETRIEVAL_WORKERS,
+    thread_name_prefix="retrieval"
+)
+
+async def run_in_retrieval_pool(func, *args):
+    # Copy the context so stage timings recorded in the pool end up in this request's breakdown
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(retrieval_executor, context.run, func, *args)
+
+async def chat_endpoint(request):
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint="chat")
+    start = time.perf_counter()
+    status = 200
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data:
+            status = 400
+            return JSONResponse({"error": "No data provided"}, status_code=status)
+
+        message = data.get('message', '')
+        file_ids = data.get('fileIds', [])
+        include_timings = data.get('includeTimings', config.CHAT_INCLUDE_TIMINGS)
+        logger.info(f"Async chat request with file ids: {file_ids}")
+
+        if not message:
+            status = 400
+            return JSONResponse({"error": "No message provided"}, status_code=status)
+
+        with metrics.collect_timings() as timings:
+            context_docs, response = await run_in_retrieval_pool(retrieve_context, message, file_ids)
+            if response is None:
+                response = await llm_service.agenerate_response(message, context_docs)
+
+        if include_timings:
+            response["timings"] = timings
+
+        return JSONResponse(response)
+
+    except LLMGatewayError as e:
+        logger.warning(f"Async chat request rejected by the LLM gateway: {e}")
+        status = e.status
+        return JSONResponse({
+            "text": "The assistant is handling too many requests right now. Please try again in a moment.",
+            "sources": [],
+            "error": str(e)
+        }, status_code=status, headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error(f"Error processing async chat request: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        status = 500
+        return JSONResponse({
+            "text": f"Error processing your request: {str(e)}",
+            "sources": []
+        }, status_code=status)
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(endpoint="chat")
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint="chat", status=status)
+
+async def chat_app(scope, receive, send):
+    # Plain ASGI wrapper so the route can be wrapped in its own CORS middleware
+    request = Request(scope, receive)
+    if request.method != "POST":
+        response = JSONResponse({"error": "Method not allowed"}, status_code=405)
+    else:
+        response = await chat_endpoint(request)
+    await response(scope, receive, send)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    retrieval_executor.shutdown(wait=False)
+
+# Flask-CORS handles the mounted Flask routes, the native chat route needs its own CORS handling
+app = Starlette(
+    routes=[
+        Route("/api/chat", endpoint=CORSMiddleware(chat_app, allow_origins=["*"], allow_methods=["POST"], allow_headers=["*"])),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
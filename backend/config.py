@@ -9,21 +9,137 @@ DEBUG = os.getenv("DEBUG", "True").lower() == "true"
 PORT = int(os.getenv("PORT", "5000"))
 HOST = os.getenv("HOST", "0.0.0.0")
 
+# Async (ASGI) serving configuration: threads used for retrieval by the async chat route
+ASYNC_RETRIEVAL_WORKERS = int(os.getenv("ASYNC_RETRIEVAL_WORKERS", "8"))
+
 # Storage paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-PDF_STORAGE_PATH = os.path.join(BASE_DIR, "storage", "pdfs")
-VECTOR_DB_PATH = os.path.join(BASE_DIR, "storage", "vectors")
+STORAGE_PATH = os.getenv("STORAGE_PATH", os.path.join(BASE_DIR, "storage"))  # loadtest.py points this to a temp dir
+PDF_STORAGE_PATH = os.path.join(STORAGE_PATH, "pdfs")
+VECTOR_DB_PATH = os.path.join(STORAGE_PATH, "vectors")
+PROFILE_STORAGE_PATH = os.path.join(STORAGE_PATH, "profiles")
+DEDUP_INDEX_PATH = os.path.join(VECTOR_DB_PATH, "dedup")
+TEXT_BLOB_PATH = os.path.join(VECTOR_DB_PATH, "text_blobs")
+FILE_SUMMARY_PATH = os.path.join(VECTOR_DB_PATH, "file_summaries")
+SNAPSHOT_STORAGE_PATH = os.path.join(STORAGE_PATH, "snapshots")
+PARTITION_CACHE_PATH = os.path.join(STORAGE_PATH, "partition_cache")
 
 # Create directories if they don't exist
 os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
 os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+os.makedirs(PROFILE_STORAGE_PATH, exist_ok=True)
+os.makedirs(SNAPSHOT_STORAGE_PATH, exist_ok=True)
 
 # API Keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Alternative Gemini API endpoint (host:port or URL, REST transport), e.g. the local stub of loadtest.py
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
+
+# Number of vector store shards (files are assigned by consistent hashing, run manage.py rebalance-shards after changing it)
+VECTOR_DB_SHARDS = int(os.getenv("VECTOR_DB_SHARDS", "1"))
+
+# HNSW index parameters, applied when a shard's collection is created (empty/0 keeps Chroma's defaults)
+# space, M and construction_ef are fixed at creation, search_ef can be changed on an existing collection
+HNSW_SPACE = os.getenv("HNSW_SPACE", "")  # l2, cosine or ip
+HNSW_M = int(os.getenv("HNSW_M", "0"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "0"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "0"))
+
+# Filtered queries whose selected files hold at most this many chunks (per shard) are scored exactly from cached
+# embeddings instead of going through HNSW (0 disables the fast path)
+EXACT_SEARCH_MAX_CHUNKS = int(os.getenv("EXACT_SEARCH_MAX_CHUNKS", "1000"))
+EMBEDDING_CACHE_MAX_CHUNKS = int(os.getenv("EMBEDDING_CACHE_MAX_CHUNKS", "50000"))
+
+# Two-level retrieval: queries selecting at least TWO_LEVEL_MIN_FILES files rank them by their summary vector
+# and only search the chunks of the TWO_LEVEL_TOP_FILES best ones (0 disables)
+TWO_LEVEL_MIN_FILES = int(os.getenv("TWO_LEVEL_MIN_FILES", "12"))
+TWO_LEVEL_TOP_FILES = int(os.getenv("TWO_LEVEL_TOP_FILES", "6"))
+
+# Small-to-big retrieval: search small chunks, then expand every hit to RETRIEVAL_NEIGHBOR_CHUNKS chunks on each side
+# ("neighbors") or to every chunk of its pages ("page"), read from the text blobs ("none" disables). With expansion
+# CHUNK_SIZE can be kept small for matching precision, the LLM still gets the surrounding context
+RETRIEVAL_EXPANSION = os.getenv("RETRIEVAL_EXPANSION", "neighbors")
+RETRIEVAL_NEIGHBOR_CHUNKS = int(os.getenv("RETRIEVAL_NEIGHBOR_CHUNKS", "1"))
+# Most chunks one hit is expanded to, so a hit on a long page doesn't pull in the whole page (0 disables the cap)
+RETRIEVAL_EXPANSION_MAX_CHUNKS = int(os.getenv("RETRIEVAL_EXPANSION_MAX_CHUNKS", "8"))
 
 # HuggingFace embedding model
 HF_EMBEDDING_MODEL = os.getenv("HF_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# When HF_EMBEDDING_MODEL differs from the model of the stored vectors, they are re-embedded into a new collection
+# in the background (MIGRATION_BATCH_SIZE chunks per batch, MIGRATION_BATCH_DELAY seconds between batches)
+EMBEDDING_MIGRATION_AUTOSTART = os.getenv("EMBEDDING_MIGRATION_AUTOSTART", "True").lower() == "true"
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "64"))
+MIGRATION_BATCH_DELAY = float(os.getenv("MIGRATION_BATCH_DELAY", "0.5"))
+# Query embeddings are scheduled before ingestion batches, which are embedded EMBED_MICRO_BATCH_SIZE chunks at a time
+# so a query waits for at most one micro-batch. Torch intra-op threads per class of work (0 keeps the torch default)
+EMBED_MICRO_BATCH_SIZE = int(os.getenv("EMBED_MICRO_BATCH_SIZE", "16"))
+EMBED_QUERY_THREADS = int(os.getenv("EMBED_QUERY_THREADS", "0"))
+EMBED_INGEST_THREADS = int(os.getenv("EMBED_INGEST_THREADS", "0"))
 
 # PDF processing configuration
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
\ No newline at end of file
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# Near-duplicate chunk suppression before indexing (MinHash/LSH)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "True").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # Estimated Jaccard similarity of word shingles
+# Also drop chunks that are boilerplate shared with at least DEDUP_CORPUS_MIN_FILES other files
+DEDUP_CROSS_CORPUS = os.getenv("DEDUP_CROSS_CORPUS", "False").lower() == "true"
+DEDUP_CORPUS_MIN_FILES = int(os.getenv("DEDUP_CORPUS_MIN_FILES", "3"))
+
+# Layout processing: a page's text layer is used instead of OCR when its quality score (0-1) reaches the threshold
+OCR_TEXT_QUALITY_THRESHOLD = float(os.getenv("OCR_TEXT_QUALITY_THRESHOLD", "0.6"))
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "50"))
+
+# Semantic processing: "auto" pre-scans the text layer and partitions prose pages with the fast strategy, table-like
+# pages (table score 0-1 at least PARTITION_TABLE_THRESHOLD) with hi_res and scanned pages with ocr_only.
+# fast, hi_res or ocr_only force one strategy. Page ranges taking over PARTITION_PAGE_TIMEOUT seconds per page
+# fall back to the text layer (0 disables the budget). Partitioned pages are cached in PARTITION_CACHE_PATH
+PARTITION_STRATEGY = os.getenv("PARTITION_STRATEGY", "auto")
+PARTITION_TABLE_THRESHOLD = float(os.getenv("PARTITION_TABLE_THRESHOLD", "0.3"))
+PARTITION_PAGE_TIMEOUT = float(os.getenv("PARTITION_PAGE_TIMEOUT", "30"))
+PARTITION_CACHE_MAX_MB = int(os.getenv("PARTITION_CACHE_MAX_MB", "512"))  # Least recently used documents are evicted
+
+# Streaming ingestion: standard uploads with at least this many pages are read in page windows
+# and indexed in fixed-size batches, so memory depends on the window size instead of the document size
+STREAMING_INGEST_MIN_PAGES = int(os.getenv("STREAMING_INGEST_MIN_PAGES", "300"))
+STREAM_WINDOW_PAGES = int(os.getenv("STREAM_WINDOW_PAGES", "20"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# Finish ingestions interrupted by a crash or restart (they left a checkpoint) in the background at startup.
+# With several workers, enable it on one of them only.
+RESUME_INGESTIONS_ON_STARTUP = os.getenv("RESUME_INGESTIONS_ON_STARTUP", "True").lower() == "true"
+
+# Prompt context configuration
+# Maximum (estimated) number of tokens of retrieved context sent to the LLM
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_CHARS_PER_TOKEN = int(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+# LLM gateway configuration (applies to every Gemini call)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_RATE_LIMIT_PER_SECOND = float(os.getenv("LLM_RATE_LIMIT_PER_SECOND", "0"))  # 0 disables the rate limiter
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# /api/files pagination
+FILES_PAGE_SIZE = int(os.getenv("FILES_PAGE_SIZE", "100"))
+FILES_MAX_PAGE_SIZE = int(os.getenv("FILES_MAX_PAGE_SIZE", "500"))
+
+# Batch question API configuration
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# Metrics configuration
+# When enabled, every chat response carries a per stage timing breakdown (clients can also ask for it per request)
+CHAT_INCLUDE_TIMINGS = os.getenv("CHAT_INCLUDE_TIMINGS", "False").lower() == "true"
+
+# Request profiling configuration
+# Requests sending the X-Profile-Request header are profiled only when header profiling is enabled
+PROFILING_HEADER_ENABLED = os.getenv("PROFILING_HEADER_ENABLED", "False").lower() == "true"
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "20"))
+
+# Token required in the X-Admin-Token header by the admin endpoints (admin endpoints are disabled when empty)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
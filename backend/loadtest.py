@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import argparse
+import logging
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Load test for /api/chat and /api/upload, run from the backend directory:
+    python loadtest.py --rate 5 --duration 60 --upload-ratio 0.1
+
+1. A local HTTP stub of the Gemini generateContent endpoint is started, with configurable latency and failure rate.
+2. The backend is started (Flask or the ASGI server) with GEMINI_API_ENDPOINT pointing to the stub and its storage in
+   a temporary directory, unless --base-url points to an already running backend (started with GEMINI_API_ENDPOINT
+   set to the stub address printed at startup).
+3. A corpus of generated PDFs is uploaded, then chat and upload requests are sent at the target rate for the duration.
+4. p50/p95/p99 latency, error rate and throughput are reported per endpoint.
+
+Requests are scheduled open loop: latency is measured from the time a request was due, not from when a worker picked
+it up, so a saturated backend shows up as growing latency instead of a silently lower request rate.
+"""
+
+WORDS = (
+    "system data model index query vector latency throughput document page chunk embedding retrieval cache "
+    "storage network request response server client memory disk thread process batch stream shard replica "
+    "policy contract invoice report analysis revenue budget forecast quarter customer supplier schedule risk"
+).split()
+
+
+def generate_text(rng, words):
+    sentences = []
+    while sum(len(s) for s in sentences) < words * 6:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+        sentences.append(sentence.capitalize() + ".")
+    return " ".join(sentences)
+
+
+def make_pdf(pages, line_chars=90, lines_per_page=50):
+    """Minimal PDF (Helvetica text only) with one page per string, readable by pypdf"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for text in pages:
+        words, lines, line = text.split(), [], ""
+        for word in words:
+            if len(line) + len(word) + 1 > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.append(line)
+        commands = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in lines[:lines_per_page]:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            commands.append(f"({escaped}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands)
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return output
+
+
+class GeminiStub:
+    """Local stand-in for the Gemini REST API, answers generateContent after a random latency"""
+
+    def __init__(self, port=0, latency_ms=800, jitter_ms=400, failure_rate=0.0, failure_status=503, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Gemini stub listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _next_call(self):
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            return delay, failed
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request_body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                if not self.path.split("?")[0].endswith(":generateContent"):
+                    self._send(404, {"error": {"code": 404, "message": f"Not found: {self.path}", "status": "NOT_FOUND"}})
+                    return
+
+                delay, failed = stub._next_call()
+                time.sleep(delay)
+                if failed:
+                    status = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL"}.get(stub.failure_status, "UNAVAILABLE")
+                    self._send(stub.failure_status, {"error": {
+                        "code": stub.failure_status, "message": "Stub failure", "status": status
+                    }})
+                    return
+
+                prompt_tokens = max(1, len(request_body) // 4)
+                answer = "This is a stub answer from the load test Gemini endpoint. " * 4
+                self._send(200, {
+                    "candidates": [{
+                        "content": {"parts": [{"text": answer}], "role": "model"},
+                        "finishReason": "STOP",
+                        "index": 0
+                    }],
+                    "usageMetadata": {
+                        "promptTokenCount": prompt_tokens,
+                        "candidatesTokenCount": len(answer) // 4,
+                        "totalTokenCount": prompt_tokens + len(answer) // 4
+                    }
+                })
+
+        return Handler
+
+
+def http_request(method, url, body=None, headers=None, timeout=120):
+    """Returns (status, parsed JSON body or None), HTTP errors are returned, not raised"""
+    request = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, data = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, data = e.code, e.read()
+    try:
+        return status, json.loads(data) if data else None
+    except ValueError:
+        return status, None
+
+
+def post_json(url, payload, timeout=120):
+    return http_request("POST", url, json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json"}, timeout)
+
+
+def post_pdf(url, filename, pdf_bytes, fields=None, timeout=300):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="pdf"; filename="{filename}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'.encode("utf-8") + pdf_bytes + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    return http_request("POST", url, b"".join(parts), headers, timeout)
+
+
+def start_backend(args, stub_url, storage_path):
+    env = dict(
+        os.environ,
+        GEMINI_API_KEY="loadtest",
+        GEMINI_API_ENDPOINT=stub_url,
+        STORAGE_PATH=storage_path,
+        PORT=str(args.port),
+        HOST="127.0.0.1",
+        DEBUG="False",
+        PYTHONUNBUFFERED="1"
+    )
+    if args.server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(args.port),
+                   "--workers", str(args.workers)]
+    else:
+        command = [sys.executable, "app.py"]
+    log_path = os.path.join(storage_path, "backend.log")
+    log_file = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    # Model loading takes a while, wait for the index route to answer
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}, see {log_path}")
+        try:
+            if http_request("GET", base_url + "/", timeout=2)[0] == 200:
+                logger.info(f"Backend ({args.server}) is up on {base_url}, logs in {log_path}")
+                return process, base_url
+        except OSError:
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError(f"Backend did not start within {args.startup_timeout}s, see {log_path}")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    # Nearest rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, base_url, rate, duration, upload_ratio, concurrency, pages_per_upload, seed=0):
+        self.base_url = base_url
+        self.rate = rate
+        self.duration = duration
+        self.upload_ratio = upload_ratio
+        self.pages_per_upload = pages_per_upload
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest")
+        self.rng = random.Random(seed)
+        self.file_ids = []
+        self.results = []  # (endpoint, status, latency seconds)
+        self._lock = threading.Lock()
+
+    def _upload(self, name):
+        pdf = make_pdf([generate_text(self.rng, 350) for _ in range(self.pages_per_upload)])
+        status, body = post_pdf(self.base_url + "/api/upload", name, pdf)
+        if status == 200 and body and body.get("fileId"):
+            with self._lock:
+                self.file_ids.append(body["fileId"])
+        return status
+
+    def _chat(self):
+        with self._lock:
+            file_ids = self.rng.sample(self.file_ids, min(len(self.file_ids), self.rng.randint(1, 3)))
+        question = f"What does the document say about {self.rng.choice(WORDS)} and {self.rng.choice(WORDS)}?"
+        status, _ = post_json(self.base_url + "/api/chat", {"message": question, "fileIds": file_ids})
+        return status
+
+    def seed_corpus(self, files):
+        start = time.time()
+        failed = sum(self._upload(f"seed_{i}.pdf") != 200 for i in range(files))
+        logger.info(f"Seeded {files - failed}/{files} files in {time.time() - start:.1f}s")
+        if not self.file_ids:
+            raise RuntimeError("No file could be uploaded, check the backend logs")
+
+    def _run_one(self, endpoint, due):
+        try:
+            status = self._upload(f"load_{uuid.uuid4().hex[:8]}.pdf") if endpoint == "upload" else self._chat()
+        except Exception as e:
+            logger.debug(f"{endpoint} request failed: {e}")
+            status = 0
+        with self._lock:
+            self.results.append((endpoint, status, time.monotonic() - due))
+
+    def run(self):
+        logger.info(f"Sending {self.rate} requests/s for {self.duration}s ({self.upload_ratio:.0%} uploads)")
+        start = time.monotonic()
+        futures = []
+        sent = 0
+        while True:
+            due = start + sent / self.rate
+            if due - start >= self.duration:
+                break
+            time.sleep(max(0.0, due - time.monotonic()))
+            endpoint = "upload" if self.rng.random() < self.upload_ratio else "chat"
+            futures.append(self.executor.submit(self._run_one, endpoint, due))
+            sent += 1
+        for future in futures:
+            future.result()
+        elapsed = time.monotonic() - start
+        self.executor.shutdown()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint in ("chat", "upload"):
+            results = [r for r in self.results if r[0] == endpoint]
+            if not results:
+                continue
+            latencies = sorted(latency for _, _, latency in results)
+            errors = sum(1 for _, status, _ in results if status != 200)
+            statuses = {}
+            for _, status, _ in results:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            report[endpoint] = {
+                "requests": len(results),
+                "errorRate": errors / len(results),
+                "throughput": (len(results) - errors) / elapsed,
+                "p50Ms": percentile(latencies, 50) * 1000,
+                "p95Ms": percentile(latencies, 95) * 1000,
+                "p99Ms": percentile(latencies, 99) * 1000,
+                "statuses": statuses
+            }
+        return report
+
+
+def format_report(report):
+    header = f"{'endpoint':<10}{'requests':>10}{'errors':>9}{'ok/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses"
+    lines = [header, "-" * len(header)]
+    for endpoint, r in report.items():
+        lines.append(
+            f"{endpoint:<10}{r['requests']:>10}{r['errorRate']:>9.1%}{r['throughput']:>8.2f}"
+            f"{r['p50Ms']:>10.0f}{r['p95Ms']:>10.0f}{r['p99Ms']:>10.0f}  {r['statuses']}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/chat and /api/upload against a local Gemini stub")
+    parser.add_argument("--base-url", help="Use an already running backend instead of starting one")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask", help="Backend server to start")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --server asgi")
+    parser.add_argument("--port", type=int, default=5055, help="Port of the started backend")
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--stub-port", type=int, default=0, help="Port of the Gemini stub (default: any free port)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Mean latency of the Gemini stub")
+    parser.add_argument("--llm-jitter-ms", type=float, default=400, help="Uniform jitter around the stub latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Fraction of stub calls that fail")
+    parser.add_argument("--llm-failure-status", type=int, default=503, choices=[429, 500, 503])
+    parser.add_argument("--seed-files", type=int, default=5, help="PDFs uploaded before the test")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per generated PDF")
+    parser.add_argument("--rate", type=float, default=2.0, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=60, help="Test duration in seconds")
+    parser.add_argument("--upload-ratio", type=float, default=0.1, help="Fraction of requests that are uploads")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--keep-storage", action="store_true", help="Keep the temporary storage of the started backend")
+    args = parser.parse_args()
+
+    stub = GeminiStub(args.stub_port, args.llm_latency_ms, args.llm_jitter_ms, args.llm_failure_rate,
+                      args.llm_failure_status, seed=args.seed).start()
+    process = None
+    storage_path = None
+    try:
+        if args.base_url:
+            base_url = args.base_url.rstrip("/")
+            print(f"Start the backend with GEMINI_API_ENDPOINT={stub.url} for it to use the stub")
+        else:
+            storage_path = tempfile.mkdtemp(prefix="loadtest_")
+            process, base_url = start_backend(args, stub.url, storage_path)
+
+        test = LoadTest(base_url, args.rate, args.duration, args.upload_ratio, args.concurrency, args.pages, args.seed)
+        test.seed_corpus(args.seed_files)
+        report = test.run()
+        report["llmStub"] = {"calls": stub.requests, "injectedFailures": stub.failures}
+
+        print(format_report({k: v for k, v in report.items() if k != "llmStub"}))
+        print(f"Gemini stub: {stub.requests} calls, {stub.failures} injected failures")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        stub.stop()
+        if storage_path and not args.keep_storage:
+            shutil.rmtree(storage_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import logging
+import config
+from utils.vector_store import VectorStoreService
+from utils.snapshot import SnapshotService
+from utils.embedding_migration import EmbeddingMigration
+from utils import hnsw_tuning
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Offline maintenance commands, run from the backend directory while the API is stopped:
+    python manage.py rebalance-shards    Move every file's vectors to the shard assigned to it for VECTOR_DB_SHARDS
+    python manage.py snapshot-export     Export chunks, embeddings and metadata of some or all files into an archive
+    python manage.py snapshot-import     Bulk load a snapshot archive without re-embedding
+    python manage.py build-summaries     Compute the file summary vectors (two-level retrieval) of files indexed before them
+    python manage.py migrate-embeddings  Re-embed the stored chunks with HF_EMBEDDING_MODEL and switch to them
+    python manage.py drop-previous-collection  Delete the collection replaced by the last embedding migration
+    python manage.py hnsw-benchmark      Measure recall@k and latency of HNSW parameter combinations on real embeddings
+"""
+
+def open_vector_store():
+    return VectorStoreService(
+        vector_db_path=config.VECTOR_DB_PATH,
+        model_name=config.HF_EMBEDDING_MODEL,
+        num_shards=config.VECTOR_DB_SHARDS,
+        hnsw_params={
+            "space": config.HNSW_SPACE,
+            "m": config.HNSW_M,
+            "construction_ef": config.HNSW_CONSTRUCTION_EF,
+            "search_ef": config.HNSW_SEARCH_EF
+        },
+        text_blob_path=config.TEXT_BLOB_PATH,
+        summary_index_path=config.FILE_SUMMARY_PATH
+    )
+
+def rebalance_shards(args):
+    vector_store = open_vector_store()
+    moved = vector_store.rebalance_shards(batch_size=args.batch_size)
+    print(f"Moved {sum(moved.values())} chunks of {len(moved)} files, {config.VECTOR_DB_SHARDS} shard(s) in use")
+
+def snapshot_export(args):
+    snapshot_service = SnapshotService(open_vector_store(), config.SNAPSHOT_STORAGE_PATH, config.PDF_STORAGE_PATH)
+    archive_path = snapshot_service.export_snapshot(file_ids=args.file_ids, archive_path=args.output)
+    print(f"Snapshot written to {archive_path}")
+
+def snapshot_import(args):
+    snapshot_service = SnapshotService(open_vector_store(), config.SNAPSHOT_STORAGE_PATH, config.PDF_STORAGE_PATH)
+    summary = snapshot_service.import_snapshot(args.archive, overwrite=args.overwrite)
+    print(f"Imported {len(summary['imported'])} files ({summary['chunks']} chunks), skipped {len(summary['skipped'])}")
+
+def build_summaries(args):
+    built = open_vector_store().build_missing_summaries()
+    print(f"Built {built} file summary vectors")
+
+def migrate_embeddings(args):
+    vector_store = open_vector_store()
+    migration = EmbeddingMigration(vector_store, batch_size=args.batch_size, batch_delay=0)
+    if not migration.pending:
+        print(f"Stored vectors already use {vector_store.model_name}")
+        return
+    migration.run()
+    print(json.dumps(migration.status(), indent=2))
+
+def drop_previous_collection(args):
+    dropped = open_vector_store().drop_previous_collection()
+    print(f"Dropped collection {dropped}" if dropped else "No previous collection to drop")
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+def hnsw_benchmark(args):
+    sample = hnsw_tuning.sample_embeddings(open_vector_store(), args.sample_size + args.queries, seed=args.seed)
+    if sample.shape[0] <= args.queries:
+        raise SystemExit(f"Only {sample.shape[0]} embeddings stored, need more than --queries ({args.queries})")
+    # Held out queries are not inserted, so the exact neighbours are never the query itself
+    queries, corpus = sample[:args.queries], sample[args.queries:]
+    print(f"Benchmarking on {corpus.shape[0]} vectors with {queries.shape[0]} held out queries")
+
+    results = hnsw_tuning.run_grid(
+        corpus,
+        queries,
+        k=args.k,
+        spaces=[s for s in args.space.split(",") if s],
+        ms=int_list(args.m),
+        construction_efs=int_list(args.construction_ef),
+        search_efs=int_list(args.search_ef)
+    )
+    print(hnsw_tuning.format_report(results, args.k))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF Q&A backend maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebalance = subparsers.add_parser("rebalance-shards", help="Move vectors to the shards assigned by consistent hashing")
+    rebalance.add_argument("--batch-size", type=int, default=1000, help="Chunks moved per batch")
+    rebalance.set_defaults(func=rebalance_shards)
+
+    export = subparsers.add_parser("snapshot-export", help="Export an index snapshot")
+    export.add_argument("--output", help="Archive path (defaults to the snapshot storage directory)")
+    export.add_argument("--file-id", dest="file_ids", action="append", help="File to export (repeatable, default all)")
+    export.set_defaults(func=snapshot_export)
+
+    snapshot_import_parser = subparsers.add_parser("snapshot-import", help="Import an index snapshot")
+    snapshot_import_parser.add_argument("archive", help="Snapshot archive path")
+    snapshot_import_parser.add_argument("--overwrite", action="store_true", help="Replace files that already exist")
+    snapshot_import_parser.set_defaults(func=snapshot_import)
+
+    summaries = subparsers.add_parser("build-summaries", help="Compute missing file summary vectors")
+    summaries.set_defaults(func=build_summaries)
+
+    migrate = subparsers.add_parser("migrate-embeddings", help="Re-embed the stored chunks with HF_EMBEDDING_MODEL")
+    migrate.add_argument("--batch-size", type=int, default=config.MIGRATION_BATCH_SIZE, help="Chunks embedded per batch")
+    migrate.set_defaults(func=migrate_embeddings)
+
+    drop_previous = subparsers.add_parser("drop-previous-collection", help="Delete the collection replaced by a migration")
+    drop_previous.set_defaults(func=drop_previous_collection)
+
+    benchmark = subparsers.add_parser("hnsw-benchmark", help="Recall/latency of HNSW parameters against exact search")
+    benchmark.add_argument("--sample-size", type=int, default=5000, help="Stored embeddings used as the corpus")
+    benchmark.add_argument("--queries", type=int, default=200, help="Stored embeddings held out as queries")
+    benchmark.add_argument("--k", type=int, default=5, help="k for recall@k (the chat route uses 5)")
+    benchmark.add_argument("--space", default="l2", help="Comma separated spaces (l2, cosine, ip)")
+    benchmark.add_argument("--m", default="8,16,32", help="Comma separated M values")
+    benchmark.add_argument("--construction-ef", default="100,200", help="Comma separated construction ef values")
+    benchmark.add_argument("--search-ef", default="10,50,100", help="Comma separated search ef values")
+    benchmark.add_argument("--seed", type=int, default=0)
+    benchmark.add_argument("--json", help="Also write the results to this JSON file")
+    benchmark.set_defaults(func=hnsw_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
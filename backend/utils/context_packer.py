@@ -0,0 +1,154 @@
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+The context packer turns the retrieved chunks into the context block of the prompt.
+Adjacent chunks of the same file share up to CHUNK_OVERLAP characters, so joining them verbatim repeats text
+and the prompt has no size limit. The packer:
+1. Merges adjacent chunks (consecutive chunk ids) of the same file and drops the repeated overlap.
+2. Drops chunks whose text is already contained in another selected chunk.
+3. Fits the merged sections into a token budget, keeping the most relevant sections first.
+4. Orders the result by document position (files by their best hit, chunks by chunk id).
+
+Token counts are a local estimate (characters per token), we don't call the Gemini tokenizer for this.
+"""
+
+MIN_OVERLAP_CHARS = 20  # Shorter suffix/prefix matches are likely coincidental
+
+
+def estimate_tokens(text, chars_per_token=4):
+    if not text:
+        return 0
+    return len(text) // chars_per_token + 1
+
+
+def find_overlap(previous_text, next_text, max_overlap=None):
+    """Length of the longest suffix of previous_text that is also a prefix of next_text"""
+    if not previous_text or not next_text:
+        return 0
+    max_overlap = min(len(previous_text), len(next_text), max_overlap or len(next_text))
+    if max_overlap < MIN_OVERLAP_CHARS:
+        return 0
+
+    # Look for the start of next_text in the tail of previous_text, longest candidate first
+    probe = next_text[:MIN_OVERLAP_CHARS]
+    tail_start = len(previous_text) - max_overlap
+    position = previous_text.find(probe, tail_start)
+    while position != -1:
+        overlap = len(previous_text) - position
+        if next_text.startswith(previous_text[position:]):
+            return overlap
+        position = previous_text.find(probe, position + 1)
+    return 0
+
+
+class ContextPacker:
+    def __init__(self, token_budget=6000, chars_per_token=4, separator="\n\n---\n\n"):
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.separator = separator
+
+    def _tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _merge_sections(self, context_docs):
+        # Group the hits per file, remembering their rank in the retrieval results
+        files = {}
+        for rank, doc in enumerate(context_docs):
+            meta = doc.get("metadata", {})
+            file_key = meta.get("file_id") or f"unknown-{rank}"
+            chunk_id = meta.get("chunk_id")
+            try:
+                chunk_id = int(chunk_id)
+            except (TypeError, ValueError):
+                chunk_id = None
+            files.setdefault(file_key, []).append({
+                "rank": rank,
+                "chunk_id": chunk_id,
+                "text": doc.get("content", ""),
+            })
+
+        sections = []
+        for file_key, hits in files.items():
+            # Order by document position, hits without a chunk id keep their retrieval order at the end
+            hits.sort(key=lambda h: (h["chunk_id"] is None, h["chunk_id"] if h["chunk_id"] is not None else h["rank"]))
+            current = None
+            for hit in hits:
+                # Skip exact repeats and chunks fully contained in the current section
+                if current and hit["text"] in current["text"]:
+                    current["rank"] = min(current["rank"], hit["rank"])
+                    continue
+
+                adjacent = (
+                    current is not None
+                    and hit["chunk_id"] is not None
+                    and current["last_chunk_id"] is not None
+                    and hit["chunk_id"] == current["last_chunk_id"] + 1
+                )
+                if adjacent:
+                    overlap = find_overlap(current["text"], hit["text"])
+                    joiner = "" if overlap else "\n"
+                    current["text"] += joiner + hit["text"][overlap:]
+                    current["last_chunk_id"] = hit["chunk_id"]
+                    current["rank"] = min(current["rank"], hit["rank"])
+                    continue
+
+                current = {
+                    "file_key": file_key,
+                    "first_chunk_id": hit["chunk_id"],
+                    "last_chunk_id": hit["chunk_id"],
+                    "rank": hit["rank"],
+                    "text": hit["text"],
+                }
+                sections.append(current)
+        return sections
+
+    def pack(self, context_docs):
+        """Returns (context, stats) where stats reports the token estimates before and after packing"""
+        verbatim_tokens = self._tokens(self.separator.join(doc.get("content", "") for doc in context_docs))
+        sections = self._merge_sections(context_docs)
+        merged_tokens = self._tokens(self.separator.join(section["text"] for section in sections))
+
+        # Fill the budget with the most relevant sections first
+        selected = []
+        used_tokens = 0
+        separator_tokens = self._tokens(self.separator)
+        for section in sorted(sections, key=lambda s: s["rank"]):
+            cost = self._tokens(section["text"]) + (separator_tokens if selected else 0)
+            if used_tokens + cost <= self.token_budget:
+                selected.append(section)
+                used_tokens += cost
+                continue
+
+            # Truncate the section that crosses the budget, unless only a sliver would be left.
+            # The top-ranked section is always kept, so the LLM never gets an empty context.
+            remaining = self.token_budget - used_tokens - (separator_tokens if selected else 0)
+            if remaining >= 50 or not selected:
+                section["text"] = section["text"][:max(remaining, 1) * self.chars_per_token]
+                selected.append(section)
+            break
+
+        # Present the selection in document order: files by their best hit, then by chunk position
+        file_rank = {}
+        for section in selected:
+            file_rank[section["file_key"]] = min(file_rank.get(section["file_key"], section["rank"]), section["rank"])
+        selected.sort(key=lambda s: (
+            file_rank[s["file_key"]],
+            s["first_chunk_id"] if s["first_chunk_id"] is not None else float("inf"),
+            s["rank"],
+        ))
+
+        context = self.separator.join(section["text"] for section in selected)
+        packed_tokens = self._tokens(context)
+        stats = {
+            "verbatimTokens": verbatim_tokens,
+            "packedTokens": packed_tokens,
+            # Saved by merging overlaps and dropping repeats, cut by the budget is reported separately
+            "tokensSaved": max(0, verbatim_tokens - merged_tokens),
+            "tokensTruncated": max(0, merged_tokens - packed_tokens),
+            "sections": len(selected),
+            "chunks": len(context_docs),
+        }
+        return context, stats
@@ -0,0 +1,204 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import numpy as np
+from utils.metrics import registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Near-duplicate chunk suppression, run between chunking and add_file.
+Repeated headers, footers, disclaimers and template pages turn into many near-identical chunks, which inflate
+the index and take retrieval slots. Each chunk gets a MinHash signature over word shingles and an LSH index
+(bands of the signature) finds near-duplicate candidates cheaply.
+
+1. Within a document: a chunk that is a near-duplicate of an earlier chunk is dropped, and its pages are added
+   to the kept chunk so page citations are preserved.
+2. Across the corpus (optional): a chunk is dropped when near-duplicates already exist in at least
+   corpus_min_files other files, i.e. it is boilerplate shared by the corpus. We don't drop chunks that only
+   exist in one other file, since queries filtered on this file would then miss them.
+
+Signatures of the indexed chunks are kept per file under index_path for the cross-corpus check.
+"""
+
+DEDUP_DROPPED = registry.counter(
+    "rag_dedup_chunks_dropped_total", "Chunks dropped as near-duplicates before indexing", ("scope",)
+)
+DEDUP_CHARS_SAVED = registry.counter(
+    "rag_dedup_chars_saved_total", "Characters of chunk text not indexed thanks to deduplication"
+)
+
+class ChunkDeduplicator:
+    def __init__(self, index_path, num_perm=128, bands=16, threshold=0.85, shingle_size=5,
+                 cross_corpus=False, corpus_min_files=3, seed=42):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.index_path = index_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.cross_corpus = cross_corpus
+        self.corpus_min_files = corpus_min_files
+
+        # Multiply-shift hash family over 64 bit shingle hashes (odd multipliers), one hash per permutation
+        rng = np.random.default_rng(seed)
+        self._mul = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._add = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+        # Corpus LSH index: band key -> {file_id: [chunk positions]}, and file_id -> signatures
+        self._lock = threading.Lock()
+        self._corpus_buckets = {}
+        self._corpus_signatures = {}
+        os.makedirs(self.index_path, exist_ok=True)
+        if self.cross_corpus:
+            self._load_corpus()
+
+    def _shingles(self, text):
+        # Normalize case and digits so "Page 3 of 10" and "Page 4 of 10" footers look the same
+        words = re.sub(r"\d", "0", text.lower()).split()
+        if len(words) < self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        shingles = self._shingles(text)
+        if not shingles:
+            return np.zeros(self.num_perm, dtype=np.uint32)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        # (a * x + b) mod 2^64, keeping the high 32 bits, then the minimum per permutation
+        permuted = (hashes[:, None] * self._mul[None, :] + self._add[None, :]) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def similarity(self, sig_a, sig_b):
+        """Estimated Jaccard similarity of the shingle sets"""
+        return float(np.count_nonzero(sig_a == sig_b)) / self.num_perm
+
+    def deduplicate(self, file_id, chunks, chunk_page_map):
+        """Returns (chunks, chunk_page_map, signatures, stats) with near-duplicates removed"""
+        kept_chunks = []
+        kept_map = []
+        kept_signatures = []
+        buckets = {}
+        stats = {"chunksIn": len(chunks), "withinDocument": 0, "crossCorpus": 0, "charsSaved": 0}
+
+        for i, chunk in enumerate(chunks):
+            text = chunk if isinstance(chunk, str) else str(chunk)
+            entry = chunk_page_map[i] if chunk_page_map and i < len(chunk_page_map) else {"chunk": text, "pages": []}
+            sig = self.signature(text)
+            keys = self._band_keys(sig)
+
+            # Near-duplicate of an earlier chunk of this document: merge its pages into the kept chunk
+            duplicate_of = None
+            for key in keys:
+                for candidate in buckets.get(key, ()):
+                    if self.similarity(sig, kept_signatures[candidate]) >= self.threshold:
+                        duplicate_of = candidate
+                        break
+                if duplicate_of is not None:
+                    break
+            if duplicate_of is not None:
+                kept_entry = kept_map[duplicate_of]
+                kept_entry["pages"] = sorted(set(kept_entry.get("pages", [])) | set(entry.get("pages", [])))
+                stats["withinDocument"] += 1
+                stats["charsSaved"] += len(text)
+                continue
+
+            # Boilerplate shared by enough other files of the corpus
+            if self.cross_corpus and self._corpus_duplicate_files(sig, keys) >= self.corpus_min_files:
+                stats["crossCorpus"] += 1
+                stats["charsSaved"] += len(text)
+                continue
+
+            position = len(kept_chunks)
+            kept_chunks.append(chunk)
+            kept_map.append(dict(entry))
+            kept_signatures.append(sig)
+            for key in keys:
+                buckets.setdefault(key, []).append(position)
+
+        stats["chunksOut"] = len(kept_chunks)
+        stats["chunksDropped"] = stats["chunksIn"] - stats["chunksOut"]
+        DEDUP_DROPPED.inc(stats["withinDocument"], scope="document")
+        DEDUP_DROPPED.inc(stats["crossCorpus"], scope="corpus")
+        DEDUP_CHARS_SAVED.inc(stats["charsSaved"])
+        if stats["chunksDropped"]:
+            logger.info(
+                f"Dropped {stats['chunksDropped']} of {stats['chunksIn']} chunks of {file_id} as near-duplicates "
+                f"({stats['charsSaved']} characters not indexed)"
+            )
+        return kept_chunks, kept_map, kept_signatures, stats
+
+    def _corpus_duplicate_files(self, sig, keys):
+        with self._lock:
+            candidate_files = set()
+            for key in keys:
+                candidate_files.update(self._corpus_buckets.get(key, {}).keys())
+            duplicate_files = 0
+            for other_file in candidate_files:
+                positions = set()
+                for key in keys:
+                    positions.update(self._corpus_buckets.get(key, {}).get(other_file, ()))
+                signatures = self._corpus_signatures[other_file]
+                if any(self.similarity(sig, signatures[p]) >= self.threshold for p in positions):
+                    duplicate_files += 1
+            return duplicate_files
+
+    def _signature_file(self, file_id):
+        return os.path.join(self.index_path, f"{file_id}.npy")
+
+    def _index_file(self, file_id, signatures):
+        self._corpus_signatures[file_id] = signatures
+        for position, sig in enumerate(signatures):
+            for key in self._band_keys(sig):
+                self._corpus_buckets.setdefault(key, {}).setdefault(file_id, []).append(position)
+
+    def add_to_corpus(self, file_id, signatures):
+        """Remember the signatures of an indexed file for the cross-corpus check"""
+        if not self.cross_corpus or not signatures:
+            return
+        try:
+            array = np.stack(signatures)
+            np.save(self._signature_file(file_id), array)
+            with self._lock:
+                self._index_file(file_id, array)
+        except Exception as e:
+            logger.error(f"Error adding {file_id} to the deduplication index: {e}")
+
+    def remove_from_corpus(self, file_id):
+        with self._lock:
+            if self._corpus_signatures.pop(file_id, None) is not None:
+                for key in list(self._corpus_buckets):
+                    files = self._corpus_buckets[key]
+                    files.pop(file_id, None)
+                    if not files:
+                        del self._corpus_buckets[key]
+        path = self._signature_file(file_id)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Error removing deduplication signatures of {file_id}: {e}")
+
+    def _load_corpus(self):
+        loaded = 0
+        for name in os.listdir(self.index_path):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                self._index_file(name[:-4], np.load(os.path.join(self.index_path, name)))
+                loaded += 1
+            except Exception as e:
+                logger.error(f"Error loading deduplication signatures {name}: {e}")
+        logger.info(f"Deduplication index loaded with {loaded} files")
@@ -0,0 +1,96 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.metrics import registry, CACHE_EVENTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+In-memory LRU cache of each file's chunk embeddings, texts and metadata, used by the exact search fast path.
+When a chat only selects a few small files, scoring their few hundred vectors directly is cheaper than an HNSW
+search with a $in metadata filter, and it always returns min(k, chunks) results.
+The cache is bounded by the total number of cached chunks, whole files are evicted least recently used first.
+clear() starts a new generation (after an embedding model switch): entries are tagged with the generation they were
+loaded for, so a load that started before the switch is never stored or served to queries of the new generation.
+"""
+
+CACHED_CHUNKS = registry.gauge(
+    "rag_embedding_cache_chunks", "Number of chunk embeddings held in the exact search cache"
+)
+
+
+class FileEmbeddings:
+    def __init__(self, embeddings, documents, metadatas, generation=0):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.documents = documents
+        self.metadatas = metadatas
+        self.generation = generation
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class FileEmbeddingCache:
+    def __init__(self, max_chunks=50000):
+        self.max_chunks = max_chunks
+        self._files = OrderedDict()
+        self._size = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_id, loader, generation=None):
+        """Cached chunks of a file, loader(file_id) returns a dict of embeddings, documents and metadatas on a miss.
+        generation is the cache generation the caller's embeddings belong to (the current one by default)."""
+        with self._lock:
+            if generation is None:
+                generation = self.generation
+            entry = self._files.get(file_id)
+            if entry is not None and entry.generation == generation:
+                self._files.move_to_end(file_id)
+                CACHE_EVENTS.inc(cache="file_embeddings", result="hit")
+                return entry
+        CACHE_EVENTS.inc(cache="file_embeddings", result="miss")
+
+        # Load outside the lock, two concurrent misses on the same file just load it twice
+        chunks = loader(file_id)
+        entry = FileEmbeddings(chunks["embeddings"], chunks["documents"], chunks["metadatas"], generation)
+        if len(entry) > self.max_chunks:
+            return entry
+
+        with self._lock:
+            if generation != self.generation:
+                # Loaded for an older (or newer) generation, only the caller uses it
+                return entry
+            previous = self._files.pop(file_id, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._files[file_id] = entry
+            self._size += len(entry)
+            while self._size > self.max_chunks:
+                _, evicted = self._files.popitem(last=False)
+                self._size -= len(evicted)
+            CACHED_CHUNKS.set(self._size)
+        return entry
+
+    def cached_size(self, file_id):
+        with self._lock:
+            entry = self._files.get(file_id)
+            return len(entry) if entry is not None else None
+
+    def invalidate(self, file_id):
+        with self._lock:
+            entry = self._files.pop(file_id, None)
+            if entry is not None:
+                self._size -= len(entry)
+                CACHED_CHUNKS.set(self._size)
+
+    def clear(self):
+        """Drop every entry and start a new generation, returns it"""
+        with self._lock:
+            self._files.clear()
+            self._size = 0
+            self.generation += 1
+            CACHED_CHUNKS.set(0)
+            return self.generation
@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+import numpy as np
+from utils.file_summaries import FileSummaryIndex
+from utils.vector_store import collection_name_for
+from utils.embedding_scheduler import BACKGROUND
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Background re-embedding of the stored chunks when HF_EMBEDDING_MODEL changes.
+The stored chunk texts (from the text blobs) are embedded with the new model in throttled batches and upserted with
+the same ids and metadata into a new collection on every shard, while queries and uploads keep using the old model
+and collection. Files uploaded during the migration are picked up by later passes. When every file is migrated,
+ingestions are paused for the last files and the vector store switches model and collection in one step.
+The old collection is kept until it is dropped (admin route or manage.py drop-previous-collection).
+
+Migrated file ids are saved in the embedding state, so a restarted migration skips them.
+"""
+
+
+class EmbeddingMigration:
+    def __init__(self, vector_store, batch_size=64, batch_delay=0.5):
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay  # Pause between batches, leaves CPU to queries and uploads
+        self._thread = None
+        self._lock = threading.Lock()
+        self.progress = {"state": "idle"}
+
+    @property
+    def pending(self):
+        return self.vector_store.model_name != self.vector_store.target_model_name
+
+    def status(self):
+        status = dict(self.progress)
+        status["activeModel"] = self.vector_store.model_name
+        status["activeCollection"] = self.vector_store.collection_name
+        status["configuredModel"] = self.vector_store.target_model_name
+        status["previous"] = self.vector_store.embedding_state.get("previous")
+        return status
+
+    def start(self):
+        """Start the migration in a background thread, returns False if there is nothing to do or it is running"""
+        with self._lock:
+            if not self.pending or (self._thread and self._thread.is_alive()):
+                return False
+            self._thread = threading.Thread(target=self.run, daemon=True, name="embedding-migration")
+            self._thread.start()
+            return True
+
+    def run(self):
+        store = self.vector_store
+        target_model = store.target_model_name
+        collection_name = collection_name_for(target_model)
+        self.progress = {
+            "state": "running",
+            "fromModel": store.model_name,
+            "toModel": target_model,
+            "collection": collection_name,
+            "filesTotal": len(store.file_metadata),
+            "filesMigrated": 0,
+            "chunksMigrated": 0,
+            "startedAt": time.time()
+        }
+        try:
+            embeddings = store._load_embeddings(target_model)
+            shards = [store._open_shard(i, collection_name, embeddings) for i in range(store.num_shards)]
+            store.migration_shards = shards
+
+            # Resume the file list of an interrupted migration to the same model
+            saved = store.embedding_state.get("migration") or {}
+            migrated = set(saved.get("migratedFiles", [])) if saved.get("model") == target_model else set()
+            store.embedding_state["migration"] = {"model": target_model, "collection": collection_name,
+                                                  "migratedFiles": sorted(migrated)}
+            store._save_embedding_state()
+            summaries = {}
+
+            # Keep making passes while uploads add files, the last pass runs with ingestions paused
+            while True:
+                pending = [file_id for file_id in list(store.file_metadata) if file_id not in migrated]
+                self.progress["filesTotal"] = len(store.file_metadata)
+                if not pending:
+                    break
+                for file_id in pending:
+                    self._migrate_file(file_id, embeddings, shards, migrated, summaries)
+
+            with store.ingestion_paused():
+                for file_id in [file_id for file_id in list(store.file_metadata) if file_id not in migrated]:
+                    self._migrate_file(file_id, embeddings, shards, migrated, summaries, throttle=False)
+                # Summaries of files migrated before a restart are rebuilt from the new collection
+                for file_id in store.file_metadata:
+                    if file_id not in summaries:
+                        stored = shards[store.ring.shard_for(file_id)]._collection.get(
+                            where={"file_id": file_id}, include=["embeddings"]
+                        )
+                        summaries[file_id] = FileSummaryIndex.summarize(stored["embeddings"])
+                store.embedding_state.pop("migration", None)
+                store.activate_collection(target_model, embeddings, collection_name, shards,
+                                          {k: v for k, v in summaries.items() if v is not None})
+
+            self.progress.update({"state": "completed", "finishedAt": time.time()})
+            logger.info(
+                f"Embedding migration to {target_model} completed: {self.progress['filesMigrated']} files, "
+                f"{self.progress['chunksMigrated']} chunks in {time.time() - self.progress['startedAt']:.1f}s"
+            )
+        except Exception as e:
+            logger.error(f"Embedding migration to {target_model} failed: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            store.migration_shards = None
+            self.progress.update({"state": "failed", "error": str(e), "finishedAt": time.time()})
+
+    def _migrate_file(self, file_id, embeddings, shards, migrated, summaries, throttle=True):
+        store = self.vector_store
+        if file_id not in store.file_metadata:
+            return
+        chunks = store.get_file_chunks(file_id)
+        target = shards[store.ring.shard_for(file_id)]._collection
+        # Chunks indexed before the text blobs keep their text in the collection, so it has to be copied
+        keep_documents = not store.text_blobs.exists(file_id)
+        vectors = []
+        for start in range(0, len(chunks["ids"]), self.batch_size):
+            end = start + self.batch_size
+            batch_vectors = embeddings.embed_documents(chunks["documents"][start:end], priority=BACKGROUND)
+            target.upsert(
+                ids=chunks["ids"][start:end],
+                embeddings=batch_vectors,
+                metadatas=chunks["metadatas"][start:end],
+                documents=chunks["documents"][start:end] if keep_documents else None
+            )
+            vectors.extend(batch_vectors)
+            self.progress["chunksMigrated"] += len(batch_vectors)
+            if throttle and self.batch_delay:
+                time.sleep(self.batch_delay)
+
+        summaries[file_id] = FileSummaryIndex.summarize(np.asarray(vectors, dtype=np.float32)) if vectors else None
+        migrated.add(file_id)
+        self.progress["filesMigrated"] = len(migrated)
+        store.embedding_state["migration"]["migratedFiles"] = sorted(migrated)
+        store._save_embedding_state()
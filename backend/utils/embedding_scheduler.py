@@ -0,0 +1,100 @@
+import time
+import logging
+import threading
+from utils.metrics import registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Priority scheduling of the embedding model between chat queries and ingestion.
+The model runs one call at a time (torch already spreads a call over its intra-op threads), and a waiting query
+call always goes before waiting ingestion or migration calls. Ingestion texts are embedded in small micro-batches,
+each one scheduled on its own, so a large upload can be preempted between micro-batches instead of holding the model
+for seconds. The torch thread count can be set per priority class (torch.set_num_threads is process wide, which is
+fine because only one call runs at a time).
+
+ScheduledEmbeddings wraps a HuggingFaceEmbeddings model with the same embed_query/embed_documents interface.
+"""
+
+QUERY = 0
+INGEST = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {QUERY: "query", INGEST: "ingest", BACKGROUND: "background"}
+
+EMBEDDING_WAIT = registry.histogram(
+    "rag_embedding_wait_seconds", "Time embedding calls wait for the model, by priority class", ("priority",)
+)
+EMBEDDING_WAITING = registry.gauge(
+    "rag_embedding_waiting", "Embedding calls waiting for the model, by priority class", ("priority",)
+)
+
+
+class EmbeddingScheduler:
+    def __init__(self, threads=None):
+        # threads: priority -> torch intra-op thread count, missing or 0 keeps the current setting
+        self.threads = {priority: count for priority, count in (threads or {}).items() if count}
+        self._condition = threading.Condition()
+        self._busy = False
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._current_threads = None
+        self._torch = None
+        if self.threads:
+            try:
+                import torch
+                self._torch = torch
+                self._current_threads = torch.get_num_threads()
+            except ImportError:
+                logger.warning("torch is not installed, embedding thread settings are ignored")
+
+    def _acquire(self, priority):
+        start = time.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            EMBEDDING_WAITING.set(self._waiting[priority], priority=PRIORITY_NAMES[priority])
+            while self._busy or any(self._waiting[p] for p in PRIORITY_NAMES if p < priority):
+                self._condition.wait()
+            self._waiting[priority] -= 1
+            EMBEDDING_WAITING.set(self._waiting[priority], priority=PRIORITY_NAMES[priority])
+            self._busy = True
+        EMBEDDING_WAIT.observe(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+        threads = self.threads.get(priority)
+        if self._torch is not None and threads and threads != self._current_threads:
+            self._torch.set_num_threads(threads)
+            self._current_threads = threads
+
+    def _release(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+    def run(self, priority, func, *args):
+        self._acquire(priority)
+        try:
+            return func(*args)
+        finally:
+            self._release()
+
+
+class ScheduledEmbeddings:
+    def __init__(self, embeddings, scheduler, micro_batch_size=16):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.micro_batch_size = max(1, micro_batch_size)
+
+    def embed_query(self, text):
+        return self.scheduler.run(QUERY, self.embeddings.embed_query, text)
+
+    def embed_queries(self, texts):
+        """Embed several queries in one call, with query priority (the model is symmetric, like embed_query)"""
+        return self.scheduler.run(QUERY, self.embeddings.embed_documents, list(texts))
+
+    def embed_documents(self, texts, priority=INGEST):
+        # Micro-batches are scheduled one by one, so queries get the model in between
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.micro_batch_size):
+            batch = texts[start:start + self.micro_batch_size]
+            vectors.extend(self.scheduler.run(priority, self.embeddings.embed_documents, batch))
+        return vectors
@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+import numpy as np
+from utils.hnsw_tuning import pairwise_distances
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+One summary vector per file (the normalized mean of its chunk embeddings), used for two-level retrieval:
+queries over many files first rank the files by their summary vector and only search the chunks of the best
+files. The vectors are small, they are all kept in memory and persisted as one .npy file per file id.
+"""
+
+
+class FileSummaryIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._vectors = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.index_path, exist_ok=True)
+        self._load()
+
+    def _vector_file(self, file_id):
+        return os.path.join(self.index_path, f"{file_id}.npy")
+
+    @staticmethod
+    def summarize(embeddings):
+        """Normalized mean of a file's chunk embeddings, None for a file without chunks"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not embeddings.size:
+            return None
+        mean = embeddings.mean(axis=0)
+        norm = np.linalg.norm(mean)
+        return mean / norm if norm else mean
+
+    def set(self, file_id, vector):
+        if vector is None:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        try:
+            np.save(self._vector_file(file_id), vector)
+        except Exception as e:
+            logger.error(f"Error saving the summary vector of {file_id}: {e}")
+        with self._lock:
+            self._vectors[file_id] = vector
+
+    def has(self, file_id):
+        with self._lock:
+            return file_id in self._vectors
+
+    def remove(self, file_id):
+        with self._lock:
+            self._vectors.pop(file_id, None)
+        path = self._vector_file(file_id)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Error removing the summary vector of {file_id}: {e}")
+
+    def rank(self, query_embedding, file_ids, limit):
+        """The limit best files for the query, followed by every file that has no summary vector yet"""
+        dimension = len(query_embedding)
+        with self._lock:
+            # Vectors of another dimension are left over from an embedding model migration, treat them as unknown
+            known = [
+                file_id for file_id in file_ids
+                if file_id in self._vectors and self._vectors[file_id].shape[0] == dimension
+            ]
+            vectors = [self._vectors[file_id] for file_id in known]
+        known_ids = set(known)
+        unknown = [file_id for file_id in file_ids if file_id not in known_ids]
+        if not known:
+            return unknown
+        distances = pairwise_distances(
+            np.stack(vectors), np.asarray([query_embedding], dtype=np.float32), "cosine"
+        )[0]
+        best = [known[i] for i in np.argsort(distances)[:limit]]
+        return best + unknown
+
+    def _load(self):
+        for name in os.listdir(self.index_path):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                self._vectors[name[:-4]] = np.load(os.path.join(self.index_path, name))
+            except Exception as e:
+                logger.error(f"Error loading summary vector {name}: {e}")
+        logger.info(f"File summary index loaded with {len(self._vectors)} files")
@@ -0,0 +1,143 @@
+import time
+import uuid
+import logging
+import itertools
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Recall/latency harness for the HNSW parameters of the vector collections.
+It samples real chunk embeddings from the store, holds some of them out as queries, computes the exact
+top-k with a brute-force search, and then builds a temporary in-memory Chroma collection for every parameter
+combination to measure recall@k against the exact results plus p50/p99 query latency and build time.
+
+The main functions are:
+1. sample_embeddings: Random sample of stored chunk embeddings across all shards.
+2. exact_top_k: Brute-force top-k for a distance space (l2, cosine, ip), using Chroma's distance definitions.
+3. evaluate_params: Build one collection with the given parameters and measure it.
+4. run_grid: Evaluate every combination of the given parameter lists.
+"""
+
+
+def sample_embeddings(vector_store, sample_size, seed=0, page_size=500):
+    rng = np.random.default_rng(seed)
+    collections = [shard._collection for shard in vector_store.shards]
+    counts = [collection.count() for collection in collections]
+    total = sum(counts)
+    if total == 0:
+        raise ValueError("The vector store is empty, upload some documents first")
+
+    # Read random pages from each shard, proportionally to its size
+    vectors = []
+    for collection, count in zip(collections, counts):
+        wanted = int(round(sample_size * count / total))
+        if not wanted:
+            continue
+        offsets = list(range(0, count, page_size))
+        rng.shuffle(offsets)
+        taken = 0
+        for offset in offsets:
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings"])
+            embeddings = page["embeddings"][:wanted - taken]
+            vectors.extend(embeddings)
+            taken += len(embeddings)
+            if taken >= wanted:
+                break
+
+    sample = np.asarray(vectors, dtype=np.float32)
+    rng.shuffle(sample)
+    return sample
+
+
+def pairwise_distances(corpus, queries, space):
+    # Same definitions as Chroma/hnswlib: squared L2, 1 - cosine similarity, 1 - inner product
+    if space == "l2":
+        return (
+            np.sum(queries ** 2, axis=1)[:, None]
+            - 2 * queries @ corpus.T
+            + np.sum(corpus ** 2, axis=1)[None, :]
+        )
+    if space == "cosine":
+        corpus_norm = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        query_norm = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return 1 - query_norm @ corpus_norm.T
+    if space == "ip":
+        return 1 - queries @ corpus.T
+    raise ValueError(f"Unsupported space: {space}")
+
+
+def exact_top_k(corpus, queries, k, space):
+    """Indexes of the exact k nearest corpus vectors for every query"""
+    distances = pairwise_distances(corpus, queries, space)
+    k = min(k, corpus.shape[0])
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, candidates, axis=1).argsort(axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def evaluate_params(client, corpus, queries, exact, k, space, m, construction_ef, search_ef, batch_size=1000):
+    name = f"hnsw_tuning_{uuid.uuid4().hex[:8]}"
+    collection = client.create_collection(name=name, metadata={
+        "hnsw:space": space,
+        "hnsw:M": m,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:search_ef": search_ef
+    })
+    try:
+        build_start = time.perf_counter()
+        for start in range(0, corpus.shape[0], batch_size):
+            end = min(start + batch_size, corpus.shape[0])
+            collection.add(ids=[str(i) for i in range(start, end)], embeddings=corpus[start:end].tolist())
+        build_seconds = time.perf_counter() - build_start
+
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, exact):
+            query_start = time.perf_counter()
+            result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            found = {int(i) for i in result["ids"][0]}
+            hits += len(found & set(expected.tolist()))
+
+        return {
+            "space": space,
+            "M": m,
+            "constructionEf": construction_ef,
+            "searchEf": search_ef,
+            "recallAtK": hits / (len(queries) * exact.shape[1]),
+            "p50Ms": float(np.percentile(latencies, 50)),
+            "p99Ms": float(np.percentile(latencies, 99)),
+            "buildSeconds": build_seconds
+        }
+    finally:
+        client.delete_collection(name)
+
+
+def run_grid(corpus, queries, k=5, spaces=("l2",), ms=(16,), construction_efs=(100,), search_efs=(10, 50, 100)):
+    import chromadb
+    client = chromadb.EphemeralClient()
+
+    results = []
+    for space in spaces:
+        exact = exact_top_k(corpus, queries, k, space)
+        for m, construction_ef, search_ef in itertools.product(ms, construction_efs, search_efs):
+            result = evaluate_params(client, corpus, queries, exact, k, space, m, construction_ef, search_ef)
+            logger.info(
+                f"space={space} M={m} construction_ef={construction_ef} search_ef={search_ef}: "
+                f"recall@{k}={result['recallAtK']:.3f} p50={result['p50Ms']:.2f}ms p99={result['p99Ms']:.2f}ms"
+            )
+            results.append(result)
+    return results
+
+
+def format_report(results, k):
+    header = f"{'space':<7}{'M':>5}{'c_ef':>7}{'s_ef':>7}{f'recall@{k}':>11}{'p50 ms':>9}{'p99 ms':>9}{'build s':>9}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['space']:<7}{r['M']:>5}{r['constructionEf']:>7}{r['searchEf']:>7}"
+            f"{r['recallAtK']:>11.3f}{r['p50Ms']:>9.2f}{r['p99Ms']:>9.2f}{r['buildSeconds']:>9.2f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,259 @@
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from utils.metrics import registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+The LLM gateway sits between LLMService and the chat model, so traffic spikes queue up instead of all
+hitting the provider's rate limits at the same moment. For every call it:
+1. Admits the request into a bounded wait queue (fails fast with LLMQueueFullError when the queue is full).
+2. Waits for a concurrency slot and a token from the token bucket, until the request deadline.
+3. Invokes the model with the time left until the deadline, retrying 429/5xx errors with jittered exponential
+   backoff. A call still running at the deadline fails with LLMDeadlineExceededError, so a hung provider call
+   doesn't hold its concurrency slot past the request timeout.
+
+The model only needs invoke(messages, timeout=seconds) (and ainvoke(messages, timeout=seconds) for the async path),
+so a local stub model can be plugged in for tests. LangChain chat models pass timeout on to their client.
+"""
+
+LLM_QUEUE_WAIT = registry.histogram(
+    "rag_llm_queue_wait_seconds", "Time LLM calls spend waiting for a concurrency slot and rate limit token"
+)
+LLM_QUEUE_DEPTH = registry.gauge(
+    "rag_llm_queue_depth", "Number of LLM calls waiting in the gateway queue"
+)
+LLM_IN_FLIGHT = registry.gauge(
+    "rag_llm_in_flight", "Number of LLM calls currently running"
+)
+LLM_RETRIES = registry.counter(
+    "rag_llm_retries_total", "Number of retried LLM calls"
+)
+LLM_REJECTIONS = registry.counter(
+    "rag_llm_rejections_total", "LLM calls rejected by the gateway", ("reason",)
+)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_MESSAGE_PATTERN = re.compile(
+    r"\b(429|500|502|503|504)\b|resource.?exhausted|rate.?limit|quota|unavailable|overloaded|deadline",
+    re.IGNORECASE
+)
+
+
+class LLMGatewayError(Exception):
+    """Base class for errors raised by the gateway itself, status is the HTTP status to report"""
+    status = 503
+
+
+class LLMQueueFullError(LLMGatewayError):
+    pass
+
+
+class LLMDeadlineExceededError(LLMGatewayError):
+    status = 504
+
+
+def is_retryable_error(error):
+    # google api_core exceptions expose the HTTP status as .code, other clients use .status_code
+    for attr in ("status_code", "code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code in RETRYABLE_STATUS_CODES
+    return bool(RETRYABLE_MESSAGE_PATTERN.search(str(error)))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self):
+        """Take a token, returns 0 on success or the number of seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class LLMGateway:
+    def __init__(self, llm, max_concurrency=4, max_queue=32, rate_per_second=0, rate_burst=1,
+                 max_retries=3, retry_base_delay=0.5, retry_max_delay=8.0, request_timeout=60.0):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.request_timeout = request_timeout
+        self.bucket = TokenBucket(rate_per_second, rate_burst)
+        self._active = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def _enter_queue(self):
+        with self._condition:
+            # Only queue when all slots are busy, and never beyond the queue bound
+            if self._active >= self.max_concurrency and self._waiting >= self.max_queue:
+                LLM_REJECTIONS.inc(reason="queue_full")
+                raise LLMQueueFullError(
+                    f"LLM queue is full ({self._waiting} waiting, {self._active} running), try again later"
+                )
+            self._waiting += 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+
+    def _leave_queue(self):
+        with self._condition:
+            self._waiting -= 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+
+    def _try_acquire_slot(self):
+        with self._condition:
+            if self._active < self.max_concurrency:
+                self._active += 1
+                LLM_IN_FLIGHT.set(self._active)
+                return True
+            return False
+
+    def _release_slot(self):
+        with self._condition:
+            self._active -= 1
+            LLM_IN_FLIGHT.set(self._active)
+            self._condition.notify()
+
+    def _deadline_exceeded(self, stage):
+        LLM_REJECTIONS.inc(reason="deadline")
+        return LLMDeadlineExceededError(f"LLM request deadline of {self.request_timeout}s exceeded while {stage}")
+
+    def _retry_delay(self, attempt, deadline):
+        # Full jitter: a random delay up to the exponential backoff, never past the deadline
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _acquire(self, deadline):
+        self._enter_queue()
+        start = time.monotonic()
+        try:
+            with self._condition:
+                while self._active >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._deadline_exceeded("waiting for a slot")
+                    self._condition.wait(remaining)
+                self._active += 1
+                LLM_IN_FLIGHT.set(self._active)
+            try:
+                while True:
+                    wait = self.bucket.try_take()
+                    if not wait:
+                        break
+                    if time.monotonic() + wait >= deadline:
+                        raise self._deadline_exceeded("waiting for the rate limiter")
+                    time.sleep(wait)
+            except Exception:
+                self._release_slot()
+                raise
+        finally:
+            self._leave_queue()
+            LLM_QUEUE_WAIT.observe(time.monotonic() - start)
+
+    async def _acquire_async(self, deadline):
+        self._enter_queue()
+        start = time.monotonic()
+        try:
+            # The condition can't be awaited, so poll for a free slot with a short backoff
+            poll_interval = 0.005
+            while not self._try_acquire_slot():
+                if time.monotonic() >= deadline:
+                    raise self._deadline_exceeded("waiting for a slot")
+                await asyncio.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, 0.05)
+            try:
+                while True:
+                    wait = self.bucket.try_take()
+                    if not wait:
+                        break
+                    if time.monotonic() + wait >= deadline:
+                        raise self._deadline_exceeded("waiting for the rate limiter")
+                    await asyncio.sleep(wait)
+            except Exception:
+                self._release_slot()
+                raise
+        finally:
+            self._leave_queue()
+            LLM_QUEUE_WAIT.observe(time.monotonic() - start)
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise self._deadline_exceeded("waiting for the model")
+        return remaining
+
+    def invoke(self, messages, timeout=None):
+        deadline = time.monotonic() + (timeout or self.request_timeout)
+        self._acquire(deadline)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    # The client enforces the timeout, a sync call can't be abandoned from here
+                    return self.llm.invoke(messages, timeout=self._remaining(deadline))
+                except LLMGatewayError:
+                    raise
+                except Exception as e:
+                    if time.monotonic() >= deadline:
+                        raise self._deadline_exceeded("waiting for the model") from e
+                    delay = self._retry_delay(attempt, deadline) if attempt < self.max_retries else None
+                    if delay is None or not is_retryable_error(e):
+                        raise
+                    attempt += 1
+                    LLM_RETRIES.inc()
+                    logger.warning(f"Retryable LLM error (attempt {attempt}/{self.max_retries}), retrying in {delay:.2f}s: {e}")
+                    time.sleep(delay)
+        finally:
+            self._release_slot()
+
+    async def ainvoke(self, messages, timeout=None):
+        deadline = time.monotonic() + (timeout or self.request_timeout)
+        await self._acquire_async(deadline)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    remaining = self._remaining(deadline)
+                    return await asyncio.wait_for(self.llm.ainvoke(messages, timeout=remaining), remaining)
+                except LLMGatewayError:
+                    raise
+                except asyncio.TimeoutError as e:
+                    raise self._deadline_exceeded("waiting for the model") from e
+                except Exception as e:
+                    if time.monotonic() >= deadline:
+                        raise self._deadline_exceeded("waiting for the model") from e
+                    delay = self._retry_delay(attempt, deadline) if attempt < self.max_retries else None
+                    if delay is None or not is_retryable_error(e):
+                        raise
+                    attempt += 1
+                    LLM_RETRIES.inc()
+                    logger.warning(f"Retryable LLM error (attempt {attempt}/{self.max_retries}), retrying in {delay:.2f}s: {e}")
+                    await asyncio.sleep(delay)
+        finally:
+            self._release_slot()
+
+    def status(self):
+        with self._condition:
+            return {"running": self._active, "waiting": self._waiting, "maxConcurrency": self.max_concurrency, "maxQueue": self.max_queue}
@@ -2,24 +2,52 @@ import os
 import google.generativeai as genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 import logging
+from utils.metrics import track_stage, LLM_TOKENS, CONTEXT_TOKENS
+from utils.context_packer import ContextPacker
+from utils.llm_gateway import LLMGateway, LLMGatewayError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class LLMService:
-    def __init__(self, gemini_api_key):
+    def __init__(self, gemini_api_key, context_token_budget=6000, chars_per_token=4, gateway_options=None, llm=None,
+                 gemini_api_endpoint=None):
         self.gemini_api_key = gemini_api_key
-        self._initialize_llm()
+        self.gemini_api_endpoint = gemini_api_endpoint
+        self.gateway_options = gateway_options
+        self.context_packer = ContextPacker(
+            token_budget=context_token_budget,
+            chars_per_token=chars_per_token
+        )
+        # A stub model can be passed in as llm (anything with invoke/ainvoke), otherwise Gemini is used
+        if llm is not None:
+            self.llm = llm
+        else:
+            self._initialize_llm()
+        
+        # Every model call goes through the gateway (concurrency cap, rate limit, retries, bounded queue)
+        self.gateway = LLMGateway(self.llm, **(self.gateway_options or {}))
     
     def _initialize_llm(self):
         try:
             genai.configure(api_key=self.gemini_api_key)
+            endpoint_options = {}
+            if self.gemini_api_endpoint:
+                # Custom endpoints (like the load test stub) are plain HTTP servers, so use the REST transport
+                endpoint_options = {"client_options": {"api_endpoint": self.gemini_api_endpoint}, "transport": "rest"}
+                logger.info(f"Using Gemini API endpoint {self.gemini_api_endpoint}")
             self.llm = ChatGoogleGenerativeAI(
                 model="gemini-2.0-flash",
                 google_api_key=self.gemini_api_key,
                 temperature=0,
-                convert_system_message_to_human=True
+                convert_system_message_to_human=True,
+                # Retries are handled by the gateway, which passes the time left until the request deadline as the
+                # timeout of every call
+                max_retries=1,
+                timeout=(self.gateway_options or {}).get("request_timeout", 60.0),
+                **endpoint_options
             )
             logger.info("Gemini LLM initialized successfully")
         except Exception as e:
@@ -103,6 +131,113 @@ class LLMService:
     #             "sources": []
     #         }
 
+    def _build_sources(self, context_docs):
+        # First, get the relevance information for each document
+        # We need to capture this before modifying the documents
+        docs_with_info = []
+        for i, doc in enumerate(context_docs):
+            meta = doc.get("metadata", {})
+            # Use the index position as a proxy for relevance score (lower index = higher relevance)
+            # Vector search already returns most relevant first
+            relevance_score = 1.0 - (i / max(len(context_docs), 1))  # Normalize to 0-1, higher is better
+            
+            docs_with_info.append({
+                "doc": doc,
+                "relevance": relevance_score,
+                "index": i  # Original position in results
+            })
+        
+        # Sort by relevance score in descending order
+        docs_with_info.sort(key=lambda x: x["relevance"], reverse=True)
+        
+        # Create source references with numbered chunks based on relevance
+        sources = []
+        chunk_counts = {}  # Track count of each document
+        
+        for info in docs_with_info:
+            doc = info["doc"]
+            meta = doc.get("metadata", {})
+            file_id = meta.get("file_id", "")
+            file_name = meta.get("file_name", meta.get("filename", "Unknown Document"))
+            page = meta.get("page", None)
+            
+            # Track chunks from each file to number them
+            if file_name not in chunk_counts:
+                chunk_counts[file_name] = 0
+            chunk_counts[file_name] += 1
+            
+            # Add the chunk number to the title
+            numbered_title = f"{file_name} ({chunk_counts[file_name]})"
+            
+            source_entry = {
+                "fileId": file_id,
+                "title": numbered_title,
+                "originalName": file_name,
+                "relevance": info["relevance"]
+            }
+            
+            if page is not None:
+                source_entry["page"] = page
+            if meta.get("page_end") is not None:
+                source_entry["pageEnd"] = meta["page_end"]
+            # Every cited page, a deduplicated chunk stands for pages that aren't contiguous (and has no page range)
+            if meta.get("pages"):
+                source_entry["pages"] = [int(p) for p in str(meta["pages"]).split(",") if p]
+            # Character range in the file's text, for precise citations
+            if meta.get("start") is not None and meta.get("end") is not None:
+                source_entry["start"] = meta["start"]
+                source_entry["end"] = meta["end"]
+                
+            sources.append(source_entry)
+        
+        return sources
+    
+    def _build_messages(self, query, context):
+        system_prompt = """You are an AI assistant that answers questions based on provided documents.
+        Use ONLY the information in the context provided to answer the question.
+        If the context doesn't contain the information needed, say you don't know or cannot find it in the documents.
+        Provide a clear, concise answer that directly addresses the question.
+        Do not make up information or draw from knowledge outside the provided context."""
+        
+        user_prompt = f"""Context:
+        {context}
+        
+        Question: {query}
+        
+        Please provide an answer based only on the context above."""
+        
+        # In langchain we can provide separate messages for the system and user prompts
+        return [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=user_prompt)
+        ]
+    
+    def _record_token_usage(self, response):
+        # Gemini reports token usage through langchain's usage_metadata, when available
+        usage = getattr(response, "usage_metadata", None) or {}
+        if usage.get("input_tokens"):
+            LLM_TOKENS.inc(usage["input_tokens"], kind="prompt")
+        if usage.get("output_tokens"):
+            LLM_TOKENS.inc(usage["output_tokens"], kind="completion")
+
+    def _prepare_prompt(self, query, context_docs, pipeline="chat"):
+        # Returns the sources shown to the user and the messages sent to the LLM, timed under the caller's pipeline
+        with track_stage(pipeline, "prompt_assembly"):
+            # Create context from retrieved documents, merging overlapping chunks and fitting the token budget
+            context, context_stats = self.context_packer.pack(context_docs)
+            sources = self._build_sources(context_docs)
+            messages = self._build_messages(query, context)
+        
+        CONTEXT_TOKENS.inc(context_stats["packedTokens"], kind="packed")
+        CONTEXT_TOKENS.inc(context_stats["tokensSaved"], kind="saved")
+        CONTEXT_TOKENS.inc(context_stats["tokensTruncated"], kind="truncated")
+        logger.info(
+            f"Packed {context_stats['chunks']} chunks into {context_stats['sections']} sections, "
+            f"~{context_stats['packedTokens']} tokens ({context_stats['tokensSaved']} saved, "
+            f"{context_stats['tokensTruncated']} truncated)"
+        )
+        return sources, messages
+
     def generate_response(self, query, context_docs):
         try:
             if not context_docs:
@@ -112,92 +247,97 @@ class LLMService:
                     "sources": []
                 }
             
-            # Create context from retrieved documents
-            context = "\n\n---\n\n".join([doc["content"] for doc in context_docs])
-            
-            # First, get the relevance information for each document
-            # We need to capture this before modifying the documents
-            docs_with_info = []
-            for i, doc in enumerate(context_docs):
-                meta = doc.get("metadata", {})
-                # Use the index position as a proxy for relevance score (lower index = higher relevance)
-                # Vector search already returns most relevant first
-                relevance_score = 1.0 - (i / max(len(context_docs), 1))  # Normalize to 0-1, higher is better
-                
-                docs_with_info.append({
-                    "doc": doc,
-                    "relevance": relevance_score,
-                    "index": i  # Original position in results
-                })
-            
-            # Sort by relevance score in descending order
-            docs_with_info.sort(key=lambda x: x["relevance"], reverse=True)
-            
-            # Create source references with numbered chunks based on relevance
-            sources = []
-            chunk_counts = {}  # Track count of each document
-            
-            for info in docs_with_info:
-                doc = info["doc"]
-                meta = doc.get("metadata", {})
-                file_id = meta.get("file_id", "")
-                file_name = meta.get("file_name", meta.get("filename", "Unknown Document"))
-                page = meta.get("page", None)
-                
-                # Track chunks from each file to number them
-                if file_name not in chunk_counts:
-                    chunk_counts[file_name] = 0
-                chunk_counts[file_name] += 1
-                
-                # Format relevance score as percentage for display
-                relevance_pct = int(info["relevance"] * 100)
-                
-                # Add the relevance percentage to the title
-                numbered_title = f"{file_name} ({chunk_counts[file_name]})"
-                
-                source_entry = {
-                    "fileId": file_id,
-                    "title": numbered_title,
-                    "originalName": file_name,
-                    "relevance": info["relevance"]
-                }
-                
-                if page is not None:
-                    source_entry["page"] = page
-                    
-                sources.append(source_entry)
-            
-            # Rest of your function remains the same...
-            system_prompt = """You are an AI assistant that answers questions based on provided documents.
-            Use ONLY the information in the context provided to answer the question.
-            If the context doesn't contain the information needed, say you don't know or cannot find it in the documents.
-            Provide a clear, concise answer that directly addresses the question.
-            Do not make up information or draw from knowledge outside the provided context."""
-            
-            user_prompt = f"""Context:
-            {context}
-            
-            Question: {query}
+            sources, messages = self._prepare_prompt(query, context_docs)
+
+            # Generate response using the LLM using the invoke method of the ChatGoogleGenerativeAI library
+            with track_stage("chat", "generation"):
+                response = self.gateway.invoke(messages)
+            self._record_token_usage(response)
             
-            Please provide an answer based only on the context above."""
+            return {
+                "text": response.content,
+                "sources": sources
+            }
+        
+        except LLMGatewayError:
+            # Overload errors are reported to the client with their own status
+            raise
+        except Exception as e:
+            logger.error(f"Error generating response from Gemini LLM: {e}")
+            return {
+                "text": "Sorry, I encountered an error while processing your question.",
+                "sources": []
+            }
+
+    async def agenerate_response(self, query, context_docs):
+        """Async version of generate_response, the Gemini round-trip doesn't hold a thread"""
+        try:
+            if not context_docs:
+                logger.warning("No context documents provided for query")
+                return {
+                    "text": "I couldn't find any relevant information in your documents to answer this question.",
+                    "sources": []
+                }
             
-            # In langchain we can provide separate messages for the system and user prompts
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
+            sources, messages = self._prepare_prompt(query, context_docs)
 
-            # Generate response using the LLM using the invoke method of the ChatGoogleGenerativeAI library
-            response = self.llm.invoke(messages)
+            with track_stage("chat", "generation"):
+                response = await self.gateway.ainvoke(messages)
+            self._record_token_usage(response)
             
             return {
                 "text": response.content,
                 "sources": sources
             }
         
+        except LLMGatewayError:
+            # Overload errors are reported to the client with their own status
+            raise
         except Exception as e:
             logger.error(f"Error generating response from Gemini LLM: {e}")
             return {
                 "text": "Sorry, I encountered an error while processing your question.",
                 "sources": []
-            }
\ No newline at end of file
+            }
+
+    def generate_batch(self, queries, context_docs_list, max_concurrency=4):
+        """Generate answers for many queries at once, returns one response per query (in order)"""
+        responses = [None] * len(queries)
+        pending = []
+        for i, (query, context_docs) in enumerate(zip(queries, context_docs_list)):
+            if not context_docs:
+                responses[i] = {
+                    "text": "I couldn't find any relevant information in your documents to answer this question.",
+                    "sources": []
+                }
+                continue
+            sources, messages = self._prepare_prompt(query, context_docs, pipeline="batch")
+            pending.append((i, sources, messages))
+        
+        if not pending:
+            return responses
+        
+        # Run the prompts through langchain's batch interface, each call still goes through the gateway
+        with track_stage("batch", "generation"):
+            outputs = RunnableLambda(self.gateway.invoke).batch(
+                [messages for _, _, messages in pending],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True
+            )
+        
+        for (i, sources, _), output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                logger.error(f"Error generating batch response {i} from Gemini LLM: {output}")
+                responses[i] = {
+                    "text": "Sorry, I encountered an error while processing your question.",
+                    "sources": [],
+                    "error": str(output)
+                }
+                continue
+            self._record_token_usage(output)
+            responses[i] = {
+                "text": output.content,
+                "sources": sources
+            }
+        
+        return responses
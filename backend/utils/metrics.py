@@ -0,0 +1,219 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+"""
+Lightweight in-process metrics for the upload and chat pipelines.
+We keep our own small registry instead of pulling in a client library, the metrics are rendered
+in the Prometheus text exposition format by the /api/metrics route.
+
+The main pieces in this file:
+1. Counter, Gauge and Histogram: thread safe metric types with optional labels.
+2. MetricsRegistry: holds all metrics and renders them as Prometheus text.
+3. track_stage: context manager that times one stage of a pipeline into the stage histogram.
+4. collect_timings: context manager that collects the per stage timings of one request,
+   so they can be returned with the chat response.
+"""
+
+# Latency buckets in seconds, from a few milliseconds (metadata lookups) up to minutes (OCR of big PDFs)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape_label_value(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+    def _render_samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per label set we keep the bucket counts, the sum and the total count
+                state = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_samples(self):
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            yield f"{self.name}_bucket{labels} {state['count']}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state['sum'])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Metrics shared by the app and the services
+STAGE_LATENCY = registry.histogram(
+    "rag_stage_duration_seconds", "Time spent in each stage of the upload and chat pipelines", ("pipeline", "stage")
+)
+REQUEST_LATENCY = registry.histogram(
+    "rag_request_duration_seconds", "End to end latency of API requests", ("endpoint", "status")
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "rag_requests_in_flight", "Number of API requests currently being handled", ("endpoint",)
+)
+CHUNKS = registry.counter(
+    "rag_chunks_total", "Number of chunks produced, indexed or retrieved", ("operation",)
+)
+PAGES = registry.counter(
+    "rag_layout_pages_total", "Pages handled by the layout method, by text source (text_layer or ocr)", ("source",)
+)
+LLM_TOKENS = registry.counter(
+    "rag_llm_tokens_total", "Number of tokens sent to and received from the LLM", ("kind",)
+)
+CONTEXT_TOKENS = registry.counter(
+    "rag_context_tokens_total",
+    "Estimated context tokens sent to the LLM (packed), removed by overlap merging (saved) and cut by the budget (truncated)",
+    ("kind",)
+)
+CACHE_EVENTS = registry.counter(
+    "rag_cache_events_total", "Cache lookups by cache and result (hit or miss)", ("cache", "result")
+)
+COLLECTION_SIZE = registry.gauge(
+    "rag_collection_documents", "Number of chunks stored in the vector collection"
+)
+STORED_FILES = registry.gauge(
+    "rag_stored_files", "Number of files stored in the vector store"
+)
+
+# Timings collected for the request currently being handled (None when nobody is collecting)
+_current_timings = ContextVar("rag_current_timings", default=None)
+
+
+@contextmanager
+def collect_timings():
+    """Collect per stage timings (in milliseconds) for everything run inside this block"""
+    timings = {}
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def track_stage(pipeline, stage):
+    """Time one stage of a pipeline into the stage histogram and the current request timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, pipeline=pipeline, stage=stage)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 2)
@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from utils.metrics import CACHE_EVENTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Disk cache of the unstructured elements of every partitioned PDF page, so re-processing a document (a retry, a resumed
+ingestion or the same PDF uploaded again) only partitions the pages that are not cached yet.
+Pages are keyed by the SHA-1 of the PDF bytes, the page number and the partition strategy:
+    <cache_path>/<file hash>/<page>.<strategy>.json    list of [category, text] pairs
+
+The file hash is recorded as content_hash in the file metadata, and the vector store removes the document's
+directory when the file is removed or expires. The cache is bounded to max_bytes: the least recently used documents
+are evicted (the directory mtime is the last use, so the order survives restarts).
+"""
+
+
+def file_content_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PartitionCache:
+    def __init__(self, cache_path, max_bytes=512 * 1024 * 1024):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self._sizes = OrderedDict()  # file hash -> cached bytes, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_path, exist_ok=True)
+        self._load()
+
+    def _document_dir(self, file_hash):
+        return os.path.join(self.cache_path, file_hash)
+
+    def _page_file(self, file_hash, page_num, strategy):
+        return os.path.join(self._document_dir(file_hash), f"{page_num}.{strategy}.json")
+
+    def _touch(self, file_hash):
+        # Caller holds _lock
+        if file_hash in self._sizes:
+            self._sizes.move_to_end(file_hash)
+        try:
+            os.utime(self._document_dir(file_hash))
+        except OSError:
+            pass
+
+    def get(self, file_hash, page_num, strategy):
+        """The cached [category, text] elements of a page, None if the page isn't cached"""
+        path = self._page_file(file_hash, page_num, strategy)
+        if not os.path.exists(path):
+            CACHE_EVENTS.inc(cache="partition_pages", result="miss")
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                elements = json.load(f)
+            CACHE_EVENTS.inc(cache="partition_pages", result="hit")
+            with self._lock:
+                self._touch(file_hash)
+            return elements
+        except Exception as e:
+            logger.error(f"Error reading cached partition of page {page_num}: {e}")
+            CACHE_EVENTS.inc(cache="partition_pages", result="miss")
+            return None
+
+    def set(self, file_hash, page_num, strategy, elements):
+        path = self._page_file(file_hash, page_num, strategy)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(elements, f, ensure_ascii=False)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(path + ".tmp", path)
+            added = os.path.getsize(path) - previous
+        except Exception as e:
+            logger.error(f"Error caching partition of page {page_num}: {e}")
+            return
+
+        with self._lock:
+            self._sizes[file_hash] = self._sizes.get(file_hash, 0) + added
+            self._total_bytes += added
+            self._touch(file_hash)
+            # Evict the least recently used documents, never the one being written
+            while self.max_bytes and self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+                evicted = next(iter(self._sizes))
+                if evicted == file_hash:
+                    break
+                self._remove_unlocked(evicted)
+                logger.info(f"Evicted cached partition of {evicted}")
+
+    def remove(self, file_hash):
+        with self._lock:
+            self._remove_unlocked(file_hash)
+
+    def _remove_unlocked(self, file_hash):
+        self._total_bytes -= self._sizes.pop(file_hash, 0)
+        path = self._document_dir(file_hash)
+        if os.path.isdir(path):
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                logger.error(f"Error removing cached partition of {file_hash}: {e}")
+
+    def _load(self):
+        documents = []
+        for name in os.listdir(self.cache_path):
+            path = self._document_dir(name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                documents.append((os.path.getmtime(path), name, size))
+            except OSError as e:
+                logger.error(f"Error reading cached partition {name}: {e}")
+        for _, name, size in sorted(documents):
+            self._sizes[name] = size
+            self._total_bytes += size
+        logger.info(f"Partition cache loaded with {len(self._sizes)} documents ({self._total_bytes} bytes)")
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import queue
+import logging
+import tempfile
+import threading
+import subprocess
+from pypdf import PdfReader, PdfWriter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Child process for the unstructured partitioning of the semantic method. A partition call can't be interrupted inside
+a thread, so partitioning runs in a worker process and a page range that exceeds its time budget is handled by
+killing the worker (the next range starts a new one). The PDFProcessor keeps one long-lived worker, so unstructured
+and its models are imported once instead of for every document, and sends it one range at a time. The budget only
+counts the time the range is actually being partitioned: the worker is started and has imported unstructured before
+the range is sent, and the wait for other documents' ranges isn't counted.
+
+The worker runs as `python -m utils.partition_worker` and talks JSON lines over stdin/stdout:
+    {"ready": true}                                              once unstructured is imported
+    {"file_path": ..., "pages": [...], "strategy": ...}         a range to partition
+    {"elements": {"<page>": [[category, text], ...]}}           or {"error": "..."}
+"""
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PartitionTimeout(Exception):
+    pass
+
+
+def partition_range(file_path, pages, strategy):
+    """Partition consecutive pages with one strategy, returns {page number: [[category, text], ...]}"""
+    from unstructured.partition.pdf import partition_pdf
+
+    # Write the pages to a temporary PDF, unstructured partitions whole files
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for page_num in pages:
+        writer.add_page(reader.pages[page_num - 1])
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        writer.write(tmp)
+        range_path = tmp.name
+
+    try:
+        elements = partition_pdf(
+            filename=range_path,
+            strategy=strategy,
+            extract_images_in_pdf=False,
+            infer_table_structure=strategy == "hi_res"
+        )
+    finally:
+        os.remove(range_path)
+
+    page_elements = {page_num: [] for page_num in pages}
+    for element in elements:
+        range_page = getattr(element.metadata, "page_number", None) if hasattr(element, "metadata") else None
+        page_num = pages[min(max(range_page or 1, 1), len(pages)) - 1]
+        page_elements[page_num].append([getattr(element, "category", "") or "", str(element)])
+    return page_elements
+
+
+class PartitionWorker:
+    def __init__(self, startup_timeout=120):
+        self.startup_timeout = startup_timeout
+        self._process = None
+        self._replies = None
+        self._failed = None  # Startup error reported by the worker (unstructured missing), it isn't restarted after it
+
+    def ensure_started(self):
+        """Start the worker (and import unstructured in it) unless it is running, startup errors are kept"""
+        if self._failed:
+            raise RuntimeError(self._failed)
+        if self._process is not None and self._process.poll() is None:
+            return
+        try:
+            self._start()
+        except PartitionTimeout:
+            # A slow import, the next range tries again
+            self.close()
+            raise
+        except Exception as e:
+            self._failed = str(e)
+            self.close()
+            raise
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "utils.partition_worker"],
+            cwd=BACKEND_DIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8"
+        )
+        self._replies = queue.Queue()
+        threading.Thread(
+            target=self._read_replies, args=(self._process, self._replies), daemon=True, name="partition-reader"
+        ).start()
+        reply = self._reply(self.startup_timeout)
+        if not reply.get("ready"):
+            raise RuntimeError(reply.get("error", "partition worker didn't start"))
+
+    @staticmethod
+    def _read_replies(process, replies):
+        for line in process.stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                continue
+        replies.put({"error": f"partition worker exited with code {process.wait()}"})
+
+    def _reply(self, timeout):
+        try:
+            return self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise PartitionTimeout(f"no reply from the partition worker in {timeout:.1f}s")
+
+    def partition(self, file_path, pages, strategy, timeout=None):
+        """Partition a page range in the worker, raises PartitionTimeout (and kills the worker) past the timeout"""
+        self.ensure_started()
+        job = {"file_path": os.path.abspath(file_path), "pages": pages, "strategy": strategy}
+        self._process.stdin.write(json.dumps(job) + "\n")
+        self._process.stdin.flush()
+        reply = self._reply(timeout)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return {int(page_num): elements for page_num, elements in reply["elements"].items()}
+
+    def close(self):
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process = None
+
+
+def main():
+    # unstructured and its native dependencies may print, keep the original stdout for the replies only
+    replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def send(message):
+        replies.write(json.dumps(message, ensure_ascii=False) + "\n")
+        replies.flush()
+
+    try:
+        from unstructured.partition.pdf import partition_pdf  # noqa: F401, imported once before the first range
+    except Exception as e:
+        send({"error": f"unstructured is not available: {e}"})
+        return
+    send({"ready": True})
+
+    for line in sys.stdin:
+        try:
+            job = json.loads(line)
+            send({"elements": partition_range(job["file_path"], job["pages"], job["strategy"])})
+        except Exception as e:
+            send({"error": str(e)})
+
+
+if __name__ == "__main__":
+    main()
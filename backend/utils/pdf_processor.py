@@ -1,8 +1,15 @@
 import os
+import re
+import time
+import bisect
 from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 import uuid
 import logging
+import threading
+from utils.metrics import registry, track_stage, CHUNKS, PAGES
+from utils.partition_cache import file_content_hash
+from utils.partition_worker import PartitionWorker, PartitionTimeout
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,19 +22,51 @@ The main functions are:
 3. chunk_text: Split the text into smaller chunks.
 4. map_chunks_to_pages: Map the chunks to their source pages.
 5. process_pdf: Process the PDF
+6. iter_chunks and process_pdf_stream: Bounded-memory ingestion for very large PDFs. Pages are read in windows and
+   chunks are yielded as soon as they can no longer change, so the full text and chunk list are never built.
 
 Now we have 3 extract and process methods for each of the processing methods standard, semantic and layout.
 
 standard: Uses PyPDF to extract text and chunk it.
-semantic: Uses unstructured to extract text and chunk it based on headers.
-layout: Uses pytesseract to extract text and chunk it based on layout.
+semantic: Uses unstructured to extract text and chunk it based on headers. A pre-scan of the pypdf text layer picks the
+    partition strategy of every page (fast for prose, hi_res with table inference for table-like pages, ocr_only for
+    scanned pages), each page range has a time budget and partitioned pages are cached.
+layout: Uses the pypdf text layer where it is good enough and pytesseract OCR for the other pages, then chunks based on layout.
 """
 
+PARTITION_STRATEGIES = ("auto", "fast", "hi_res", "ocr_only")
+MAX_PARTITION_RANGE_PAGES = 10  # Pages partitioned in one unstructured call
+
+PARTITION_PAGES = registry.counter(
+    "rag_partition_pages_total", "Pages partitioned by the semantic method, by strategy", ("strategy",)
+)
+PARTITION_PAGE_SECONDS = registry.histogram(
+    "rag_partition_page_seconds", "Partition time per page of the semantic method, by strategy", ("strategy",)
+)
+
 class PDFProcessor:
-    def __init__(self, pdf_storage_path, chunk_size=1000, chunk_overlap=200):
+    def __init__(self, pdf_storage_path, chunk_size=1000, chunk_overlap=200, stream_window_pages=20,
+                 ocr_quality_threshold=0.6, ocr_min_page_chars=50, partition_strategy="auto", table_score_threshold=0.3,
+                 partition_page_timeout=30, partition_cache=None):
         self.pdf_storage_path = pdf_storage_path
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.stream_window_pages = stream_window_pages
+        # Layout method: pages whose text layer scores below the threshold (or is too short) are OCRed
+        self.ocr_quality_threshold = ocr_quality_threshold
+        self.ocr_min_page_chars = ocr_min_page_chars
+        # Semantic method: "auto" picks the strategy per page, the others force one strategy for every page
+        if partition_strategy not in PARTITION_STRATEGIES:
+            logger.warning(f"Unknown partition strategy {partition_strategy}, using auto")
+            partition_strategy = "auto"
+        self.partition_strategy = partition_strategy
+        self.table_score_threshold = table_score_threshold
+        self.partition_page_timeout = partition_page_timeout  # Seconds per page of a range, 0 disables the budget
+        self.partition_cache = partition_cache  # Optional PartitionCache of the partitioned pages
+        # One long-lived worker process partitions the ranges of every document, one range at a time. It is only
+        # restarted after it was killed for exceeding a budget (or exited), so unstructured is imported once.
+        self.partition_worker = PartitionWorker()
+        self._partition_lock = threading.Lock()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size, 
             chunk_overlap=self.chunk_overlap
@@ -89,44 +128,219 @@ class PDFProcessor:
             logger.error(f"Error extracting text from PDF: {e}")
             raise
     
-    def extract_text_with_structure(self, file_path):
+    def count_pages(self, file_path):
+        return len(PdfReader(file_path).pages)
+    
+    def iter_page_texts(self, file_path):
+        # Yield (page number, text) one page at a time
+        pdf = PdfReader(file_path)
+        for i, page in enumerate(pdf.pages):
+            yield i + 1, page.extract_text() or ""
+    
+    def iter_chunks(self, file_path, window_pages=None):
+        """Yield chunk records (index, text, start/end offsets, pages, pages_read) reading the PDF in page windows"""
+        window_pages = window_pages or self.stream_window_pages
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            add_start_index=True
+        )
+        
+        buffer = ""  # Text that hasn't been turned into final chunks yet
+        buffer_offset = 0  # Position of buffer[0] in the full document text
+        page_spans = []  # (page number, start, end) in full document positions, for the pages still in the buffer
+        chunk_index = 0
+        pages_read = 0
+        
+        def split_buffer(final):
+            # The splitter cuts the text at "\n\n" into pieces and merges them greedily. Only the last chunk can
+            # still change when the next window is appended (every buffered page ends with "\n\n"), and splitting
+            # again from the first piece of a chunk reproduces that chunk and everything after it. So the chunks
+            # before the last chunk's first piece are emitted and the rest is re-split with the next window,
+            # which gives exactly the chunks of splitting the whole document at once.
+            nonlocal buffer, buffer_offset, page_spans, chunk_index
+            docs = splitter.create_documents([buffer])
+            if final or not docs:
+                cutoff = len(buffer) if final else 0
+            else:
+                piece_starts = [0] + [m.start() for m in re.finditer("\n\n", buffer) if m.start() > 0]
+                last_start = docs[-1].metadata["start_index"]
+                cutoff = piece_starts[bisect.bisect_right(piece_starts, last_start) - 1]
+            for doc in docs:
+                start = doc.metadata["start_index"]
+                if start >= cutoff and not final:
+                    break
+                if not doc.page_content.strip():
+                    continue
+                chunk_start = buffer_offset + start
+                chunk_end = chunk_start + len(doc.page_content)
+                yield {
+                    "index": chunk_index,
+                    "text": doc.page_content,
+                    "start": chunk_start,
+                    "end": chunk_end,
+                    "pages": [page for page, page_start, page_end in page_spans if page_start < chunk_end and page_end > chunk_start],
+                    "pages_read": pages_read
+                }
+                chunk_index += 1
+            
+            buffer = buffer[cutoff:]
+            buffer_offset += cutoff
+            page_spans = [span for span in page_spans if span[2] > buffer_offset]
+        
+        for page_num, page_text in self.iter_page_texts(file_path):
+            page_start = buffer_offset + len(buffer)
+            buffer += page_text + "\n\n"
+            page_spans.append((page_num, page_start, page_start + len(page_text)))
+            pages_read = page_num
+            
+            if page_num % window_pages == 0:
+                yield from split_buffer(final=False)
+        
+        yield from split_buffer(final=True)
+    
+    def process_pdf_stream(self, file_info):
+        """Prepare a streaming ingestion, returns (chunk iterator, file_info). Only the standard method streams."""
+        logger.info(f"🌊 Starting streaming processing for '{file_info['name']}'")
+        file_info["pages"] = self.count_pages(file_info["path"])
+        file_info["processing_method"] = "standard"
+        file_info["status"] = "processing"
+        return self.iter_chunks(file_info["path"]), file_info
+    
+    def table_likeness(self, text):
+        """Cheap 0-1 score of how much of a page's text layer looks like table rows (mostly numeric cells)"""
+        lines = [line.split() for line in text.splitlines() if line.strip()] if text else []
+        if not lines:
+            return 0.0
+        
+        def numeric(token):
+            digits = sum(1 for c in token if c.isdigit())
+            return digits > 0 and digits + sum(1 for c in token if c in ".,%$()+-/") >= 0.6 * len(token)
+        
+        rows = sum(1 for tokens in lines if len(tokens) >= 3 and 2 * sum(map(numeric, tokens)) >= len(tokens))
+        if rows < 3:
+            return 0.0
+        return rows / len(lines)
+    
+    def plan_partition(self, pdf):
+        """Pre-scan the pypdf text layer of every page and pick its partition strategy.
+        Returns [(page number, strategy, text layer)]"""
+        plan = []
+        for i, page in enumerate(pdf.pages):
+            try:
+                layer_text = page.extract_text() or ""
+            except Exception as e:
+                logger.warning(f"Error reading text layer of page {i + 1}: {e}")
+                layer_text = ""
+            
+            if self.partition_strategy != "auto":
+                strategy = self.partition_strategy
+            elif self.table_likeness(layer_text) >= self.table_score_threshold:
+                strategy = "hi_res"  # Only pages that look like tables pay for table structure inference
+            elif self.text_layer_quality(layer_text) < self.ocr_quality_threshold:
+                strategy = "ocr_only"  # Scanned page, there is no usable text layer to read
+            else:
+                strategy = "fast"
+            plan.append((i + 1, strategy, layer_text))
+        return plan
+    
+    def partition_pages(self, file_path, page_report=None, file_hash=None):
+        """Partition every page with its planned strategy, reusing cached pages.
+        Returns ({page number: [[category, text], ...]}, number of pages). A row per page (strategy, seconds,
+        cached) is appended to page_report."""
+        pdf = PdfReader(file_path)
+        plan = self.plan_partition(pdf)
+        layer_texts = {page_num: layer_text for page_num, _, layer_text in plan}
+        if self.partition_cache and not file_hash:
+            file_hash = file_content_hash(file_path)
+        page_elements = {}
+        report = {}
+        
+        # Cached pages are reused, the others are grouped in ranges of consecutive pages with the same strategy
+        ranges = []
+        for page_num, strategy, _ in plan:
+            cached = self.partition_cache.get(file_hash, page_num, strategy) if self.partition_cache else None
+            if cached is not None:
+                page_elements[page_num] = cached
+                report[page_num] = {"page": page_num, "strategy": strategy, "seconds": 0.0, "cached": True}
+            elif (ranges and ranges[-1][0] == strategy and ranges[-1][1][-1] == page_num - 1
+                    and len(ranges[-1][1]) < MAX_PARTITION_RANGE_PAGES):
+                ranges[-1][1].append(page_num)
+            else:
+                ranges.append((strategy, [page_num]))
+        
+        # Ranges are partitioned in the shared worker process, killed when a range exceeds its budget
+        for strategy, pages in ranges:
+            used = strategy
+            timeout = self.partition_page_timeout * len(pages) if self.partition_page_timeout else None
+            start_time = time.time()
+            try:
+                with self._partition_lock:
+                    self.partition_worker.ensure_started()
+                    # The budget and the cost only count the partitioning itself, not the wait for the worker
+                    start_time = time.time()
+                    range_elements = self.partition_worker.partition(file_path, pages, strategy, timeout)
+            except Exception as e:
+                if isinstance(e, PartitionTimeout):
+                    logger.warning(f"Partitioning pages {pages[0]}-{pages[-1]} with {strategy} exceeded "
+                                   f"{timeout:.1f}s, using the text layer")
+                else:
+                    logger.error(f"Error partitioning pages {pages[0]}-{pages[-1]} with {strategy}: {e}")
+                used = "text_layer"
+                range_elements = {
+                    page_num: [["NarrativeText", layer_texts[page_num]]] if layer_texts[page_num].strip() else []
+                    for page_num in pages
+                }
+            
+            seconds = (time.time() - start_time) / len(pages)
+            for page_num in pages:
+                page_elements[page_num] = range_elements[page_num]
+                report[page_num] = {
+                    "page": page_num, "strategy": used, "seconds": round(seconds, 3), "cached": False
+                }
+                if used != strategy:
+                    report[page_num]["planned"] = strategy
+                elif self.partition_cache:
+                    self.partition_cache.set(file_hash, page_num, strategy, range_elements[page_num])
+                PARTITION_PAGES.inc(strategy=used)
+                PARTITION_PAGE_SECONDS.observe(seconds, strategy=used)
+        
+        if page_report is not None:
+            page_report.extend(report[page_num] for page_num in sorted(report))
+        counts = {}
+        for row in report.values():
+            counts[row["strategy"]] = counts.get(row["strategy"], 0) + 1
+        cached = sum(1 for row in report.values() if row["cached"])
+        logger.info(f"Partitioned {len(plan)} pages ({cached} cached), strategies: {counts}")
+        return page_elements, len(plan)
+    
+    def extract_text_with_structure(self, file_path, page_report=None, file_hash=None):
         try:
-            from unstructured.partition.auto import partition_auto
-            elements_auto = partition_auto(
-                file_path,
-                extract_images_in_pdf=False,
-                infer_table_structure=True
-            )
+            from unstructured.partition.pdf import partition_pdf  # noqa: F401, fall back early without unstructured
+            page_elements, num_pages = self.partition_pages(file_path, page_report, file_hash)
             
             # Group elements by type and page
             structured_text = ""
             page_map = {}
             current_pos = 0
-            text_elements = []
             
             # Get headers to create markdown structure
             headers = []
-            current_page = 1
             page_texts = {}
             
-            for element in elements_auto:
-                element_text = str(element)
-                # Check if this element is from a different page
-                page_num = element.metadata.page_number if hasattr(element, "metadata") and hasattr(element.metadata, "page_number") else current_page
-                
-                # Initialize page text if needed
-                if page_num not in page_texts:
-                    page_texts[page_num] = ""
-                
-                # Add element text to the corresponding page
-                if hasattr(element, "category") and element.category == "Title":
-                    level = min(3, 1 + element_text.count('.'))  # Estimate heading level
-                    page_texts[page_num] += f"{'#' * level} {element_text}\n\n"
-                    headers.append((element_text, f"Header {level}"))
-                else:
-                    page_texts[page_num] += element_text + "\n\n"
-                
-                current_page = max(current_page, page_num)
+            for page_num in sorted(page_elements):
+                for category, element_text in page_elements[page_num]:
+                    # Initialize page text if needed
+                    if page_num not in page_texts:
+                        page_texts[page_num] = ""
+                    
+                    # Add element text to the corresponding page
+                    if category == "Title":
+                        level = min(3, 1 + element_text.count('.'))  # Estimate heading level
+                        page_texts[page_num] += f"{'#' * level} {element_text}\n\n"
+                        headers.append((element_text, f"Header {level}"))
+                    else:
+                        page_texts[page_num] += element_text + "\n\n"
             
             # Combine all page texts with page markers
             for page_num in sorted(page_texts.keys()):
@@ -138,7 +352,7 @@ class PDFProcessor:
                 current_pos += len(page_text)
                 page_map[page_num] = (page_start, current_pos)
             
-            return structured_text, page_map, current_page, headers
+            return structured_text, page_map, num_pages, headers
             
         except Exception as e:
             logger.error(f"Error extracting structured text from PDF: {e}")
@@ -148,70 +362,122 @@ class PDFProcessor:
             # Return empty headers list
             return text, page_map, num_pages, []
     
+    def text_layer_quality(self, text):
+        """Cheap 0-1 score of how usable a page's text layer is (0 means the page needs OCR)"""
+        stripped = text.strip() if text else ""
+        if len(stripped) < self.ocr_min_page_chars:
+            return 0.0
+        
+        # Broken font encodings show up as (cid:NN) sequences or replacement characters
+        garbage = stripped.count("(cid:") * 6 + stripped.count("\ufffd")
+        if garbage / len(stripped) > 0.05:
+            return 0.0
+        
+        # Share of characters that are letters, digits, whitespace or common punctuation
+        printable = sum(1 for c in stripped if c.isalnum() or c.isspace() or c in ".,;:!?'\"()[]-%$/&")
+        printable_ratio = printable / len(stripped)
+        
+        # Share of tokens that look like words (contain letters, reasonable length)
+        tokens = stripped.split()
+        wordlike = sum(1 for t in tokens if 1 < len(t) <= 25 and any(c.isalpha() for c in t))
+        wordlike_ratio = wordlike / len(tokens) if tokens else 0.0
+        
+        return 0.5 * printable_ratio + 0.5 * wordlike_ratio
+    
+    def _configure_ocr(self):
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+        poppler_path = r"C:\Program Files\poppler-24.08.0\Library\bin"
+        return poppler_path
+    
+    def _ocr_page_text(self, image):
+        """OCR one page image into markdown-ish text, marking likely headings"""
+        import pytesseract
+        
+        # Simple layout detection parameters
+        min_line_height = 30  # Pixels
+        title_font_size_threshold = 15  # Tesseract's font size estimation
+        page_text = ""
+        
+        # Get OCR data with detailed info
+        ocr_data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+        
+        # Group by line
+        line_boxes = {}
+        for j in range(len(ocr_data['text'])):
+            if not ocr_data['text'][j].strip():
+                continue
+            
+            # Group by line number
+            line_num = ocr_data['line_num'][j]
+            if line_num not in line_boxes:
+                line_boxes[line_num] = {
+                    'text': [],
+                    'conf': [],
+                    'height': ocr_data['height'][j],
+                    'font_size': float(ocr_data['conf'][j]) if ocr_data['conf'][j] != '-1' else 0
+                }
+            
+            line_boxes[line_num]['text'].append(ocr_data['text'][j])
+            line_boxes[line_num]['conf'].append(int(ocr_data['conf'][j]) if ocr_data['conf'][j] != '-1' else 0)
+        
+        # Process lines in order
+        for line_num in sorted(line_boxes.keys()):
+            line = line_boxes[line_num]
+            text = ' '.join(line['text'])
+            
+            # Skip empty lines
+            if not text.strip():
+                continue
+            
+            # Determine if this is a heading based on font size or height
+            if (line['height'] > min_line_height or line['font_size'] > title_font_size_threshold) and len(text) < 100:
+                # This is likely a heading
+                page_text += f"# {text.strip()}\n\n"
+            else:
+                # Regular paragraph
+                page_text += f"{text.strip()}\n\n"
+        
+        return page_text
+    
     def extract_with_layout(self, file_path):
-        """Extract text with basic layout awareness using pytesseract directly"""
+        """Text-layer-first extraction: pages with a good pypdf text layer are used as is, only the others are OCRed.
+        Returns (text, page_map, num_pages, headers, ocr_pages)"""
         try:
             import pdf2image
-            import pytesseract
-
-            pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-            poppler_path = r"C:\Program Files\poppler-24.08.0\Library\bin"
             
-            # Convert PDF to images
-            images = pdf2image.convert_from_path(file_path, poppler_path=poppler_path)
+            poppler_path = self._configure_ocr()
+            pdf = PdfReader(file_path)
             
             structured_text = ""
             page_map = {}
             current_pos = 0
-            
-            # Simple layout detection parameters
-            min_line_height = 30  # Pixels
-            title_font_size_threshold = 15  # Tesseract's font size estimation
+            ocr_pages = []
             
             # Process each page
-            for i, image in enumerate(images):
+            for i, page in enumerate(pdf.pages):
                 page_num = i + 1
                 page_start = current_pos
-                page_text = ""
                 
-                # Get OCR data with detailed info
-                ocr_data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                
-                # Group by line
-                line_boxes = {}
-                for j in range(len(ocr_data['text'])):
-                    if not ocr_data['text'][j].strip():
-                        continue
-                    
-                    # Group by line number
-                    line_num = ocr_data['line_num'][j]
-                    if line_num not in line_boxes:
-                        line_boxes[line_num] = {
-                            'text': [],
-                            'conf': [],
-                            'height': ocr_data['height'][j],
-                            'font_size': float(ocr_data['conf'][j]) if ocr_data['conf'][j] != '-1' else 0
-                        }
-                    
-                    line_boxes[line_num]['text'].append(ocr_data['text'][j])
-                    line_boxes[line_num]['conf'].append(int(ocr_data['conf'][j]) if ocr_data['conf'][j] != '-1' else 0)
+                # Try the text layer first, it is orders of magnitude cheaper than rasterizing and OCR
+                try:
+                    layer_text = page.extract_text() or ""
+                except Exception as e:
+                    logger.warning(f"Error reading text layer of page {page_num}: {e}")
+                    layer_text = ""
                 
-                # Process lines in order
-                for line_num in sorted(line_boxes.keys()):
-                    line = line_boxes[line_num]
-                    text = ' '.join(line['text'])
-                    
-                    # Skip empty lines
-                    if not text.strip():
-                        continue
-                    
-                    # Determine if this is a heading based on font size or height
-                    if (line['height'] > min_line_height or line['font_size'] > title_font_size_threshold) and len(text) < 100:
-                        # This is likely a heading
-                        page_text += f"# {text.strip()}\n\n"
-                    else:
-                        # Regular paragraph
-                        page_text += f"{text.strip()}\n\n"
+                if self.text_layer_quality(layer_text) >= self.ocr_quality_threshold:
+                    page_text = layer_text.strip() + "\n\n"
+                else:
+                    # Rasterize and OCR only this page
+                    images = pdf2image.convert_from_path(
+                        file_path,
+                        first_page=page_num,
+                        last_page=page_num,
+                        poppler_path=poppler_path
+                    )
+                    page_text = self._ocr_page_text(images[0]) if images else ""
+                    ocr_pages.append(page_num)
                 
                 # Add the page text to the full document text
                 structured_text += page_text
@@ -220,12 +486,15 @@ class PDFProcessor:
                 # Map this page's position in the full text
                 page_map[page_num] = (page_start, current_pos)
             
-            return structured_text, page_map, len(images), []
+            PAGES.inc(len(ocr_pages), source="ocr")
+            PAGES.inc(len(pdf.pages) - len(ocr_pages), source="text_layer")
+            logger.info(f"OCRed {len(ocr_pages)} of {len(pdf.pages)} pages, used the text layer for the rest")
+            return structured_text, page_map, len(pdf.pages), [], ocr_pages
                 
         except Exception as e:
             logger.error(f"Error in simplified layout-aware processing: {e}")
             # Fall back to structured extraction
-            return self.extract_text_with_structure(file_path)
+            return (*self.extract_text_with_structure(file_path), [])
 
     def chunk_text(self, text, method="recursive"):
         try:
@@ -267,16 +536,21 @@ class PDFProcessor:
     
     def map_chunks_to_pages(self, chunks, text, page_map):
         chunk_page_map = []
+        search_from = 0
         
-        # For each chunk, find which page it comes from
+        # For each chunk, find which page it comes from. Chunks are in text order, so searching on from the previous
+        # chunk maps repeated text (headers, footers) to its own occurrence
         for chunk in chunks:
-            chunk_start = text.find(chunk)
+            chunk_start = text.find(chunk, search_from)
+            if chunk_start == -1:
+                chunk_start = text.find(chunk)
             if chunk_start == -1:
                 # If exact match not found, this is a fallback
                 chunk_page_map.append({"chunk": chunk, "pages": []})
                 continue
                 
             chunk_end = chunk_start + len(chunk)
+            search_from = chunk_start + 1
             chunk_pages = []
             
             # Check which pages contain this chunk
@@ -285,9 +559,12 @@ class PDFProcessor:
                 if not (chunk_end < page_start or chunk_start > page_end):
                     chunk_pages.append(page_num)
             
+            # start/end are the chunk's character offsets in the document text, for citations
             chunk_page_map.append({
                 "chunk": chunk, 
-                "pages": chunk_pages
+                "pages": chunk_pages,
+                "start": chunk_start,
+                "end": chunk_end
             })
         
         return chunk_page_map
@@ -298,13 +575,16 @@ class PDFProcessor:
             file_path = file_info["path"]
             
             # Extract text from PDF using standard method
-            text, page_map, num_pages = self.extract_text(file_path)
+            with track_stage("upload", "extract"):
+                text, page_map, num_pages = self.extract_text(file_path)
             
             # Chunk the text using recursive character splitting
-            chunks = self.chunk_text(text, "recursive")
+            with track_stage("upload", "chunk"):
+                chunks = self.chunk_text(text, "recursive")
             
             # Map chunks to pages
-            chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
+            with track_stage("upload", "page_mapping"):
+                chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
             
             # Update file info
             file_info["pages"] = num_pages
@@ -324,22 +604,32 @@ class PDFProcessor:
             logger.info(f"📚 Starting semantic processing for '{file_info['name']}'")
             file_path = file_info["path"]
             
-            # Extract text from PDF using structure-aware method
-            text, page_map, num_pages, headers = self.extract_text_with_structure(file_path)
+            # Extract text from PDF using structure-aware method. The content hash keys the cached pages, the vector
+            # store uses it to delete them with the file
+            if self.partition_cache:
+                file_info["content_hash"] = file_content_hash(file_path)
+            partition_pages = []
+            with track_stage("upload", "extract"):
+                text, page_map, num_pages, headers = self.extract_text_with_structure(
+                    file_path, partition_pages, file_info.get("content_hash")
+                )
             
             # Chunk the text using markdown-aware splitting if we found headers
-            if headers:
-                chunks = self.chunk_text(text, "markdown")
-            else:
-                chunks = self.chunk_text(text, "recursive")
+            with track_stage("upload", "chunk"):
+                if headers:
+                    chunks = self.chunk_text(text, "markdown")
+                else:
+                    chunks = self.chunk_text(text, "recursive")
             
             # Map chunks to pages
-            chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
+            with track_stage("upload", "page_mapping"):
+                chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
             
             # Update file info
             file_info["pages"] = num_pages
             file_info["status"] = "processed"
             file_info["processing_method"] = "semantic"
+            file_info["partition_pages"] = partition_pages  # Strategy and cost of every page
             
             return chunks, chunk_page_map, file_info
             
@@ -356,18 +646,22 @@ class PDFProcessor:
             file_path = file_info["path"]
             
             # Extract text from PDF using layout-aware method
-            text, page_map, num_pages, _ = self.extract_with_layout(file_path)
+            with track_stage("upload", "extract"):
+                text, page_map, num_pages, _, ocr_pages = self.extract_with_layout(file_path)
             
             # Chunk the text (we'll use markdown chunking since the layout extraction adds markdown)
-            chunks = self.chunk_text(text, "markdown") 
+            with track_stage("upload", "chunk"):
+                chunks = self.chunk_text(text, "markdown") 
             
             # Map chunks to pages
-            chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
+            with track_stage("upload", "page_mapping"):
+                chunk_page_map = self.map_chunks_to_pages(chunks, text, page_map)
             
             # Update file info
             file_info["pages"] = num_pages
             file_info["status"] = "processed"
             file_info["processing_method"] = "layout"
+            file_info["ocr_pages"] = ocr_pages
             
             return chunks, chunk_page_map, file_info
             
@@ -384,10 +678,10 @@ class PDFProcessor:
             processor = self.processors[method]
 
             # Process using selected method and time it
-            import time
             start_time = time.time()
             result = processor(file_info)
             elapsed_time = time.time() - start_time
+            CHUNKS.inc(len(result[0]), operation="produced")
             
             # Log the processing result
             logger.info(f"✅ Processed PDF '{file_info['name']}' with {method} method in {elapsed_time:.2f}s")
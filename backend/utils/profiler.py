@@ -0,0 +1,139 @@
+import os
+import io
+import re
+import time
+import uuid
+import cProfile
+import pstats
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+On demand profiling of single requests, so a slow PDF or query can be diagnosed in production without redeploying.
+A request is profiled when it carries the profiling header (and header profiling is enabled), or when an admin
+has armed profiling for the next few requests. Profiles are cProfile dumps stored in a bounded on-disk ring.
+
+The main functions are:
+1. should_profile: Decides if the current request is profiled, consuming an armed slot if needed.
+2. run: Runs a function under cProfile and stores the profile.
+3. list_profiles: Lists the stored profiles, newest first.
+4. get_profile_path and render_profile: Access a stored profile as a raw dump or as a pstats text report.
+"""
+
+# Profile file names look like <timestamp>_<endpoint>_<short id>.prof
+PROFILE_NAME_PATTERN = re.compile(r"^(\d+)_([a-z_]+)_([0-9a-f]{8})\.prof$")
+
+
+class RequestProfiler:
+    def __init__(self, profile_storage_path, max_profiles=20, header_enabled=False):
+        self.profile_storage_path = profile_storage_path
+        self.max_profiles = max_profiles
+        self.header_enabled = header_enabled
+        self.armed_requests = 0
+        self._lock = threading.Lock()
+        # cProfile can only have one active profiler at a time, so profiled requests are serialized
+        self._profile_lock = threading.Lock()
+        os.makedirs(self.profile_storage_path, exist_ok=True)
+
+    def configure(self, header_enabled=None, armed_requests=None):
+        """Admin toggle: enable header profiling and/or arm profiling for the next N requests"""
+        with self._lock:
+            if header_enabled is not None:
+                self.header_enabled = bool(header_enabled)
+            if armed_requests is not None:
+                self.armed_requests = max(0, int(armed_requests))
+            return self.status()
+
+    def status(self):
+        return {
+            "headerEnabled": self.header_enabled,
+            "armedRequests": self.armed_requests,
+            "maxProfiles": self.max_profiles,
+        }
+
+    def should_profile(self, header_requested=False):
+        with self._lock:
+            if header_requested and self.header_enabled:
+                return True
+            if self.armed_requests > 0:
+                self.armed_requests -= 1
+                return True
+            return False
+
+    def run(self, endpoint, func, *args, **kwargs):
+        """Run func under cProfile. Returns (result, profile_name), profile_name is None if not profiled."""
+        # Another request is already being profiled, run this one normally
+        if not self._profile_lock.acquire(blocking=False):
+            logger.warning(f"Profiler busy, running {endpoint} request without profiling")
+            return func(*args, **kwargs), None
+
+        profiler = cProfile.Profile()
+        start_time = time.time()
+        try:
+            profiler.enable()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.disable()
+            profile_name = self._save_profile(profiler, endpoint, start_time)
+            return result, profile_name
+        finally:
+            self._profile_lock.release()
+
+    def _save_profile(self, profiler, endpoint, start_time):
+        try:
+            safe_endpoint = re.sub(r"[^a-z_]", "_", endpoint.lower())
+            profile_name = f"{int(start_time * 1000)}_{safe_endpoint}_{uuid.uuid4().hex[:8]}.prof"
+            profiler.dump_stats(os.path.join(self.profile_storage_path, profile_name))
+            logger.info(f"Saved profile {profile_name} ({time.time() - start_time:.2f}s)")
+            self._enforce_ring()
+            return profile_name
+        except Exception as e:
+            logger.error(f"Error saving profile: {e}")
+            return None
+
+    def _enforce_ring(self):
+        # Drop the oldest profiles once we go over the limit
+        profiles = self.list_profiles()
+        for profile in profiles[self.max_profiles:]:
+            try:
+                os.remove(os.path.join(self.profile_storage_path, profile["name"]))
+            except OSError as e:
+                logger.error(f"Error removing old profile {profile['name']}: {e}")
+
+    def list_profiles(self):
+        profiles = []
+        for name in os.listdir(self.profile_storage_path):
+            match = PROFILE_NAME_PATTERN.match(name)
+            if not match:
+                continue
+            profiles.append({
+                "name": name,
+                "endpoint": match.group(2),
+                "created": int(match.group(1)) / 1000,
+                "size": os.path.getsize(os.path.join(self.profile_storage_path, name)),
+            })
+        profiles.sort(key=lambda p: p["created"], reverse=True)
+        return profiles
+
+    def get_profile_path(self, profile_name):
+        # Only names we generated are served, this also rules out path traversal
+        if not PROFILE_NAME_PATTERN.match(profile_name):
+            return None
+        path = os.path.join(self.profile_storage_path, profile_name)
+        return path if os.path.exists(path) else None
+
+    def render_profile(self, profile_name, sort_by="cumulative", limit=50):
+        """Render a stored profile as a pstats text report"""
+        path = self.get_profile_path(profile_name)
+        if not path:
+            return None
+        if sort_by not in pstats.Stats.sort_arg_dict_default:
+            sort_by = "cumulative"
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats(sort_by).print_stats(limit)
+        return output.getvalue()
@@ -0,0 +1,41 @@
+import bisect
+import hashlib
+
+"""
+Consistent hashing of file ids to vector store shards.
+Every shard owns a number of virtual nodes on a hash ring and a file belongs to the first node clockwise of its
+own hash. Adding or removing a shard only moves the files of the neighbouring ring segments (about 1/N of the
+files), which keeps offline rebalancing cheap.
+"""
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, num_shards, virtual_nodes=160):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards
+        self.virtual_nodes = virtual_nodes
+        nodes = sorted(
+            (_ring_hash(f"shard-{shard}-vnode-{vnode}"), shard)
+            for shard in range(num_shards)
+            for vnode in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in nodes]
+        self._shards = [shard for _, shard in nodes]
+
+    def shard_for(self, file_id):
+        if self.num_shards == 1:
+            return 0
+        index = bisect.bisect(self._hashes, _ring_hash(str(file_id))) % len(self._hashes)
+        return self._shards[index]
+
+    def group_by_shard(self, file_ids):
+        """Map shard index -> list of the given file ids stored on it"""
+        groups = {}
+        for file_id in file_ids:
+            groups.setdefault(self.shard_for(file_id), []).append(file_id)
+        return groups
@@ -0,0 +1,201 @@
+import io
+import os
+import re
+import json
+import time
+import uuid
+import zipfile
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Portable index snapshots, so a new node can be bootstrapped without re-uploading and re-embedding every PDF.
+A snapshot is a zip archive:
+    manifest.json                   format version, embedding model, dimension, and per file metadata and last access
+    files/<file_id>/chunks.jsonl    one {"id", "document", "metadata"} line per chunk, in chunk order
+    files/<file_id>/embeddings.npy  float32 array (chunks x dimension), rows in the same order as chunks.jsonl
+
+Import bulk loads the chunks and embeddings as they are, after checking that the embedding model matches.
+The archive is untrusted input: file ids must be UUIDs (they are used in storage paths) and the archived "path" is
+replaced by the location the file would have under pdf_storage_path (the PDF itself is not part of a snapshot).
+"""
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_NAME_PATTERN = re.compile(r"^snapshot_(\d+)_([0-9a-f]{8})\.zip$")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def is_file_id(value):
+    # File ids are generated with uuid4, anything else could escape the storage directories
+    try:
+        return isinstance(value, str) and str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+class SnapshotService:
+    def __init__(self, vector_store, snapshot_storage_path, pdf_storage_path=None):
+        self.vector_store = vector_store
+        self.snapshot_storage_path = snapshot_storage_path
+        self.pdf_storage_path = pdf_storage_path
+        os.makedirs(self.snapshot_storage_path, exist_ok=True)
+
+    def export_snapshot(self, file_ids=None, archive_path=None):
+        """Export the given files (all files by default) into a snapshot archive, returns the archive path"""
+        if file_ids is None:
+            file_ids = list(self.vector_store.file_metadata.keys())
+        missing = [file_id for file_id in file_ids if file_id not in self.vector_store.file_metadata]
+        if missing:
+            raise SnapshotError(f"Unknown file ids: {', '.join(missing)}")
+
+        if archive_path is None:
+            name = f"snapshot_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.zip"
+            archive_path = os.path.join(self.snapshot_storage_path, name)
+
+        manifest = {
+            "formatVersion": SNAPSHOT_FORMAT_VERSION,
+            "createdAt": time.time(),
+            "embeddingModel": self.vector_store.model_name,
+            "dimension": None,
+            "files": []
+        }
+
+        start_time = time.time()
+        total_chunks = 0
+        # Write to a temporary name so a failed export never looks like a valid snapshot
+        temp_path = archive_path + ".partial"
+        try:
+            with zipfile.ZipFile(temp_path, "w") as archive:
+                for file_id in file_ids:
+                    chunks = self.vector_store.get_file_chunks(file_id)
+                    embeddings = np.asarray(chunks["embeddings"], dtype=np.float32)
+                    if len(chunks["ids"]):
+                        manifest["dimension"] = int(embeddings.shape[1])
+
+                    lines = "".join(
+                        json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n"
+                        for chunk_id, document, metadata in zip(chunks["ids"], chunks["documents"], chunks["metadatas"])
+                    )
+                    archive.writestr(f"files/{file_id}/chunks.jsonl", lines, compress_type=zipfile.ZIP_DEFLATED)
+
+                    # Embeddings barely compress, store the raw array
+                    buffer = io.BytesIO()
+                    np.save(buffer, embeddings)
+                    archive.writestr(f"files/{file_id}/embeddings.npy", buffer.getvalue(), compress_type=zipfile.ZIP_STORED)
+
+                    manifest["files"].append({
+                        "metadata": self.vector_store.file_metadata[file_id],
+                        "lastAccess": self.vector_store.access_log.get(file_id),
+                        "chunks": len(chunks["ids"])
+                    })
+                    total_chunks += len(chunks["ids"])
+
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+            os.replace(temp_path, archive_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        logger.info(f"Exported {len(file_ids)} files ({total_chunks} chunks) to {archive_path} in {time.time() - start_time:.2f}s")
+        return archive_path
+
+    def read_manifest(self, archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            return json.loads(archive.read("manifest.json"))
+
+    def import_snapshot(self, archive_path, overwrite=False):
+        """Bulk load a snapshot archive. Returns a summary of imported and skipped files."""
+        start_time = time.time()
+        summary = {"imported": [], "skipped": [], "chunks": 0}
+
+        with zipfile.ZipFile(archive_path) as archive:
+            try:
+                manifest = json.loads(archive.read("manifest.json"))
+            except KeyError:
+                raise SnapshotError("Archive has no manifest.json, it is not a snapshot")
+
+            if manifest.get("formatVersion") != SNAPSHOT_FORMAT_VERSION:
+                raise SnapshotError(f"Unsupported snapshot format version: {manifest.get('formatVersion')}")
+            if manifest.get("embeddingModel") != self.vector_store.model_name:
+                raise SnapshotError(
+                    f"Snapshot was built with embedding model '{manifest.get('embeddingModel')}', "
+                    f"this node uses '{self.vector_store.model_name}'"
+                )
+
+            # Validate every entry before anything is loaded, so a crafted archive is rejected as a whole
+            entries = manifest.get("files")
+            if not isinstance(entries, list):
+                raise SnapshotError("Snapshot is corrupt: manifest has no file list")
+            for entry in entries:
+                metadata = entry.get("metadata") if isinstance(entry, dict) else None
+                if not isinstance(metadata, dict) or not is_file_id(metadata.get("id")):
+                    raise SnapshotError("Snapshot contains an invalid file id")
+
+            expiry_threshold = time.time() - self.vector_store.retention_days * 86400
+            for entry in entries:
+                file_info = dict(entry["metadata"])
+                file_id = file_info["id"]
+                # Never trust the archived path, removal and expiry delete it
+                file_info.pop("path", None)
+                if self.pdf_storage_path:
+                    file_info["path"] = os.path.join(self.pdf_storage_path, f"{file_id}.pdf")
+                if file_id in self.vector_store.file_metadata and not overwrite:
+                    summary["skipped"].append(file_id)
+                    continue
+                chunks = {"ids": [], "documents": [], "metadatas": []}
+                for line in archive.read(f"files/{file_id}/chunks.jsonl").decode("utf-8").splitlines():
+                    record = json.loads(line)
+                    if not isinstance(record.get("metadata"), dict) or record["metadata"].get("file_id") != file_id:
+                        raise SnapshotError(f"Snapshot is corrupt: a chunk of {file_id} belongs to another file")
+                    chunks["ids"].append(record["id"])
+                    chunks["documents"].append(record["document"])
+                    chunks["metadatas"].append(record["metadata"])
+                embeddings = np.load(io.BytesIO(archive.read(f"files/{file_id}/embeddings.npy")))
+                if embeddings.shape[0] != len(chunks["ids"]):
+                    raise SnapshotError(f"Snapshot is corrupt: {file_id} has {embeddings.shape[0]} embeddings for {len(chunks['ids'])} chunks")
+                if len(chunks["ids"]) and manifest.get("dimension") and embeddings.shape[1] != manifest["dimension"]:
+                    raise SnapshotError(f"Snapshot is corrupt: {file_id} embeddings have the wrong dimension")
+                chunks["embeddings"] = embeddings.tolist()
+                if file_id in self.vector_store.file_metadata:
+                    self.vector_store.shard_for(file_id)._collection.delete(where={"file_id": file_id})
+
+                # Keep the archived access time, unless the file would expire right away on this node
+                last_access = entry.get("lastAccess")
+                if not last_access or last_access < expiry_threshold:
+                    last_access = time.time()
+
+                summary["chunks"] += self.vector_store.load_file_chunks(file_info, chunks, last_access=last_access)
+                summary["imported"].append(file_id)
+
+        logger.info(
+            f"Imported {len(summary['imported'])} files ({summary['chunks']} chunks) from {archive_path} "
+            f"in {time.time() - start_time:.2f}s, skipped {len(summary['skipped'])} existing files"
+        )
+        return summary
+
+    def list_snapshots(self):
+        snapshots = []
+        for name in os.listdir(self.snapshot_storage_path):
+            match = SNAPSHOT_NAME_PATTERN.match(name)
+            if not match:
+                continue
+            snapshots.append({
+                "name": name,
+                "created": int(match.group(1)) / 1000,
+                "size": os.path.getsize(os.path.join(self.snapshot_storage_path, name))
+            })
+        snapshots.sort(key=lambda s: s["created"], reverse=True)
+        return snapshots
+
+    def get_snapshot_path(self, name):
+        # Only names we generated are served, this also rules out path traversal
+        if not SNAPSHOT_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.snapshot_storage_path, name)
+        return path if os.path.exists(path) else None
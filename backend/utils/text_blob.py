@@ -0,0 +1,192 @@
+import os
+import mmap
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.context_packer import find_overlap
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+"""
+Per-file text blobs, so a chunk's text is stored once instead of in every Chroma document and metadata preview.
+Every file has:
+    <file_id>.txt          the file's text as one contiguous UTF-8 string, overlapping chunk text is written once
+    <file_id>.offsets.npy  int64 array (ordinal x 2) with the byte range of every chunk in the blob, -1 if missing
+
+Chunks are read back by memory-mapping the blob and slicing, so reading a chunk (or its neighbours, read_range
+returns a run of consecutive chunks as one slice) is O(1) and doesn't load the whole file. Blob positions stay
+internal: after deduplication the blob skips the dropped chunks, so the chunk metadata keeps the offsets in the
+document text for citations instead. Writers are created by the store, which closes a file's open mmap before its
+blob is replaced or removed.
+"""
+
+TAIL_CHARS = 8192  # Blob tail kept by the writer to find the overlap with the next chunk
+
+
+class TextBlobWriter:
+    def __init__(self, blob_path, offsets_path, separator="\n\n", publish=None):
+        self.blob_path = blob_path
+        self.offsets_path = offsets_path
+        self.separator = separator
+        # publish(replacements) moves the finished files in place, the store uses it to drop its open mmaps first
+        self._publish = publish or self._replace
+        self._file = open(blob_path + ".partial", "wb")
+        self._chars = 0
+        self._bytes = 0
+        self._tail = ""
+        self._source_end = None  # Document offset of the end of the last chunk, when known
+        self._offsets = {}
+
+    def _write(self, text):
+        data = text.encode("utf-8")
+        self._file.write(data)
+        self._chars += len(text)
+        self._bytes += len(data)
+        self._tail = (self._tail + text)[-TAIL_CHARS:]
+
+    def append(self, ordinal, text, source_start=None):
+        """Add a chunk. source_start is the chunk's offset in the document text when known, it gives the overlap
+        with the previous chunk. Otherwise (or when it doesn't match the text) the overlap is detected from the text."""
+        overlap = None
+        if source_start is not None and self._source_end is not None:
+            overlap = max(self._source_end - source_start, 0)
+            if overlap > min(len(text), len(self._tail)) or not self._tail.endswith(text[:overlap]):
+                overlap = None
+        if overlap is None:
+            overlap = find_overlap(self._tail, text)
+        if not overlap and self._chars:
+            self._write(self.separator)
+
+        shared = self._tail[len(self._tail) - overlap:] if overlap else ""
+        start_byte = self._bytes - len(shared.encode("utf-8"))
+        self._write(text[overlap:])
+        self._offsets[ordinal] = (start_byte, self._bytes)
+        self._source_end = source_start + len(text) if source_start is not None else None
+
+    def commit(self):
+        self._file.close()
+        offsets = np.full((max(self._offsets, default=-1) + 1, 2), -1, dtype=np.int64)
+        for ordinal, byte_range in self._offsets.items():
+            offsets[ordinal] = byte_range
+        # np.save appends .npy to names without it, so write the temporary file under an .npy name
+        temp_offsets = self.offsets_path[:-len(".npy")] + ".partial.npy"
+        np.save(temp_offsets, offsets)
+        self._publish([(temp_offsets, self.offsets_path), (self.blob_path + ".partial", self.blob_path)])
+
+    @staticmethod
+    def _replace(replacements):
+        for source, target in replacements:
+            os.replace(source, target)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.blob_path + ".partial"):
+            os.remove(self.blob_path + ".partial")
+
+
+class TextBlobStore:
+    def __init__(self, blob_storage_path, max_open_files=64):
+        self.blob_storage_path = blob_storage_path
+        self.max_open_files = max_open_files
+        self._open = OrderedDict()  # file_id -> (mmap or None for an empty blob, offsets array)
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_storage_path, exist_ok=True)
+
+    def _paths(self, file_id):
+        base = os.path.join(self.blob_storage_path, str(file_id))
+        return base + ".txt", base + ".offsets.npy"
+
+    def writer(self, file_id):
+        return TextBlobWriter(*self._paths(file_id), publish=lambda replacements: self._publish(file_id, replacements))
+
+    def _close(self, file_id):
+        # Caller holds _lock
+        entry = self._open.pop(file_id, None)
+        if entry is not None and entry[0] is not None:
+            entry[0].close()
+
+    def _publish(self, file_id, replacements):
+        # The mapped old files are closed before they are replaced, so later reads map the new ones
+        # (and os.replace doesn't fail on Windows, which can't replace a mapped file)
+        with self._lock:
+            self._close(file_id)
+            TextBlobWriter._replace(replacements)
+
+    def exists(self, file_id):
+        return all(os.path.exists(path) for path in self._paths(file_id))
+
+    def _get(self, file_id):
+        # Caller holds _lock. The offsets are small (16 bytes per chunk), they are loaded instead of mapped.
+        entry = self._open.get(file_id)
+        if entry is not None:
+            self._open.move_to_end(file_id)
+            return entry
+
+        blob_path, offsets_path = self._paths(file_id)
+        offsets = np.load(offsets_path)
+        with open(blob_path, "rb") as f:
+            # mmap can't map an empty file
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        entry = self._open[file_id] = (blob, offsets)
+        while len(self._open) > self.max_open_files:
+            _, (evicted, _) = self._open.popitem(last=False)
+            if evicted is not None:
+                evicted.close()
+        return entry
+
+    def _read(self, file_id, select):
+        """Bytes of the range select(offsets) returns (None for nothing). The slice is taken under the lock, so a
+        concurrent rewrite or removal can't close the mmap while it is read."""
+        if not self.exists(file_id):
+            return None
+        with self._lock:
+            try:
+                blob, offsets = self._get(file_id)
+            except Exception as e:
+                logger.error(f"Error opening text blob of {file_id}: {e}")
+                return None
+            byte_range = select(offsets)
+            if byte_range is None:
+                return None
+            return blob[byte_range[0]:byte_range[1]] if blob is not None else b""
+
+    def read(self, file_id, ordinal):
+        """Text of a chunk, None if the file has no blob or no chunk with this ordinal"""
+        def select(offsets):
+            if not 0 <= ordinal < len(offsets) or offsets[ordinal][0] < 0:
+                return None
+            return int(offsets[ordinal][0]), int(offsets[ordinal][1])
+
+        data = self._read(file_id, select)
+        return data.decode("utf-8") if data is not None else None
+
+    def read_range(self, file_id, first, last):
+        """Text of the consecutive chunks first..last with their overlaps written once, None without a blob"""
+        def select(offsets):
+            rows = offsets[max(first, 0):last + 1]
+            rows = rows[rows[:, 0] >= 0] if len(rows) else rows
+            if not len(rows):
+                return None
+            # Chunks are written in order, so the range is one contiguous slice of the blob
+            return int(rows[:, 0].min()), int(rows[:, 1].max())
+
+        data = self._read(file_id, select)
+        return data.decode("utf-8") if data is not None else None
+
+    def chunk_count(self, file_id):
+        if not self.exists(file_id):
+            return 0
+        with self._lock:
+            return len(self._get(file_id)[1])
+
+    def remove(self, file_id):
+        with self._lock:
+            self._close(file_id)
+            for path in self._paths(file_id):
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        logger.error(f"Error removing text blob {path}: {e}")
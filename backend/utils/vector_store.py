@@ -1,13 +1,27 @@
 import os
 from langchain_community.vectorstores import Chroma
+import chromadb
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain.schema import Document
 import logging
 import json
 import time
-from threading import Thread
+import base64
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Thread, Condition, Lock
 import schedule
+import numpy as np
+from utils.metrics import registry, track_stage, CHUNKS
+from utils.sharding import HashRing
+from utils.embedding_cache import FileEmbeddingCache
+from utils.hnsw_tuning import pairwise_distances
+from utils.text_blob import TextBlobStore
+from utils.file_summaries import FileSummaryIndex
+from utils.embedding_scheduler import EmbeddingScheduler, ScheduledEmbeddings, QUERY, INGEST, BACKGROUND
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,54 +41,375 @@ These are the major functions in this file:
 5. add_file: Adds a file to the vector database, including chunking and metadata storage.
 6. remove_file: Removes a file from the vector database and deletes the actual file if it exists.
 7. query: Queries the vector database for relevant chunks based on a query text.
+8. query_batch: Queries the vector database for many query texts at once (one embedding call, one search call).
+9. add_file_stream: Adds a file from a stream of chunk records, embedding and inserting fixed-size batches.
+10. list_files: Read-only, cursor paginated listing of the stored files for the /api/files route.
+11. rebalance_shards: Offline move of every file's vectors to the shard the hash ring assigns it to.
+12. get_file_chunks and load_file_chunks: Read and bulk load a file's stored chunks with their embeddings (snapshots).
+13. pending_ingestions and _cleanup_orphans: Ingestions to resume after a crash, and removal of vectors without a file.
+14. activate_collection and drop_previous_collection: Switch to the collection built by an embedding model migration.
 """
 
+"""
+Embedding model: embedding_state.json records the model the stored vectors were built with and the Chroma
+collection holding them. When HF_EMBEDDING_MODEL names another model, the store keeps serving with the recorded
+model and collection, and EmbeddingMigration re-embeds every chunk into a new collection in the background. Once
+it is complete, activate_collection swaps model and collection while ingestions are paused; the previous collection
+is kept until drop_previous_collection is called. Model, collection and shards are published together as one
+ActiveIndex, and every query works on the ActiveIndex it started with.
+"""
+
+"""
+Ingestion is idempotent and resumable: chunk ids are deterministic (file id, ordinal and a hash of the text) and
+chunks are upserted, so indexing a chunk twice never duplicates it. add_file and add_file_stream commit fixed-size
+batches and save a checkpoint (vector_db_path/ingest_checkpoints/<file_id>.json) after each one, which is removed
+once the file metadata is saved. A checkpoint without metadata is an interrupted ingestion: run again, it only embeds
+the chunks that are not stored yet. At startup, vectors of files with neither metadata nor a checkpoint are removed.
+"""
+
+"""
+Chunk storage: Chroma keeps the embedding and a compact metadata record per chunk (file_id, chunk_id ordinal,
+start/end character offsets in the file's text, first and last page). The text itself lives once per file in a
+memory-mapped text blob (TextBlobStore) and is read back by slice when results are returned. Chunks indexed
+before the blobs existed still have their text as the Chroma document, which is used when there is no blob.
+"""
+
+"""
+Two-level retrieval: every file gets a summary vector (normalized mean of its chunk embeddings) when it is added.
+When a query selects at least two_level_min_files files, the files are ranked by their summary vector first and
+only the chunks of the two_level_top_files best files are searched, so the chunk search cost follows the number of
+files worth searching instead of the number of selected chunks. Files without a summary vector are always searched.
+"""
+
+"""
+Small-to-big retrieval: the search matches small chunks, then every hit is expanded to a larger context window read
+from the file's text blob, either expansion_neighbors chunks on each side ("neighbors") or every chunk of the hit's
+pages ("page"). The window of a hit is capped to expansion_max_chunks chunks, and in "page" mode a hit whose pages
+aren't contiguous (a deduplicated chunk standing for pages far apart) keeps just its own chunk. Windows of the same
+file that overlap or touch are merged into one result at the rank of its best hit, so the LLM gets long passages
+without embedding long chunks. Hits without a text blob are returned as they are.
+"""
+
+"""
+Query planning: when the selected files of a shard hold at most exact_search_max_chunks chunks in total, the shard
+is searched exactly instead of through HNSW with a $in filter. The files' embeddings come from an in-memory LRU
+cache (FileEmbeddingCache) and are scored with one matrix product, using the collection's distance space so the
+distances can be merged with the HNSW results of other shards.
+"""
+
+"""
+The vectors can be split over several shards, each one a Chroma database with its own persist directory
+(shard 0 is vector_db_path itself, so a single shard setup keeps the original layout, shard i lives in
+vector_db_path/shard_i). Files are assigned to shards by consistent hashing of their id, all chunks of a file live
+on the same shard. Queries fan out concurrently to the shards holding the selected files and the per-shard
+top-k lists are merged by distance. File metadata and the access log stay in vector_db_path.
+"""
+
+QUERY_PLANS = registry.counter(
+    "rag_query_plans_total", "Shard searches by plan (exact scan of cached embeddings or hnsw)", ("plan",)
+)
+EXPANSION_CHARS = registry.counter(
+    "rag_expansion_chars_total", "Characters of the retrieved hits (matched) and of their expanded windows", ("kind",)
+)
+EXPANSION_MODES = ("none", "neighbors", "page")
+TWO_LEVEL_FILES = registry.counter(
+    "rag_two_level_files_total", "Files selected by two-level queries, and how many of them were searched", ("kind",)
+)
+
+def build_hnsw_metadata(space=None, m=None, construction_ef=None, search_ef=None):
+    # Only the parameters that are set are passed, Chroma keeps its defaults for the others
+    metadata = {}
+    if space:
+        metadata["hnsw:space"] = space
+    if m:
+        metadata["hnsw:M"] = m
+    if construction_ef:
+        metadata["hnsw:construction_ef"] = construction_ef
+    if search_ef:
+        metadata["hnsw:search_ef"] = search_ef
+    return metadata
+
+DEFAULT_COLLECTION_NAME = "langchain"  # Collection langchain's Chroma wrapper uses when none is given
+
+def collection_name_for(model_name):
+    # Chroma collection names: 3-63 characters of [a-zA-Z0-9._-], starting and ending with an alphanumeric character
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", model_name).strip("_")[:40]
+    return f"chunks_{slug}_{hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]}"
+
+def chunk_pages(metadata):
+    """Pages of a chunk from its metadata, the page range for chunks stored before the page list"""
+    if metadata.get("pages"):
+        return [int(page) for page in str(metadata["pages"]).split(",") if page]
+    if metadata.get("page") is not None:
+        return list(range(int(metadata["page"]), int(metadata.get("page_end", metadata["page"])) + 1))
+    return []
+
+
+def chunk_vector_id(file_id, ordinal, text):
+    # Deterministic, so re-indexing a chunk overwrites it instead of adding a duplicate
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    return f"{file_id}:{ordinal}:{digest}"
+
+class ActiveIndex:
+    """The embedding model, collection and shards queries are served from. activate_collection replaces it as a whole,
+    so a query that took it embeds and searches with the same model. cache_generation tags its embedding cache entries.
+    """
+    def __init__(self, model_name, collection_name, embeddings=None, shards=None, cache_generation=0):
+        self.model_name = model_name
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.shards = shards if shards is not None else []
+        self.cache_generation = cache_generation
+
 class VectorStoreService:
-    def __init__(self, vector_db_path, model_name="all-MiniLM-L6-v2", retention_days=7):
+    def __init__(self, vector_db_path, model_name="all-MiniLM-L6-v2", retention_days=7, deduplicator=None, num_shards=1,
+                 hnsw_params=None, exact_search_max_chunks=1000, embedding_cache_max_chunks=50000, text_blob_path=None,
+                 summary_index_path=None, two_level_min_files=12, two_level_top_files=6, embed_query_threads=0,
+                 embed_ingest_threads=0, embed_micro_batch_size=16, expansion_mode="neighbors", expansion_neighbors=1,
+                 partition_cache=None, expansion_max_chunks=8):
         self.vector_db_path = vector_db_path
         self.retention_days = retention_days
-        self._initialize_embeddings(model_name)
-        self.db = None
+        self.deduplicator = deduplicator  # Optional ChunkDeduplicator, its corpus index is kept in sync on removal
+        self.partition_cache = partition_cache  # Optional PartitionCache, a removed file's cached pages are deleted
+        self.num_shards = num_shards
+        self.ring = HashRing(num_shards)
+        # model_name is the configured model, the stored vectors may still use another one until they are migrated
+        self.target_model_name = model_name
+        self.embedding_state_file = os.path.join(vector_db_path, "embedding_state.json")
+        self.embedding_state = self._load_embedding_state(model_name)
+        self._active_lock = Lock()
+        self._active = ActiveIndex(self.embedding_state["model"], self.embedding_state["collection"])
+        self.migration_shards = None  # Collections a running migration writes to, kept in sync on removal
+        # Chroma collection metadata for the HNSW index, e.g. {"hnsw:space": "cosine", "hnsw:M": 32}
+        self.collection_metadata = build_hnsw_metadata(**(hnsw_params or {}))
+        # Filtered searches over at most this many chunks skip HNSW and score the cached embeddings (0 disables)
+        self.exact_search_max_chunks = exact_search_max_chunks
+        self.embedding_cache = FileEmbeddingCache(embedding_cache_max_chunks)
+        self._chunk_counts = {}  # file_id -> counted chunks, for files whose metadata predates the "chunks" field
+        self.text_blobs = TextBlobStore(text_blob_path or os.path.join(vector_db_path, "text_blobs"))
+        # Queries selecting at least two_level_min_files files only search the best two_level_top_files (0 disables)
+        self.file_summaries = FileSummaryIndex(summary_index_path or os.path.join(vector_db_path, "file_summaries"))
+        self.two_level_min_files = two_level_min_files
+        self.two_level_top_files = two_level_top_files
+        # Small-to-big: hits are expanded to their neighbouring chunks or their pages ("none" disables)
+        if expansion_mode not in EXPANSION_MODES:
+            logger.warning(f"Unknown expansion mode {expansion_mode}, using neighbors")
+            expansion_mode = "neighbors"
+        self.expansion_mode = expansion_mode
+        self.expansion_neighbors = expansion_neighbors
+        self.expansion_max_chunks = expansion_max_chunks  # Chunks in the window of one hit, centered on the hit
+        # Query embeddings go before ingestion and migration batches, which are embedded in preemptible micro-batches
+        self.embedding_scheduler = EmbeddingScheduler(
+            {QUERY: embed_query_threads, INGEST: embed_ingest_threads, BACKGROUND: embed_ingest_threads}
+        )
+        self.embed_micro_batch_size = embed_micro_batch_size
+        self._active.embeddings = self._load_embeddings(self.model_name)
+        if self.model_name != self.target_model_name:
+            logger.warning(
+                f"Stored vectors use {self.model_name}, configured model is {self.target_model_name}. "
+                f"Serving with {self.model_name} until the embedding migration completes"
+            )
+        self._ingest_condition = Condition()
+        self._active_ingestions = 0
+        self._ingestion_paused = False
+        self._shard_executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix="shard-query")
         self.file_metadata = {}
         self.metadata_file = os.path.join(vector_db_path, "metadata.json")
         self.access_log_file = os.path.join(vector_db_path, "access_log.json")
         self.access_log = {}
+        self.ingestion_progress = {}  # file_id -> progress of streaming ingestions currently running
+        self.metadata_updated_at = time.time()  # Last change of the file metadata, used for Last-Modified
+        self.checkpoint_path = os.path.join(vector_db_path, "ingest_checkpoints")
+        os.makedirs(self.checkpoint_path, exist_ok=True)
         self._load_metadata()
         self._load_access_log()
         self._initialize_db()
+        try:
+            removed = self._cleanup_orphans()
+            if removed:
+                logger.info(f"Removed {removed} orphaned chunks left by interrupted ingestions")
+        except Exception as e:
+            logger.error(f"Error removing orphaned chunks: {e}")
         self._start_cleanup_scheduler()
     
-    def _initialize_embeddings(self, model_name):
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def model_name(self):
+        return self._active.model_name
+
+    @property
+    def collection_name(self):
+        return self._active.collection_name
+
+    @property
+    def embeddings(self):
+        return self._active.embeddings
+
+    @property
+    def shards(self):
+        return self._active.shards
+
+    def _load_embeddings(self, model_name):
         # Initialize HuggingFace embeddings model
         try:
-            self.embeddings = HuggingFaceEmbeddings(
+            embeddings = HuggingFaceEmbeddings(
                 model_name=model_name,
                 model_kwargs={'device': 'cpu'},
                 encode_kwargs={'normalize_embeddings': True}
             )
             logger.info(f"HuggingFace embeddings initialized with model: {model_name}")
+            return ScheduledEmbeddings(embeddings, self.embedding_scheduler, self.embed_micro_batch_size)
         except Exception as e:
             logger.error(f"Error initializing HuggingFace embeddings: {e}")
             raise
     
+    def _shard_path(self, shard_index):
+        if shard_index == 0:
+            return self.vector_db_path
+        return os.path.join(self.vector_db_path, f"shard_{shard_index}")
+
+    def _open_shard(self, shard_index, collection_name=None, embeddings=None):
+        shard = Chroma(
+            collection_name=collection_name or self.collection_name,
+            persist_directory=self._shard_path(shard_index),
+            embedding_function=embeddings or self.embeddings,
+            collection_metadata=self.collection_metadata or None
+        )
+        self._check_hnsw_params(shard_index, shard)
+        return shard
+
+    def _load_embedding_state(self, model_name):
+        try:
+            with open(self.embedding_state_file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Stores created before the state file hold vectors of the configured model in the default collection
+            state = {"model": model_name, "collection": DEFAULT_COLLECTION_NAME}
+            self._save_embedding_state(state)
+            return state
+
+    def _save_embedding_state(self, state=None):
+        state = state or self.embedding_state
+        with open(self.embedding_state_file + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.embedding_state_file + ".tmp", self.embedding_state_file)
+
+    @contextmanager
+    def _ingestion_slot(self):
+        # Ingestions wait while a migration swaps collections, and the swap waits for running ingestions
+        with self._ingest_condition:
+            while self._ingestion_paused:
+                self._ingest_condition.wait()
+            self._active_ingestions += 1
+        try:
+            yield
+        finally:
+            with self._ingest_condition:
+                self._active_ingestions -= 1
+                self._ingest_condition.notify_all()
+
+    @contextmanager
+    def ingestion_paused(self):
+        """Block new ingestions and wait for the running ones to finish"""
+        with self._ingest_condition:
+            while self._ingestion_paused:
+                self._ingest_condition.wait()
+            self._ingestion_paused = True
+            while self._active_ingestions:
+                self._ingest_condition.wait()
+        try:
+            yield
+        finally:
+            with self._ingest_condition:
+                self._ingestion_paused = False
+                self._ingest_condition.notify_all()
+
+    def activate_collection(self, model_name, embeddings, collection_name, shards, summaries):
+        """Serve from a fully migrated collection. Call with ingestions paused."""
+        previous = {"model": self.model_name, "collection": self.collection_name}
+        with self._active_lock:
+            # Entries loaded from the old collection (even by loads still running) are never served again
+            generation = self.embedding_cache.clear()
+            self._active = ActiveIndex(model_name, collection_name, embeddings, shards, generation)
+        self.migration_shards = None
+        for file_id, vector in summaries.items():
+            self.file_summaries.set(file_id, vector)
+        
+        self.embedding_state = {"model": model_name, "collection": collection_name, "previous": previous}
+        self._save_embedding_state()
+        logger.info(f"Switched from {previous['model']} ({previous['collection']}) to {model_name} ({collection_name})")
+
+    def drop_previous_collection(self):
+        """Delete the collection replaced by the last migration, returns its name or None"""
+        previous = self.embedding_state.get("previous")
+        if not previous:
+            return None
+        for shard_index in self._existing_shard_indexes():
+            try:
+                # Leftover shards get a raw client, opening them as shards would create the active collection
+                if shard_index < self.num_shards:
+                    client = self.shards[shard_index]._client
+                else:
+                    client = chromadb.PersistentClient(path=self._shard_path(shard_index))
+                client.delete_collection(previous["collection"])
+            except Exception as e:
+                # The shard may never have had the collection
+                logger.warning(f"Shard {shard_index}: could not delete collection {previous['collection']}: {e}")
+        self.embedding_state.pop("previous")
+        self._save_embedding_state()
+        logger.info(f"Dropped previous collection {previous['collection']} ({previous['model']})")
+        return previous["collection"]
+
+    def _check_hnsw_params(self, shard_index, shard):
+        # The metadata only applies when the collection is created, existing collections keep their index settings
+        if not self.collection_metadata:
+            return
+        current = shard._collection.metadata or {}
+        for key, value in self.collection_metadata.items():
+            if current.get(key, value) == value:
+                continue
+            if key == "hnsw:search_ef":
+                try:
+                    shard._collection.modify(metadata={**current, key: value})
+                    logger.info(f"Shard {shard_index}: search_ef changed from {current.get(key)} to {value}")
+                    continue
+                except Exception as e:
+                    logger.warning(f"Shard {shard_index}: could not change search_ef: {e}")
+            logger.warning(
+                f"Shard {shard_index} was created with {key}={current.get(key)}, configured {value}. "
+                f"The collection has to be rebuilt (snapshot export/import) for this to take effect"
+            )
+
     def _initialize_db(self):
-        # Initialize the vector database
+        # Initialize the vector database, one Chroma instance per shard
         try:
             # Create or load the vector database
-            self.db = Chroma(
-                persist_directory=self.vector_db_path,
-                embedding_function=self.embeddings
-            )
-            logger.info(f"Vector DB initialized with {self.db._collection.count()} documents")
+            self._active.shards = [self._open_shard(i) for i in range(self.num_shards)]
+            logger.info(f"Vector DB initialized with {self.collection_count()} documents in {self.num_shards} shard(s)")
         except Exception as e:
             logger.error(f"Error initializing vector DB: {e}")
             raise
-    
+
+    @property
+    def db(self):
+        # The first shard, kept for callers that predate sharding
+        return self.shards[0]
+
+    def shard_for(self, file_id):
+        return self.shards[self.ring.shard_for(file_id)]
+
+    def collection_count(self):
+        return sum(shard._collection.count() for shard in self.shards)
+
     def _load_metadata(self):
         if os.path.exists(self.metadata_file):
             try:
                 with open(self.metadata_file, 'r') as f:
                     self.file_metadata = json.load(f)
+                self.metadata_updated_at = os.path.getmtime(self.metadata_file)
             except Exception as e:
                 logger.error(f"Error loading metadata: {e}")
                 self.file_metadata = {}
@@ -83,6 +418,7 @@ class VectorStoreService:
         try:
             with open(self.metadata_file, 'w') as f:
                 json.dump(self.file_metadata, f)
+            self.metadata_updated_at = time.time()
         except Exception as e:
             logger.error(f"Error saving metadata: {e}")
 
@@ -105,6 +441,12 @@ class VectorStoreService:
                 elif isinstance(value, (list, tuple)) and all(isinstance(x, (str, int, float, bool)) for x in value):
                     # Keep lists/tuples of simple values
                     clean_info[key] = list(value)
+                elif isinstance(value, (list, tuple)) and all(
+                    isinstance(x, dict) and all(isinstance(v, (str, int, float, bool)) for v in x.values())
+                    for x in value
+                ):
+                    # Keep lists of flat records (e.g. the per-page partition report) as JSON
+                    clean_info[key] = [dict(x) for x in value]
                 elif isinstance(value, dict):
                     # For dictionaries, keep only simple key-value pairs
                     clean_dict = {}
@@ -151,6 +493,60 @@ class VectorStoreService:
         
         return list(self.file_metadata.values())
 
+    def list_files(self, limit=100, cursor=None, sort="dateUploaded", order="desc", name_filter=None):
+        """Read-only, paginated listing of the stored files (doesn't touch the access log).
+        Returns (files, next_cursor, total) where total counts the files matching the filter."""
+        if sort not in ("dateUploaded", "name", "size"):
+            raise ValueError(f"Unsupported sort field: {sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unsupported sort order: {order}")
+        
+        files = list(self.file_metadata.values())
+        if name_filter:
+            needle = name_filter.lower()
+            files = [f for f in files if needle in str(f.get("name", "")).lower()]
+        
+        def sort_key(f):
+            value = f.get(sort, 0 if sort == "size" else "")
+            return (value.lower() if isinstance(value, str) else value, f["id"])
+        
+        descending = order == "desc"
+        files.sort(key=sort_key, reverse=descending)
+        total = len(files)
+        
+        # The cursor is the sort key of the last file of the previous page, so pages stay stable under inserts
+        if cursor:
+            cursor_sort, cursor_order, cursor_value, cursor_id = self._decode_cursor(cursor)
+            if cursor_sort != sort or cursor_order != order:
+                raise ValueError("Cursor doesn't match the requested sort")
+            # The value is compared with the sort keys, so it must have the sort field's type
+            numeric = isinstance(cursor_value, (int, float)) and not isinstance(cursor_value, bool)
+            if (not numeric if sort == "size" else not isinstance(cursor_value, str)) or not isinstance(cursor_id, str):
+                raise ValueError("Invalid cursor")
+            last_key = (cursor_value, cursor_id)
+            files = [f for f in files if (sort_key(f) < last_key if descending else sort_key(f) > last_key)]
+        
+        page = files[:limit]
+        next_cursor = None
+        if len(files) > limit and page:
+            last_value, last_id = sort_key(page[-1])
+            next_cursor = self._encode_cursor([sort, order, last_value, last_id])
+        
+        return page, next_cursor, total
+
+    def _encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != 4:
+                raise ValueError("wrong shape")
+            return values
+        except Exception:
+            raise ValueError("Invalid cursor")
+
     def _load_access_log(self):
         if os.path.exists(self.access_log_file):
             try:
@@ -215,103 +611,316 @@ class VectorStoreService:
             logger.error(f"Error during expired file cleanup: {e}")
             return []
 
-    def add_file(self, file_info, chunks, chunk_page_map):
+    def _chunk_text(self, chunk_index, chunk):
+        # Explicitly ensure chunk is a string
+        if isinstance(chunk, Document):
+            return chunk.page_content
+        elif isinstance(chunk, tuple) or isinstance(chunk, list):
+            logger.warning(f"Chunk {chunk_index} is a {type(chunk).__name__}, using first element as text")
+            return str(chunk[0]) if chunk else ""
+        return str(chunk)
+
+    def _build_document(self, file_info, chunk_index, chunk_text, pages=None, span=None):
+        # Compact metadata record, the text itself is stored in the file's text blob
+        metadata = {
+            "file_id": str(file_info["id"]),
+            "chunk_id": chunk_index,
+        }
+        if span:
+            metadata["start"], metadata["end"] = span
+        
+        # Every page of the chunk (a deduplicated chunk can stand for pages far apart), comma-joined since Chroma
+        # metadata is scalar. The page range is only stored when the pages are contiguous.
+        if pages:
+            pages = sorted(set(int(page) for page in pages))
+            metadata["pages"] = ",".join(str(page) for page in pages)
+            if pages[-1] - pages[0] + 1 == len(pages):
+                metadata["page"] = pages[0]
+                metadata["page_end"] = pages[-1]
+        
+        return Document(page_content=chunk_text, metadata=metadata)
+
+    def _index_documents(self, file_id, documents):
+        # Embed and upsert without the document text, it is read from the text blob. Returns the embeddings.
+        embeddings = self.embeddings.embed_documents([doc.page_content for doc in documents])
+        self.shard_for(file_id)._collection.upsert(
+            ids=[chunk_vector_id(file_id, doc.metadata["chunk_id"], doc.page_content) for doc in documents],
+            embeddings=embeddings,
+            metadatas=[doc.metadata for doc in documents]
+        )
+        return embeddings
+
+    def _document_text(self, text, metadata):
+        if text is not None:
+            return text
+        return self.text_blobs.read(metadata.get("file_id"), int(metadata.get("chunk_id", -1))) or ""
+
+    def add_file(self, file_info, chunks, chunk_page_map, batch_size=64):
         try:
             logger.info(f"Adding file {file_info['id']} to vector store with {len(chunks)} chunks")
-            documents = []
+            records = []
             for i, chunk in enumerate(chunks):
-                try:
-                    # Explicitly ensure chunk is a string
-                    if isinstance(chunk, Document):
-                        chunk_text = chunk.page_content
-                    elif isinstance(chunk, tuple) or isinstance(chunk, list):
-                        logger.warning(f"Chunk {i} is a {type(chunk).__name__}, using first element as text")
-                        chunk_text = str(chunk[0]) if chunk else ""
-                    else:
-                        chunk_text = str(chunk)
-                    
-                    # Create metadata as a plain dictionary
-                    metadata = {
-                        "file_id": str(file_info["id"]),
-                        "file_name": str(file_info["name"]),
-                        "chunk_id": i,
-                    }
-                    
-                    # Only add text preview if it's a reasonable length
-                    if chunk_text and len(chunk_text) > 0:
-                        metadata["text"] = chunk_text[:100] + "..."
-                    
-                    # Add page number if available
-                    if chunk_page_map and i in chunk_page_map:
-                        page_num = chunk_page_map[i]
-                        metadata["page"] = page_num
-
-                    # Manually filter complex types
-                    clean_metadata = {}
-                    for key, value in metadata.items():
-                        if value is None:
-                            continue
-                        elif isinstance(value, (str, int, float, bool)):
-                            clean_metadata[key] = value
-                        else:
-                            try:
-                                # Convert other types to string
-                                clean_metadata[key] = str(value)
-                            except:
-                                pass
-                    
-                    # Create a document with clean metadata
-                    doc = Document(page_content=chunk_text, metadata=clean_metadata)
-                    
-                    # Add the document without further filtering
-                    documents.append(doc)
-                    
-                except Exception as chunk_error:
-                    logger.error(f"Error processing chunk {i}: {chunk_error}")
-                    # Continue with next chunk
-                    continue
-                
-            # Add to vector store
-            if documents:
-                self.db.add_documents(documents)
-                logger.info(f"Added {len(documents)} documents to vector store")
-                
-                # Save file metadata
-                self._save_file_metadata(file_info)
-                
-                logger.info(f"Successfully added {len(documents)} chunks from {file_info['name']} to vector store")
+                # chunk_page_map holds one {"chunk", "pages", "start", "end"} entry per chunk
+                entry = chunk_page_map[i] if chunk_page_map and i < len(chunk_page_map) else {}
+                records.append({
+                    "index": i,
+                    "text": self._chunk_text(i, chunk),
+                    "pages": entry.get("pages", []),
+                    "start": entry.get("start"),
+                    "end": entry.get("end")
+                })
+            
+            indexed = self._ingest_records(file_info, records, batch_size, mode="chunks")
+            if indexed:
+                logger.info(f"Successfully added {indexed} chunks from {file_info['name']} to vector store")
                 return True
-            else:
-                logger.warning(f"No documents created for file {file_info['id']}")
-                return False
+            logger.warning(f"No documents created for file {file_info['id']}")
+            return False
                 
         except Exception as e:
             logger.error(f"Error adding file to vector DB: {e}")
             # Print stack trace for debugging
             import traceback
             logger.error(traceback.format_exc())
+            self.discard_ingestion(file_info["id"])
+            return False
+
+    def add_file_stream(self, file_info, chunk_records, batch_size=64):
+        """Embed and insert chunk records (from PDFProcessor.iter_chunks) in fixed-size batches"""
+        file_id = file_info["id"]
+        progress = {
+            "fileId": file_id,
+            "name": file_info["name"],
+            "pages": file_info.get("pages", 0),
+            "pagesRead": 0,
+            "chunksIndexed": 0,
+            "startedAt": time.time()
+        }
+        self.ingestion_progress[file_id] = progress
+        
+        try:
+            indexed = self._ingest_records(file_info, chunk_records, batch_size, mode="stream", progress=progress)
+            if not indexed:
+                logger.warning(f"No documents created for file {file_id}")
+                return False
+            logger.info(f"Successfully streamed {indexed} chunks from {file_info['name']} to vector store")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error streaming file into vector DB: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            file_info["status"] = "error"
+            file_info["error"] = str(e)
+            # Don't leave the partially indexed chunks behind
+            self.discard_ingestion(file_id)
             return False
+        finally:
+            self.ingestion_progress.pop(file_id, None)
+
+    def _ingest_records(self, file_info, records, batch_size, mode, progress=None):
+        """Write the text blob, embed and upsert the chunk records batch by batch, then save the file metadata.
+        
+        A checkpoint is saved after every committed batch. When an interrupted ingestion of the same file is resumed,
+        chunks whose deterministic id is already stored are not embedded again, and stored chunks that the file no
+        longer produces are removed at the end. Returns the number of chunks of the file."""
+        with self._ingestion_slot():
+            return self._ingest_records_unlocked(file_info, records, batch_size, mode, progress)
+
+    def _ingest_records_unlocked(self, file_info, records, batch_size, mode, progress):
+        file_id = file_info["id"]
+        self.embedding_cache.invalidate(file_id)
+        checkpoint = self._load_checkpoint(file_id)
+        stored_ids = set()
+        if checkpoint:
+            stored_ids = set(self.shard_for(file_id)._collection.get(where={"file_id": file_id}, include=[])["ids"])
+            logger.info(f"Resuming ingestion of {file_id}, {len(stored_ids)} chunks were already committed")
+        state = {"fileInfo": file_info, "mode": mode, "batches": 0, "chunksIndexed": len(stored_ids)}
+        self._save_checkpoint(file_id, state)
+        
+        blob_writer = self.text_blobs.writer(file_id)
+        seen_ids = set()
+        embedding_sum = None
+        batch = []
+        
+        def flush(batch):
+            nonlocal embedding_sum
+            with track_stage("upload", "index"):
+                embeddings = np.asarray(self._index_documents(file_id, batch), dtype=np.float32)
+            batch_sum = embeddings.sum(axis=0)
+            embedding_sum = batch_sum if embedding_sum is None else embedding_sum + batch_sum
+            CHUNKS.inc(len(batch), operation="indexed")
+            # The batch is committed, a resumed ingestion won't embed it again
+            state["batches"] += 1
+            state["chunksIndexed"] += len(batch)
+            self._save_checkpoint(file_id, state)
+            if progress is not None:
+                progress["chunksIndexed"] = len(seen_ids)
+                logger.info(
+                    f"Indexed {len(seen_ids)} chunks of {file_info['name']} "
+                    f"({progress['pagesRead']}/{progress['pages']} pages read)"
+                )
+        
+        try:
+            for record in records:
+                if progress is not None:
+                    progress["pagesRead"] = record.get("pages_read", progress["pagesRead"])
+                # The metadata keeps the chunk's offsets in the document text. Deduplication drops chunks, so these
+                # aren't positions in the blob, the writer only uses them to find the overlap with the previous chunk.
+                blob_writer.append(record["index"], record["text"], record.get("start"))
+                span = (record["start"], record["end"]) if record.get("start") is not None else None
+                vector_id = chunk_vector_id(file_id, record["index"], record["text"])
+                seen_ids.add(vector_id)
+                if vector_id in stored_ids:
+                    continue
+                batch.append(self._build_document(file_info, record["index"], record["text"], record.get("pages"), span))
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+            
+            if not seen_ids:
+                blob_writer.abort()
+                self._clear_checkpoint(file_id)
+                return 0
+            
+            stale_ids = stored_ids - seen_ids
+            if stale_ids:
+                # Left over from an interrupted ingestion that chunked the file differently
+                self.shard_for(file_id)._collection.delete(ids=list(stale_ids))
+            
+            # Metadata is only written once every batch is in, the chunk count is used by the query planner
+            blob_writer.commit()
+            if stored_ids:
+                self.file_summaries.set(file_id, FileSummaryIndex.summarize(self.get_file_chunks(file_id)["embeddings"]))
+            else:
+                self.file_summaries.set(file_id, FileSummaryIndex.summarize([embedding_sum / len(seen_ids)]))
+            file_info["status"] = "processed"
+            file_info["chunks"] = len(seen_ids)
+            self._save_file_metadata(file_info)
+            self._clear_checkpoint(file_id)
+            return len(seen_ids)
+        except Exception:
+            blob_writer.abort()
+            raise
+
+    def _checkpoint_file(self, file_id):
+        return os.path.join(self.checkpoint_path, f"{file_id}.json")
+
+    def _load_checkpoint(self, file_id):
+        try:
+            with open(self._checkpoint_file(file_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading ingestion checkpoint of {file_id}: {e}")
+            return None
+
+    def _save_checkpoint(self, file_id, checkpoint):
+        # Write and rename, so a crash never leaves a truncated checkpoint
+        path = self._checkpoint_file(file_id)
+        with open(path + ".tmp", "w") as f:
+            json.dump({**checkpoint, "updatedAt": time.time()}, f, default=str)
+        os.replace(path + ".tmp", path)
+
+    def _clear_checkpoint(self, file_id):
+        path = self._checkpoint_file(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def pending_ingestions(self):
+        """Checkpoints of the ingestions interrupted before their file metadata was saved"""
+        pending = []
+        for name in os.listdir(self.checkpoint_path):
+            if not name.endswith(".json"):
+                continue
+            file_id = name[:-len(".json")]
+            checkpoint = self._load_checkpoint(file_id)
+            if checkpoint and file_id not in self.file_metadata:
+                pending.append(checkpoint)
+            elif checkpoint:
+                self._clear_checkpoint(file_id)
+        return pending
+
+    def discard_ingestion(self, file_id):
+        """Remove everything an unfinished ingestion has written: vectors, text blob and checkpoint"""
+        try:
+            self.shard_for(file_id)._collection.delete(where={"file_id": file_id})
+        except Exception as e:
+            logger.error(f"Error removing partially indexed chunks of {file_id}: {e}")
+        self.text_blobs.remove(file_id)
+        self._clear_checkpoint(file_id)
+
+    def _cleanup_orphans(self, batch_size=5000):
+        """Startup pass: remove vectors whose file has neither metadata nor an ingestion checkpoint"""
+        active = set(self.file_metadata) | {
+            name[:-len(".json")] for name in os.listdir(self.checkpoint_path) if name.endswith(".json")
+        }
+        removed = 0
+        for shard_index, shard in enumerate(self.shards):
+            collection = shard._collection
+            orphan_files = set()
+            offset = 0
+            while True:
+                page = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    break
+                for metadata in page["metadatas"]:
+                    file_id = (metadata or {}).get("file_id")
+                    if file_id not in active:
+                        orphan_files.add(file_id)
+                offset += len(page["ids"])
+            for file_id in orphan_files - {None}:
+                ids = collection.get(where={"file_id": file_id}, include=[])["ids"]
+                if ids:
+                    collection.delete(ids=ids)
+                    removed += len(ids)
+                    logger.info(f"Shard {shard_index}: removed {len(ids)} orphaned chunks of {file_id}")
+        
+        for file_id in {name.split(".")[0] for name in os.listdir(self.text_blobs.blob_storage_path)} - active:
+            self.text_blobs.remove(file_id)
+        return removed
 
     def remove_file(self, file_id):
         try:
             # Delete all chunks with this file_id from vector store
-            self.db._collection.delete(
+            self.shard_for(file_id)._collection.delete(
                 where={"file_id": file_id}
             )
+            if self.migration_shards:
+                self.migration_shards[self.ring.shard_for(file_id)]._collection.delete(where={"file_id": file_id})
             
             # Remove metadata and pdf
+            content_hash = None
             if file_id in self.file_metadata:
                 file_path = self.file_metadata[file_id].get("path")
+                content_hash = self.file_metadata[file_id].get("content_hash")
                 del self.file_metadata[file_id]
                 self._save_metadata()
                 if file_path and os.path.exists(file_path):
                     os.remove(file_path)
             
+            # Cached partitioned pages, unless another stored file has the same content
+            if self.partition_cache and content_hash and not any(
+                info.get("content_hash") == content_hash for info in self.file_metadata.values()
+            ):
+                self.partition_cache.remove(content_hash)
+            
             # Remove from access log
             if file_id in self.access_log:
                 del self.access_log[file_id]
                 self._save_access_log()
             
+            if self.deduplicator:
+                self.deduplicator.remove_from_corpus(file_id)
+            self.embedding_cache.invalidate(file_id)
+            self._chunk_counts.pop(file_id, None)
+            self.text_blobs.remove(file_id)
+            self.file_summaries.remove(file_id)
+            self._clear_checkpoint(file_id)
+            
             return True
         except Exception as e:
             logger.error(f"Error removing file from vector DB: {e}")
@@ -327,46 +936,418 @@ class VectorStoreService:
                 for file_id in file_ids:
                     self._update_file_access(file_id)
             
-            # Filter by file_ids if provided
-            filter_dict = {}
-            if file_ids and len(file_ids) > 0:
-                filter_dict = {"file_id": {"$in": file_ids}}
-                logger.info(f"Using filter: {filter_dict}")
+            # Embed the query and search separately so both stages are timed on their own
+            # One model, collection and shards for the whole query, even if a migration switches them meanwhile
+            active = self._active
+            with track_stage("chat", "query_embedding"):
+                query_embedding = active.embeddings.embed_query(query_text)
             
-            # Perform similarity search
-            results = self.db.similarity_search(
-                query_text,
-                k=top_k,
-                filter=filter_dict if filter_dict else None
-            )
+            # Perform similarity search on the shards holding the selected files
+            with track_stage("chat", "vector_search"):
+                results = self._search(active, [query_embedding], top_k, file_ids)[0]
             
+            CHUNKS.inc(len(results), operation="retrieved")
             logger.info(f"Found {len(results)} results")
             
-            # Format results
-            formatted_results = []
-            for i, doc in enumerate(results):
-                # Assign decreasing relevance scores
-                relevance = 1.0 - (i * 0.1)
-                
-                # Debug each document's metadata
-                logger.debug(f"Document {i} metadata: {doc.metadata}")
-                
-                # Add file name from metadata or look it up
-                if "file_name" not in doc.metadata and "file_id" in doc.metadata:
-                    file_id = doc.metadata["file_id"]
-                    if file_id in self.file_metadata:
-                        doc.metadata["file_name"] = self.file_metadata[file_id].get("name", "Unknown Document")
-                
-                formatted_results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "relevance": relevance
-                })
+            with track_stage("chat", "expansion"):
+                results = self._expand_results(results)
             
-            return formatted_results
+            return self._format_results(results)
         except Exception as e:
             logger.error(f"Error querying vector DB: {e}")
             import traceback
             logger.error(traceback.format_exc())
             return []
+
+    def _format_results(self, results):
+        formatted_results = []
+        for i, doc in enumerate(results):
+            # Assign decreasing relevance scores
+            relevance = 1.0 - (i * 0.1)
+            
+            # Debug each document's metadata
+            logger.debug(f"Document {i} metadata: {doc.metadata}")
+            
+            # Add file name from metadata or look it up
+            if "file_name" not in doc.metadata and "file_id" in doc.metadata:
+                file_id = doc.metadata["file_id"]
+                if file_id in self.file_metadata:
+                    doc.metadata["file_name"] = self.file_metadata[file_id].get("name", "Unknown Document")
+            
+            formatted_results.append({
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "relevance": relevance
+            })
+        
+        return formatted_results
+
+    def query_batch(self, query_texts, file_ids=None, top_k=5):
+        """Query vector store for many queries, returns one result list per query (in order)"""
+        try:
+            logger.info(f"Batch querying {len(query_texts)} queries, file_ids: {file_ids}, top_k: {top_k}")
+            if not query_texts:
+                return []
+            
+            # Update access times for queried files
+            if file_ids:
+                for file_id in file_ids:
+                    self._update_file_access(file_id)
+            
+            # Embed all queries in one forward pass, the model is symmetric so this matches embed_query
+            active = self._active
+            with track_stage("batch", "query_embedding"):
+                query_embeddings = active.embeddings.embed_queries(query_texts)
+            
+            # Run all similarity searches together, one collection query per shard
+            with track_stage("batch", "vector_search"):
+                batch_results = self._search(active, query_embeddings, top_k, file_ids)
+            
+            all_results = []
+            for results in batch_results:
+                CHUNKS.inc(len(results), operation="retrieved")
+                with track_stage("batch", "expansion"):
+                    results = self._expand_results(results)
+                all_results.append(self._format_results(results))
+            
+            return all_results
+        except Exception as e:
+            logger.error(f"Error batch querying vector DB: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return [[] for _ in query_texts]
+
+    def _window_metadatas(self, file_id, conditions):
+        """Metadata of the chunks of a file matching extra where conditions, empty on error"""
+        try:
+            stored = self.shard_for(file_id)._collection.get(
+                where={"$and": [{"file_id": file_id}] + conditions}, include=["metadatas"]
+            )
+            return [metadata for metadata in stored["metadatas"] if metadata]
+        except Exception as e:
+            logger.error(f"Error reading chunk metadata of {file_id} for expansion: {e}")
+            return []
+
+    def _expand_results(self, results):
+        """Small-to-big: replace every hit by its context window, merging overlapping windows of the same file"""
+        if self.expansion_mode == "none" or not results:
+            return results
+        
+        # One window (first and last chunk ordinal) per hit that has a text blob
+        windows = {}  # file_id -> [[first, last, best rank, [ranks]], ...]
+        expanded = [None] * len(results)
+        for rank, doc in enumerate(results):
+            file_id = doc.metadata.get("file_id")
+            chunk_id = doc.metadata.get("chunk_id")
+            if file_id is None or chunk_id is None or not self.text_blobs.exists(file_id):
+                expanded[rank] = doc
+                continue
+            chunk_id = int(chunk_id)
+            first, last = chunk_id, chunk_id
+            if self.expansion_mode == "page":
+                # Only chunks with a contiguous page range have "page", a hit spanning pages far apart isn't expanded
+                if doc.metadata.get("page") is not None:
+                    page = doc.metadata["page"]
+                    page_end = doc.metadata.get("page_end", page)
+                    ordinals = [
+                        int(metadata["chunk_id"]) for metadata in self._window_metadatas(
+                            file_id, [{"page": {"$lte": page_end}}, {"page_end": {"$gte": page}}]
+                        ) if "chunk_id" in metadata
+                    ]
+                    if ordinals:
+                        first, last = min(ordinals + [chunk_id]), max(ordinals + [chunk_id])
+            else:
+                first = max(chunk_id - self.expansion_neighbors, 0)
+                last = min(chunk_id + self.expansion_neighbors, self.text_blobs.chunk_count(file_id) - 1)
+            if self.expansion_max_chunks and last - first + 1 > self.expansion_max_chunks:
+                # Keep the window around the hit
+                first = max(first, min(chunk_id - (self.expansion_max_chunks - 1) // 2, last - self.expansion_max_chunks + 1))
+                last = first + self.expansion_max_chunks - 1
+            windows.setdefault(file_id, []).append([first, max(last, chunk_id), rank, [rank]])
+        
+        for file_id, file_windows in windows.items():
+            # Merge windows that overlap or touch, the merged window takes the rank of its best hit
+            file_windows.sort()
+            merged = [file_windows[0]]
+            for window in file_windows[1:]:
+                current = merged[-1]
+                if window[0] <= current[1] + 1:
+                    current[1] = max(current[1], window[1])
+                    current[2] = min(current[2], window[2])
+                    current[3].extend(window[3])
+                else:
+                    merged.append(window)
+            
+            for first, last, best_rank, ranks in merged:
+                best = results[best_rank]
+                text = self.text_blobs.read_range(file_id, first, last)
+                if text is None:
+                    for rank in ranks:
+                        expanded[rank] = results[rank]
+                    continue
+                
+                metadata = dict(best.metadata)
+                metadata["chunk_window"] = [first, last]
+                metadata["matched_chunks"] = sorted(int(results[rank].metadata["chunk_id"]) for rank in ranks)
+                # Pages and character offsets of the whole window, from the stored chunk metadata
+                window_metadatas = self._window_metadatas(
+                    file_id, [{"chunk_id": {"$gte": first}}, {"chunk_id": {"$lte": last}}]
+                )
+                for key, pick in (("start", min), ("end", max)):
+                    values = [m[key] for m in window_metadatas if m.get(key) is not None]
+                    if values:
+                        metadata[key] = pick(values + ([metadata[key]] if metadata.get(key) is not None else []))
+                # The window's discrete pages, with a page range only when they are contiguous
+                pages = sorted(set(chunk_pages(metadata)).union(*(chunk_pages(m) for m in window_metadatas)))
+                metadata.pop("page", None)
+                metadata.pop("page_end", None)
+                if pages:
+                    metadata["pages"] = ",".join(str(page) for page in pages)
+                    if pages[-1] - pages[0] + 1 == len(pages):
+                        metadata["page"], metadata["page_end"] = pages[0], pages[-1]
+                
+                EXPANSION_CHARS.inc(sum(len(results[rank].page_content) for rank in ranks), kind="matched")
+                EXPANSION_CHARS.inc(len(text), kind="expanded")
+                expanded[best_rank] = Document(page_content=text, metadata=metadata)
+        
+        return [doc for doc in expanded if doc is not None]
+
+    def _search_shard(self, active, shard_index, query_embeddings, top_k, file_ids):
+        where = {"file_id": {"$in": file_ids}} if file_ids else None
+        raw_results = active.shards[shard_index]._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=top_k,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        # One list of (distance, Document) per query
+        return [
+            [
+                (distance, Document(page_content=self._document_text(text, metadata or {}), metadata=dict(metadata or {})))
+                for text, metadata, distance in zip(documents, metadatas, distances)
+            ]
+            for documents, metadatas, distances in zip(
+                raw_results["documents"], raw_results["metadatas"], raw_results["distances"]
+            )
+        ]
+
+    def _file_chunk_count(self, file_id):
+        count = self.embedding_cache.cached_size(file_id)
+        if count is None:
+            count = self.file_metadata.get(file_id, {}).get("chunks")
+        if count is None:
+            count = self._chunk_counts.get(file_id)
+        if count is None:
+            # Older metadata has no chunk count, count the ids once
+            ids = self.shard_for(file_id)._collection.get(where={"file_id": file_id}, include=[])["ids"]
+            count = self._chunk_counts[file_id] = len(ids)
+        return count
+
+    def _plan_shard_search(self, file_ids):
+        """Search function for one shard: exact scan when the filtered set is small enough, HNSW otherwise"""
+        if file_ids and self.exact_search_max_chunks:
+            try:
+                if sum(self._file_chunk_count(file_id) for file_id in file_ids) <= self.exact_search_max_chunks:
+                    QUERY_PLANS.inc(plan="exact")
+                    return self._search_shard_exact
+            except Exception as e:
+                logger.warning(f"Could not estimate the filtered set size, using HNSW: {e}")
+        QUERY_PLANS.inc(plan="hnsw")
+        return self._search_shard
+
+    def _search_shard_exact(self, active, shard_index, query_embeddings, top_k, file_ids):
+        shard = active.shards[shard_index]
+        entries = [
+            self.embedding_cache.get(
+                file_id, lambda file_id: self.get_file_chunks(file_id, shard=shard), active.cache_generation
+            )
+            for file_id in file_ids
+        ]
+        entries = [entry for entry in entries if len(entry)]
+        if not entries:
+            return [[] for _ in query_embeddings]
+        corpus = np.concatenate([entry.embeddings for entry in entries])
+        documents = [document for entry in entries for document in entry.documents]
+        metadatas = [metadata for entry in entries for metadata in entry.metadatas]
+        
+        # Same distance definition as the collection's HNSW index, so results merge with other shards
+        space = (shard._collection.metadata or {}).get("hnsw:space", "l2")
+        distances = pairwise_distances(corpus, np.asarray(query_embeddings, dtype=np.float32), space)
+        k = min(top_k, corpus.shape[0])
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        
+        results = []
+        for row, query_candidates in zip(distances, candidates):
+            order = query_candidates[np.argsort(row[query_candidates])]
+            # Copy the metadata, _format_results adds to it and the cache must stay untouched
+            results.append([
+                (float(row[i]), Document(page_content=documents[i], metadata=dict(metadatas[i] or {})))
+                for i in order
+            ])
+        return results
+
+    def _search(self, active, query_embeddings, top_k, file_ids=None):
+        """Search the chunks of the selected files (all files by default), one list of Documents per query"""
+        if not file_ids or not self.two_level_min_files or len(file_ids) < self.two_level_min_files:
+            return self._search_files(active, query_embeddings, top_k, file_ids)
+        
+        # Two-level: rank the selected files by summary vector, then search the chunks of the best files only.
+        # Every query gets its own file set, so batches are searched one query at a time.
+        results = []
+        for query_embedding in query_embeddings:
+            searched = self.file_summaries.rank(query_embedding, file_ids, max(self.two_level_top_files, 1))
+            TWO_LEVEL_FILES.inc(len(file_ids), kind="selected")
+            TWO_LEVEL_FILES.inc(len(searched), kind="searched")
+            results.append(self._search_files(active, [query_embedding], top_k, searched)[0])
+        return results
+
+    def _search_files(self, active, query_embeddings, top_k, file_ids=None):
+        """Fan the queries out to the relevant shards and merge the top_k results of each query by distance"""
+        if file_ids:
+            targets = self.ring.group_by_shard(file_ids)
+        else:
+            targets = {i: None for i in range(self.num_shards)}
+        plans = {shard_index: self._plan_shard_search(shard_file_ids) for shard_index, shard_file_ids in targets.items()}
+        
+        if len(targets) == 1:
+            shard_index, shard_file_ids = next(iter(targets.items()))
+            shard_results = [plans[shard_index](active, shard_index, query_embeddings, top_k, shard_file_ids)]
+        else:
+            futures = [
+                self._shard_executor.submit(
+                    plans[shard_index], active, shard_index, query_embeddings, top_k, shard_file_ids
+                )
+                for shard_index, shard_file_ids in targets.items()
+            ]
+            shard_results = [future.result() for future in futures]
+        
+        merged = []
+        for query_index in range(len(query_embeddings)):
+            hits = [hit for results in shard_results for hit in results[query_index]]
+            hits.sort(key=lambda hit: hit[0])
+            merged.append([doc for _, doc in hits[:top_k]])
+        return merged
+
+    def _existing_shard_indexes(self):
+        # Shards on disk, including ones beyond num_shards left over from a larger configuration
+        indexes = {0}
+        for name in os.listdir(self.vector_db_path):
+            match = re.fullmatch(r"shard_(\d+)", name)
+            if match and os.path.isdir(os.path.join(self.vector_db_path, name)):
+                indexes.add(int(match.group(1)))
+        return sorted(indexes)
+
+    def rebalance_shards(self, batch_size=1000):
+        """Move every file's vectors to the shard assigned by the hash ring. Meant to run offline after changing
+        the number of shards. Returns the number of chunks moved per file."""
+        moved = {}
+        shards = {i: (self.shards[i] if i < self.num_shards else self._open_shard(i)) for i in self._existing_shard_indexes()}
+        
+        for file_id in list(self.file_metadata.keys()):
+            target_index = self.ring.shard_for(file_id)
+            target = shards[target_index]._collection
+            for source_index, source_shard in shards.items():
+                if source_index == target_index:
+                    continue
+                source = source_shard._collection
+                while True:
+                    # Copy embeddings as they are, nothing is re-embedded
+                    chunk = source.get(
+                        where={"file_id": file_id},
+                        limit=batch_size,
+                        include=["embeddings", "documents", "metadatas"]
+                    )
+                    if not chunk["ids"]:
+                        break
+                    target.upsert(
+                        ids=chunk["ids"],
+                        embeddings=chunk["embeddings"],
+                        documents=chunk["documents"],
+                        metadatas=chunk["metadatas"]
+                    )
+                    source.delete(ids=chunk["ids"])
+                    moved[file_id] = moved.get(file_id, 0) + len(chunk["ids"])
+            if file_id in moved:
+                self.embedding_cache.invalidate(file_id)
+                logger.info(f"Moved {moved[file_id]} chunks of {file_id} to shard {target_index}")
+        
+        logger.info(f"Rebalanced {len(moved)} files over {self.num_shards} shard(s)")
+        return moved
+
+    def build_missing_summaries(self):
+        """Compute the summary vector of the files indexed before two-level retrieval, returns how many were built"""
+        built = 0
+        for file_id in list(self.file_metadata.keys()):
+            if self.file_summaries.has(file_id):
+                continue
+            vector = FileSummaryIndex.summarize(self.get_file_chunks(file_id)["embeddings"])
+            if vector is not None:
+                self.file_summaries.set(file_id, vector)
+                built += 1
+        logger.info(f"Built {built} missing file summary vectors")
+        return built
+
+    def get_file_chunks(self, file_id, batch_size=1000, shard=None):
+        """All stored chunks of a file: dict of ids, embeddings, documents and metadatas (sorted by chunk id)"""
+        collection = (shard or self.shard_for(file_id))._collection
+        chunks = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"file_id": file_id},
+                limit=batch_size,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"]
+            )
+            if not page["ids"]:
+                break
+            for key in chunks:
+                chunks[key].extend(page[key])
+            offset += len(page["ids"])
+        
+        order = sorted(range(len(chunks["ids"])), key=lambda i: (chunks["metadatas"][i] or {}).get("chunk_id", i))
+        chunks = {key: [values[i] for i in order] for key, values in chunks.items()}
+        chunks["documents"] = [
+            self._document_text(text, metadata or {}) for text, metadata in zip(chunks["documents"], chunks["metadatas"])
+        ]
+        return chunks
+
+    def load_file_chunks(self, file_info, chunks, last_access=None, batch_size=1000):
+        """Bulk load precomputed chunks and embeddings for a file, without running the embedding model"""
+        with self._ingestion_slot():
+            return self._load_file_chunks_unlocked(file_info, chunks, last_access, batch_size)
+
+    def _load_file_chunks_unlocked(self, file_info, chunks, last_access, batch_size):
+        file_id = file_info["id"]
+        collection = self.shard_for(file_id)._collection
+        
+        # Rebuild the text blob from the chunk texts, the document offsets in the metadata are kept as they are
+        blob_writer = self.text_blobs.writer(file_id)
+        metadatas = []
+        for i, (text, metadata) in enumerate(zip(chunks["documents"], chunks["metadatas"])):
+            metadata = dict(metadata or {})
+            metadata.pop("text", None)  # Preview of the old schema
+            metadata.pop("file_name", None)
+            ordinal = int(metadata.get("chunk_id", i))
+            metadata["chunk_id"] = ordinal
+            blob_writer.append(ordinal, text, metadata.get("start"))
+            metadatas.append(metadata)
+        blob_writer.commit()
+        self.file_summaries.set(file_id, FileSummaryIndex.summarize(chunks["embeddings"]))
+        
+        for start in range(0, len(chunks["ids"]), batch_size):
+            end = start + batch_size
+            collection.upsert(
+                ids=chunks["ids"][start:end],
+                embeddings=chunks["embeddings"][start:end],
+                metadatas=metadatas[start:end]
+            )
+        CHUNKS.inc(len(chunks["ids"]), operation="imported")
+        self.embedding_cache.invalidate(file_id)
+        self._chunk_counts.pop(file_id, None)
         
+        self._save_file_metadata(file_info)
+        if last_access is not None:
+            self.access_log[file_id] = last_access
+            self._save_access_log()
+        return len(chunks["ids"])
@@ -134,19 +134,53 @@ export const getUploadedFiles = async () => {
       return simulateGetFiles();
     }
     
-    const response = await fetch(`${API_BASE_URL}/files`);
+    // Follow the pagination cursors until we have every file
+    const files = [];
+    let cursor = null;
+    do {
+      const url = cursor
+        ? `${API_BASE_URL}/files?cursor=${encodeURIComponent(cursor)}`
+        : `${API_BASE_URL}/files`;
+      const page = await fetchFilesPage(url);
+      files.push(...page.files);
+      cursor = page.nextCursor;
+    } while (cursor);
     
-    if (!response.ok) {
-      throw new Error(`Failed to fetch files with status: ${response.status}`);
-    }
-    
-    return await response.json();
+    return files;
   } catch (error) {
     console.error('Error fetching files:', error);
     throw error;
   }
 };
 
+// Listing pages by URL, so polling can revalidate with If-None-Match and reuse the page on a 304
+const fileListCache = new Map();
+
+async function fetchFilesPage(url) {
+  const cached = fileListCache.get(url);
+  const response = await fetch(url, {
+    headers: cached ? { 'If-None-Match': cached.etag } : {}
+  });
+  
+  if (response.status === 304 && cached) {
+    return cached;
+  }
+  
+  if (!response.ok) {
+    throw new Error(`Failed to fetch files with status: ${response.status}`);
+  }
+  
+  const page = {
+    files: await response.json(),
+    etag: response.headers.get('ETag'),
+    nextCursor: response.headers.get('X-Next-Cursor')
+  };
+  if (page.etag) {
+    fileListCache.set(url, page);
+  }
+  return page;
+}
+
 
 function simulateGetFiles() {
   return Promise.resolve([]);